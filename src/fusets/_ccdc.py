@@ -0,0 +1,407 @@
+"""
+Native CCDC change detection of single band time series.
+
+All pixels of a block go through the CCDC procedure in lockstep: at every step, each pixel that is initializing a
+stable model or monitoring its model processes one observation, with array operations over the pixels. The harmonic
+models are ordinary least squares fits on per-pixel Gram matrices, which are updated with a single observation as the
+model window moves, instead of refitting the whole window.
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+from scipy.stats import chi2
+
+MEOW_SIZE = 12
+PEEK_SIZE = 6
+DAY_DELTA = 365
+AVG_DAYS_YR = 365.2425
+NUM_OBS_FACTOR = 3
+NUM_COEFFICIENTS = 8
+
+# pixels per lockstep pass, which keeps the per-pixel normal equations in the cache
+_BLOCK_SIZE = 1024
+
+_INITIALIZE, _MONITOR, _DONE = 0, 1, 2
+
+# lower bound of the residual scale, constant or noise-free series have neither noise nor residuals
+_MIN_SCALE = 1e-6
+
+
+def design_matrix(days):
+    """
+    Harmonic design matrix of CCDC for all coefficients: the intercept, the slope per year and the cosine and sine of
+    three harmonics with a period of one year, half a year and a third of a year. Models with 4 or 6 coefficients use
+    the leading columns.
+
+    Args:
+        days (ndarray): day offsets of the observations
+
+    Returns:
+        The design matrix with shape (days, 8)
+    """
+    years = np.asarray(days, dtype=np.float64) / AVG_DAYS_YR
+    angles = 2 * np.pi * years[:, None] * np.arange(1, 4)
+    harmonics = np.stack([np.cos(angles), np.sin(angles)], axis=-1).reshape(len(years), -1)
+    return np.column_stack([np.ones_like(years), years, harmonics])
+
+
+def thresholds(days):
+    """
+    The number of observations that have to deviate from a model to detect a change, adjusted for the observation
+    frequency like ``ccd``, and the matching change and outlier thresholds of the squared single band magnitude.
+
+    Args:
+        days (ndarray): day offsets of the time axis
+
+    Returns:
+        A tuple (peek_size, change_threshold, outlier_threshold)
+    """
+    peek_size = PEEK_SIZE
+    if len(days) > 1:
+        peek_size = max(PEEK_SIZE, int(np.round(PEEK_SIZE * 16 / (np.median(np.diff(days)) + 0.001))))
+    change_threshold = chi2.ppf(1 - 0.01 ** (PEEK_SIZE / peek_size), 1)
+    return peek_size, change_threshold, chi2.ppf(0.999999, 1)
+
+
+def variogram(days, values, count):
+    """
+    The median absolute difference between every observation and the first observation more than 30 days later, which
+    normalizes the residuals when the model fits the observations better than their noise level.
+
+    Args:
+        days (ndarray): day offsets of the valid observations, shape (pixels, time)
+        values (ndarray): the valid observations of every pixel first, shape (pixels, time)
+        count (ndarray): the number of valid observations of every pixel
+
+    Returns:
+        The variogram of every pixel, 0 for pixels without observations more than 30 days apart
+    """
+    npixels, ntimes = values.shape
+    valid = np.arange(ntimes) < count[:, None]
+
+    # search the rows of all pixels at once, padding each row with a day beyond the range of the later observations
+    size = int(days.max(initial=0)) + 64
+    keys = np.where(valid, days, size - 1) + size * np.arange(npixels)[:, None]
+    later = np.searchsorted(keys.ravel(), (keys + 30).ravel(), side="right").reshape(keys.shape)
+    later -= ntimes * np.arange(npixels)[:, None]
+
+    pairs = valid & (later < count[:, None])
+    differences = np.abs(np.take_along_axis(values, np.minimum(later, ntimes - 1), axis=1) - values)
+    differences[~pairs] = np.nan
+
+    result = np.zeros(npixels)
+    some = pairs.any(axis=1)
+    result[some] = np.nanmedian(differences[some], axis=1)
+    return result
+
+
+class Segment(NamedTuple):
+    """The harmonic model of the last segment of every pixel, NaN for pixels without a stable model."""
+
+    #: the coefficients of the model, zero for the unused harmonics, shape (pixels, 8)
+    coefficients: np.ndarray
+    #: the RMSE of the model
+    rmse: np.ndarray
+    #: the variogram of the observations
+    noise: np.ndarray
+    #: the first day of the segment, or where the initialization of a model continues for pixels without a model
+    start: np.ndarray
+    #: the last day of the model window, the last date that is known to be stable
+    end: np.ndarray
+
+
+def detect_breaks(pixels, dates, max_breaks):
+    """
+    Detect the breaks of a block of single band time series sharing the same date axis.
+
+    Args:
+        pixels (ndarray): observations with shape (pixels, time), NaN marks missing values
+        dates (ndarray): the day offsets of the time axis
+        max_breaks (int): the number of break days per pixel
+
+    Returns:
+        The break days of every pixel padded with NaN, with shape (pixels, max_breaks)
+    """
+    return fit_segments(pixels, dates, max_breaks)[0]
+
+
+def fit_segments(pixels, dates, max_breaks, limits=None):
+    """
+    Detect the breaks of a block of single band time series sharing the same date axis, and fit the model of the last
+    segment of every pixel.
+
+    Every pixel first initializes a model on a window of at least 12 observations spanning a year, shifting the window
+    until the model is stable. The window then grows one observation at a time, until the next observations all deviate
+    from the model, which is a break, and initialization restarts at the break. Single deviating observations are
+    outliers and are excluded. Deviations are normalized by the larger of the variogram and the RMSE of the model.
+
+    Args:
+        pixels (ndarray): observations with shape (pixels, time), NaN marks missing values
+        dates (ndarray): the day offsets of the time axis
+        max_breaks (int): the number of break days per pixel
+        limits (tuple): the peek size, change threshold and outlier threshold, defaults to the ``thresholds`` of the
+            dates
+
+    Returns:
+        A tuple (breaks, segment) of the break days of every pixel padded with NaN, with shape (pixels, max_breaks),
+        and the ``Segment`` with the model of the last segment of every pixel
+    """
+    if len(pixels) > _BLOCK_SIZE:
+        blocks = [
+            fit_segments(pixels[i : i + _BLOCK_SIZE], dates, max_breaks, limits)
+            for i in range(0, len(pixels), _BLOCK_SIZE)
+        ]
+        return np.concatenate([b[0] for b in blocks]), Segment(*map(np.concatenate, zip(*[b[1] for b in blocks])))
+
+    npixels, ntimes = pixels.shape
+    valid = ~np.isnan(pixels)
+    count = valid.sum(axis=1)
+
+    # the valid observations of every pixel first, in time order
+    order = np.argsort(~valid, axis=1, kind="stable")
+    values = np.take_along_axis(pixels, order, axis=1)
+    days = np.asarray(dates)[order]
+    design = design_matrix(dates)
+
+    peek_size, change_threshold, outlier_threshold = thresholds(dates) if limits is None else limits
+    noise = variogram(days, values, count)
+
+    phase = np.where(count >= MEOW_SIZE + peek_size, _INITIALIZE, _DONE)
+    start = np.zeros(npixels, dtype=np.int64)
+    stop = np.zeros(npixels, dtype=np.int64)
+    gram = np.zeros((npixels, NUM_COEFFICIENTS, NUM_COEFFICIENTS))
+    xty = np.zeros((npixels, NUM_COEFFICIENTS))
+    yty = np.zeros(npixels)
+    nobs = np.zeros(npixels, dtype=np.int64)
+    breaks = np.full((npixels, max_breaks), np.nan)
+    nbreaks = np.zeros(npixels, dtype=np.int64)
+    monitored = np.zeros(npixels, dtype=bool)
+
+    def update(members, position, sign=1):
+        # add (or remove) the observation at the given position to the fit of each member
+        x = design[order[members, position]]
+        y = values[members, position]
+        gram[members] += sign * x[:, :, None] * x[:, None, :]
+        xty[members] += sign * x * y[:, None]
+        yty[members] += sign * y**2
+        nobs[members] += sign
+
+    def residuals(members, coefficients, positions):
+        x = design[order[members[:, None], positions]]
+        return values[members[:, None], positions] - np.einsum("npk,nk->np", x, coefficients)
+
+    while True:
+        initializing = np.flatnonzero(phase == _INITIALIZE)
+        monitoring = np.flatnonzero(phase == _MONITOR)
+        if len(initializing) == 0 and len(monitoring) == 0:
+            break
+
+        # initialization, a model needs observations beyond its window to be monitored
+        remaining = stop[initializing] + peek_size <= count[initializing]
+        phase[initializing[~remaining]] = _DONE
+        members = initializing[remaining]
+
+        first, last = start[members], np.maximum(stop[members] - 1, 0)
+        span = days[members, last] - days[members, first]
+        grow = (stop[members] - first < MEOW_SIZE) | (span < DAY_DELTA)
+        update(members[grow], stop[members[grow]])
+        stop[members[grow]] += 1
+
+        members, first, last, span = members[~grow], first[~grow], last[~grow], span[~grow]
+        coefficients, rmse = _fit(gram[members], xty[members], yty[members], nobs[members], 4)
+        ends = np.abs(residuals(members, coefficients, np.column_stack([first, last]))).sum(axis=1)
+        check = (np.abs(coefficients[:, 1] * span / AVG_DAYS_YR) + ends) / _scale(noise[members], rmse)
+        stable = check**2 < change_threshold
+        phase[members[stable]] = _MONITOR
+
+        # an unstable model may contain a disturbance, the window shifts forward
+        shift = members[~stable]
+        update(shift, start[shift], sign=-1)
+        start[shift] += 1
+        update(shift, stop[shift])
+        stop[shift] += 1
+
+        # monitoring, the model is compared with the next observations and grows until they deviate
+        remaining = stop[monitoring] + peek_size <= count[monitoring]
+        phase[monitoring[~remaining]] = _DONE
+        monitored[monitoring[~remaining]] = True
+        members = monitoring[remaining]
+
+        coefficients, rmse = _fit(
+            gram[members], xty[members], yty[members], nobs[members], _num_coefficients(nobs[members])
+        )
+        peek = residuals(members, coefficients, stop[members, None] + np.arange(peek_size))
+        magnitude = (peek / _scale(noise[members], rmse)[:, None]) ** 2
+
+        change = magnitude.min(axis=1) > change_threshold
+        outlier = ~change & (magnitude[:, 0] > outlier_threshold)
+
+        changed = members[change]
+        recorded = changed[nbreaks[changed] < max_breaks]
+        breaks[recorded, nbreaks[recorded]] = days[recorded, stop[recorded]]
+        nbreaks[changed] += 1
+        start[changed] = stop[changed]
+        gram[changed], xty[changed], yty[changed], nobs[changed] = 0, 0, 0, 0
+        phase[changed] = _INITIALIZE
+
+        stop[members[outlier]] += 1
+        extend = members[~change & ~outlier]
+        update(extend, stop[extend])
+        stop[extend] += 1
+
+    # the models of the pixels that were monitored until the end of their series
+    members = np.flatnonzero(monitored)
+    segment = Segment(
+        np.full((npixels, NUM_COEFFICIENTS), np.nan),
+        np.full(npixels, np.nan),
+        noise,
+        np.full(npixels, np.nan),
+        np.full(npixels, np.nan),
+    )
+    segment.coefficients[members], segment.rmse[members] = _fit(
+        gram[members], xty[members], yty[members], nobs[members], _num_coefficients(nobs[members])
+    )
+    some = count > 0
+    segment.start[some] = days[some, np.minimum(start[some], count[some] - 1)]
+    segment.end[members] = days[members, stop[members] - 1]
+    return breaks, segment
+
+
+def _num_coefficients(nobs):
+    """The number of coefficients of a model, 4, 6 or 8 depending on the number of observations like ``ccd``."""
+    return np.select([nobs < 6 * NUM_OBS_FACTOR, nobs < 8 * NUM_OBS_FACTOR], [4, 6], 8)
+
+
+def _fit(gram, xty, yty, nobs, ncoefficients):
+    """
+    Least squares fits of a batch of harmonic models from their normal equations.
+
+    Args:
+        gram (ndarray): X'X of every model, shape (models, 8, 8)
+        xty (ndarray): X'y of every model, shape (models, 8)
+        yty (ndarray): y'y of every model
+        nobs (ndarray): the number of observations of every model
+        ncoefficients (ndarray): the number of coefficients of every model, 4, 6 or 8
+
+    Returns:
+        A tuple (coefficients, rmse), the coefficients of the unused harmonics are 0
+    """
+    ncoefficients = np.broadcast_to(ncoefficients, nobs.shape)
+    coefficients = np.zeros(xty.shape)
+    for size in (4, 6, 8):
+        members = ncoefficients == size
+        if not members.any():
+            continue
+        coefficients[members, :size] = np.linalg.solve(gram[members, :size, :size], xty[members, :size, None])[..., 0]
+
+    sse = (
+        yty - 2 * np.einsum("nk,nk->n", coefficients, xty) + np.einsum("nk,nkl,nl->n", coefficients, gram, coefficients)
+    )
+    rmse = np.sqrt(np.maximum(sse, 0) / np.maximum(nobs - ncoefficients, 1))
+    return coefficients, rmse
+
+
+def _scale(noise, rmse):
+    """The scale of the residuals of a model: the largest of the noise of the series and the error of the model."""
+    return np.fmax(np.fmax(noise, rmse), _MIN_SCALE)
+
+
+class MonitorState(NamedTuple):
+    """The monitoring state of every pixel, the models are NaN for pixels without a stable model."""
+
+    #: the coefficients of the model, zero for the unused harmonics, shape (pixels, 8)
+    coefficients: np.ndarray
+    #: the RMSE of the model
+    rmse: np.ndarray
+    #: the variogram of the observations
+    noise: np.ndarray
+    #: the first day of the model, or from where a model will be initialized for pixels without a model
+    start: np.ndarray
+    #: the last date that is known to be stable
+    end: np.ndarray
+    #: the number of consecutive observations after the last stable date that deviate from the model
+    pending: np.ndarray
+    #: the day of the first of the pending observations
+    pending_start: np.ndarray
+    #: the day of the last break
+    last_break: np.ndarray
+
+    @staticmethod
+    def empty(npixels):
+        """The state of pixels without models, which are initialized from the start of their series."""
+        return MonitorState(
+            np.full((npixels, NUM_COEFFICIENTS), np.nan, dtype=np.float32),
+            *(np.full(npixels, np.nan, dtype=np.float32) for _ in range(2)),
+            np.zeros(npixels, dtype=np.float32),
+            np.full(npixels, np.nan, dtype=np.float32),
+            np.zeros(npixels, dtype=np.int16),
+            *(np.full(npixels, np.nan, dtype=np.float32) for _ in range(2)),
+        )
+
+
+def monitor(state, day, values, peek_size, change_threshold):
+    """
+    Evaluate the change statistic of a new acquisition for all pixels with a model, updating the state in place.
+
+    The models are not updated with the new observations. A break is confirmed when ``peek_size`` consecutive
+    observations deviate from the model, at the first of them, after which the pixel has no model until it is refitted
+    with ``fit_segments`` on its observations since the break.
+
+    Args:
+        state (MonitorState): the state of every pixel
+        day (int): the day offset of the acquisition
+        values (ndarray): the observation of every pixel, NaN marks missing values
+        peek_size (int): the number of consecutive deviating observations of a break
+        change_threshold (double): the threshold of the squared normalized residual of a deviating observation
+
+    Returns:
+        Boolean mask of the pixels that broke
+    """
+    evaluated = ~np.isnan(values) & (day > state.end)
+    predicted = state.coefficients.astype(np.float64) @ design_matrix([day])[0]
+    with np.errstate(invalid="ignore"):
+        magnitude = ((values - predicted) / _scale(state.noise, state.rmse)) ** 2
+
+    deviates = evaluated & (magnitude > change_threshold)
+    state.pending_start[deviates & (state.pending == 0)] = day
+    state.pending[deviates] += 1
+
+    stable = evaluated & ~deviates
+    state.pending[stable] = 0
+    state.end[stable] = day
+
+    broke = deviates & (state.pending >= peek_size)
+    state.last_break[broke] = state.pending_start[broke]
+    state.start[broke] = state.pending_start[broke]
+    state.coefficients[broke], state.rmse[broke], state.end[broke] = np.nan, np.nan, np.nan
+    state.pending[broke], state.pending_start[broke] = 0, np.nan
+    return broke
+
+
+def refit(state, members, days, series, limits):
+    """
+    Fit the models of the given pixels on their observations since the start in their state, updating the state in
+    place, and evaluate the observations after the model windows, which are too few to confirm a break.
+
+    Args:
+        state (MonitorState): the state of every pixel
+        members (ndarray): the indices of the pixels to refit
+        days (ndarray): the day offsets of the time axis of the series
+        series (ndarray): the observations of the pixels, shape (members, time)
+        limits (tuple): the peek size, change threshold and outlier threshold
+    """
+    series = np.where(days >= state.start[members, None], series, np.nan)
+    breaks, segment = fit_segments(series, days, len(days) // MEOW_SIZE + 1, limits)
+
+    state.coefficients[members], state.rmse[members], state.noise[members] = segment[:3]
+    state.start[members] = np.where(np.isnan(segment.start), state.start[members], segment.start)
+    state.end[members] = segment.end
+    state.pending[members], state.pending_start[members] = 0, np.nan
+    state.last_break[members] = np.fmax(state.last_break[members], np.fmax.reduce(breaks, axis=1))
+
+    values = np.full(len(state.end), np.nan)
+    later = days > np.fmin.reduce(segment.end, initial=np.inf)
+    for day, column in zip(days[later], series[:, later].T):
+        values[members] = column
+        monitor(state, day, values, *limits[:2])
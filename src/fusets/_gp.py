@@ -0,0 +1,820 @@
+"""
+Multi-output gaussian-process regression with a linear model of coregionalization (LCM), implemented in numpy.
+
+The model mirrors the ``GPy.models.GPCoregionalizedRegression`` model with an LCM of rank-1 Matérn 3/2 kernels that is
+trained by :func:`fusets.mogpr.mogpr_1D`, but works on stacked arrays of pixels sharing the same time axis. Pixels
+with the same observation mask share the kernel matrix, so it is built and factorized once per mask.
+
+Hyperparameters are trained like GPy does: L-BFGS on the log marginal likelihood, with the positive parameters
+optimized through the softplus transformation.
+"""
+
+from functools import partial
+from typing import NamedTuple
+
+import numpy as np
+from scipy.linalg import cho_solve, cholesky, solve_triangular
+from scipy.optimize import minimize
+from scipy.special import expit
+
+_SQRT3 = np.sqrt(3.0)
+_MIN_SOFTPLUS = -36.0
+# the sparse model divides by the noise variances, which therefore need a lower bound
+_MIN_SPARSE_NOISE = 1e-6
+# relative tolerance of the likelihood at which random restarts are compared
+_SCREENING_TOL = 1e-5
+
+
+class LCMParameters(NamedTuple):
+    """
+    Hyperparameters of a linear model of coregionalization with Q Matérn 3/2 kernels and O outputs.
+
+    The coregionalization matrix of kernel q is ``B[q] = W[q] W[q]^T + diag(kappa[q])``.
+
+    The hyperparameters of several models can be stacked along a leading axis, e.g. for the starting points of an
+    optimization.
+
+    Attributes:
+        variance: Variance of each Matérn kernel, shape (Q,)
+        lengthscale: Lengthscale of each Matérn kernel in days, shape (Q,)
+        W: Rank-1 coregionalization weights, shape (Q, O)
+        kappa: Diagonal coregionalization terms, shape (Q, O)
+        noise: Gaussian noise variance of each output, shape (O,)
+    """
+
+    variance: np.ndarray
+    lengthscale: np.ndarray
+    W: np.ndarray
+    kappa: np.ndarray
+    noise: np.ndarray
+
+    @property
+    def noutputs(self) -> int:
+        return self.noise.shape[-1]
+
+    @property
+    def B(self) -> np.ndarray:
+        """The coregionalization matrices, shape (Q, O, O)."""
+        return self.W[..., :, np.newaxis] * self.W[..., np.newaxis, :] + self.kappa[..., :, np.newaxis] * np.eye(
+            self.noutputs
+        )
+
+    @classmethod
+    def from_gpy(cls, model) -> "LCMParameters":
+        """
+        Extract the hyperparameters of a trained ``GPCoregionalizedRegression`` model with an LCM kernel.
+
+        Args:
+            model: GPy model as returned by :func:`fusets.mogpr.mogpr_1D`
+
+        Returns: The hyperparameters of the model.
+        """
+        noutputs = len(model.mixed_noise.parameters)
+        return cls.from_vector(np.array(model.param_array, dtype=np.float64), noutputs)
+
+    @classmethod
+    def default(cls, noutputs: int, seed=None) -> "LCMParameters":
+        """
+        The initial hyperparameters used by GPy, one kernel per output with random coregionalization weights.
+
+        Args:
+            noutputs: The number of outputs
+            seed: Seed for the random coregionalization weights
+
+        Returns: The initial hyperparameters.
+        """
+        rng = np.random.default_rng(seed)
+        return cls(
+            variance=np.ones(noutputs),
+            lengthscale=np.ones(noutputs),
+            W=0.5 * rng.standard_normal((noutputs, noutputs)),
+            kappa=np.full((noutputs, noutputs), 0.5),
+            noise=np.ones(noutputs),
+        )
+
+    def as_initial(self, minimum: float = 1e-3) -> "LCMParameters":
+        """
+        Equivalent hyperparameters to start an optimization from, e.g. to warm start from the solution of a neighbour.
+
+        The kernel variances are moved into the coregionalization matrices, which leaves the model unchanged but stops
+        the scale of both from drifting apart over a chain of warm starts. Positive hyperparameters are lifted from the
+        boundary, where the gradient of the softplus transformation vanishes.
+
+        Args:
+            minimum: The minimum value of the positive hyperparameters
+
+        Returns: The initial hyperparameters.
+        """
+        return LCMParameters(
+            variance=np.ones_like(self.variance),
+            lengthscale=np.maximum(self.lengthscale, minimum),
+            W=self.W * np.sqrt(self.variance)[:, np.newaxis],
+            kappa=np.maximum(self.kappa * self.variance[:, np.newaxis], minimum),
+            noise=np.maximum(self.noise, minimum),
+        )
+
+    def to_vector(self) -> np.ndarray:
+        """Flatten the hyperparameters in the order of the GPy ``param_array``."""
+        kernels = np.column_stack([self.variance, self.lengthscale, self.W, self.kappa])
+        return np.concatenate([kernels.ravel(), self.noise])
+
+    @classmethod
+    def from_vector(cls, values, noutputs: int) -> "LCMParameters":
+        """Inverse of :meth:`to_vector`, vectors stacked along leading axes give stacked hyperparameters."""
+        kernels = values[..., :-noutputs].reshape(values.shape[:-1] + (-1, 2 + 2 * noutputs))
+        return cls(
+            kernels[..., 0],
+            kernels[..., 1],
+            kernels[..., 2 : 2 + noutputs],
+            kernels[..., 2 + noutputs :],
+            values[..., -noutputs:],
+        )
+
+
+def _matern32(r, lengthscale):
+    """Matérn 3/2 correlation and its derivative to the lengthscale."""
+    # the correlation vanishes long before the exponent underflows, clipping avoids overflows for tiny lengthscales
+    a = np.minimum(_SQRT3 * r / lengthscale, 700.0)
+    e = np.exp(-a)
+    return (1 + a) * e, a**2 * e / lengthscale
+
+
+def covariance(params: LCMParameters, x1, o1, x2, o2) -> np.ndarray:
+    """
+    Evaluate the LCM covariance between two sets of (time, output) inputs, excluding the observation noise.
+
+    Args:
+        params: The model hyperparameters
+        x1 (array): Times of the first set of inputs
+        o1 (array): Output indices of the first set of inputs
+        x2 (array): Times of the second set of inputs
+        o2 (array): Output indices of the second set of inputs
+
+    Returns: Covariance matrix of shape (len(x1), len(x2)).
+    """
+    r = np.abs(np.subtract.outer(x1, x2))
+    B = params.B
+    K = np.zeros(r.shape)
+    for q in range(len(params.variance)):
+        K += params.variance[q] * _matern32(r, params.lengthscale[q])[0] * B[q][np.ix_(o1, o2)]
+    return K
+
+
+class TimeGrid(NamedTuple):
+    """
+    Distances in days between the dates of the time axis, and between the time axis and the output dates.
+
+    They only depend on the time axes, so they are computed once and shared by all pixels.
+
+    Attributes:
+        observed: Distances between the dates of the time axis, shape (T, T)
+        cross: Distances between the dates of the time axis and the output dates, shape (T, N)
+    """
+
+    observed: np.ndarray
+    cross: np.ndarray
+
+    @classmethod
+    def from_times(cls, times, output_times) -> "TimeGrid":
+        times = np.asarray(times, dtype=np.float64)
+        return cls(np.abs(np.subtract.outer(times, times)), np.abs(np.subtract.outer(times, output_times)))
+
+
+def _kron_covariance(params: LCMParameters, r) -> np.ndarray:
+    """
+    The LCM covariance between the stacked inputs of two time axes shared by all outputs, given their distances.
+
+    Stacked inputs are output-major, so the covariance is a sum of Kronecker products of the coregionalization matrices
+    and the Matérn correlations, which are only evaluated once per kernel instead of once per pair of outputs.
+    """
+    B = params.B
+    return sum(np.kron(B[q], params.variance[q] * _matern32(r, params.lengthscale[q])[0]) for q in range(len(B)))
+
+
+def stacked_inputs(times, noutputs):
+    """
+    Stack a time axis shared by all outputs into the (time, output index) inputs of the multi-output model.
+
+    Args:
+        times (array): The time axis, shape (T,)
+        noutputs (int): The number of outputs O
+
+    Returns: A tuple (x, o) of arrays with shape (O * T,), output-major.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    return np.tile(times, noutputs), np.repeat(np.arange(noutputs), len(times))
+
+
+def normalize(values):
+    """
+    Normalize every output of every pixel to zero mean and unit standard deviation, ignoring missing values.
+
+    Args:
+        values (array): Observations with shape (pixels, outputs, time), NaN for missing values
+
+    Returns: A tuple (normalized, mean, std), the mean and standard deviation have shape (pixels, outputs) and are NaN
+    for outputs without observations.
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        count = np.sum(~np.isnan(values), axis=-1)
+        mean = np.nansum(values, axis=-1) / count
+        std = np.sqrt(np.nansum((values - mean[..., np.newaxis]) ** 2, axis=-1) / count)
+    std[std == 0] = 1.0
+    return (values - mean[..., np.newaxis]) / std[..., np.newaxis], mean, std
+
+
+def mask_groups(valid):
+    """
+    Group pixels by their observation mask.
+
+    Args:
+        valid (array): Boolean observation masks with shape (pixels, observations)
+
+    Returns: A tuple (masks, index) with the unique masks, shape (groups, observations), and the group of each pixel.
+    """
+    _, first, index = np.unique(np.packbits(valid, axis=-1), axis=0, return_index=True, return_inverse=True)
+    return valid[first], index.ravel()
+
+
+class MaskPlan:
+    """
+    Plan of a block of pixels, grouped by their observation mask over all outputs.
+
+    Pixels of the same group share the inputs of the gaussian process, and therefore its kernel matrix and
+    factorization for given hyperparameters.
+
+    Attributes:
+        masks: The observation mask of every group, shape (groups, outputs * T)
+        index: The group of every pixel, shape (pixels,)
+        members: The indices of the pixels of every group
+    """
+
+    def __init__(self, values):
+        """
+        Args:
+            values (array): Observations with shape (pixels, outputs, T), NaN for missing values
+        """
+        self.masks, self.index = mask_groups(~np.isnan(values.reshape(len(values), -1)))
+        order = np.argsort(self.index, kind="stable")
+        self.members = np.split(order, np.cumsum(np.bincount(self.index, minlength=len(self.masks)))[:-1])
+
+    def __len__(self):
+        return len(self.masks)
+
+    def __iter__(self):
+        return zip(self.masks, self.members)
+
+
+def _cholesky(K):
+    """Lower Cholesky factor, adding increasing jitter to the diagonal if ``K`` is numerically not positive definite."""
+    jitter = 0.0
+    for _ in range(6):
+        try:
+            return cholesky(K + jitter * np.eye(len(K)), lower=True, check_finite=False)
+        except np.linalg.LinAlgError:
+            jitter = 1e-6 * np.mean(np.diag(K)) if jitter == 0 else jitter * 10
+    raise np.linalg.LinAlgError("Covariance matrix is not positive definite, even with jitter")
+
+
+def log_likelihood(params: LCMParameters, times, values) -> np.ndarray:
+    """
+    Log marginal likelihood of every pixel under the model.
+
+    Args:
+        params: The model hyperparameters
+        times (array): The time axis shared by all outputs, shape (T,)
+        values (array): Normalized observations with shape (pixels, outputs, T), NaN for missing values
+
+    Returns: The log marginal likelihood of every pixel, shape (pixels,).
+    """
+    npixels, noutputs, _ = values.shape
+    x, o = stacked_inputs(times, noutputs)
+    y = values.reshape(npixels, -1)
+
+    result = np.zeros(npixels)
+    for mask, members in MaskPlan(values):
+        if not mask.any():
+            continue
+        K = covariance(params, x[mask], o[mask], x[mask], o[mask]) + np.diag(params.noise[o[mask]])
+        L = _cholesky(K)
+        alpha = solve_triangular(L, y[members][:, mask].T, lower=True, check_finite=False)
+        result[members] = (
+            -0.5 * np.sum(alpha**2, axis=0) - np.sum(np.log(np.diag(L))) - 0.5 * mask.sum() * np.log(2 * np.pi)
+        )
+    return result
+
+
+def predict(params: LCMParameters, times, values, output_times, inducing=None, grid: "TimeGrid" = None):
+    """
+    Predictive mean and variance of every output at the output times, for every pixel.
+
+    The kernel matrix is factorized once per unique observation mask and solved for all pixels of that mask at once.
+    Like ``GPy``, the predictive variance includes the observation noise.
+
+    Args:
+        params: The model hyperparameters
+        times (array): The time axis shared by all outputs, shape (T,)
+        values (array): Normalized observations with shape (pixels, outputs, T), NaN for missing values
+        output_times (array): The times to predict, shape (N,)
+        inducing (array): Times of the inducing points of a sparse model, shared by all outputs, or None for the exact
+            model
+        grid: The distances between the time axes, if they are shared by multiple calls
+
+    Returns: A tuple (mean, variance) of arrays with shape (pixels, outputs, N).
+    """
+    if inducing is not None:
+        return _sparse_predict(params, times, values, output_times, inducing)
+
+    npixels, noutputs, _ = values.shape
+    _, o = stacked_inputs(times, noutputs)
+    _, onew = stacked_inputs(output_times, noutputs)
+    y = values.reshape(npixels, -1)
+    if grid is None:
+        grid = TimeGrid.from_times(times, output_times)
+
+    # the covariances of all outputs at once, the same for all pixels, masks select their rows and columns
+    Kxx = _kron_covariance(params, grid.observed)
+    Kx = _kron_covariance(params, grid.cross)
+    prior = np.einsum("q,qoo->o", params.variance, params.B)[onew] + params.noise[onew]
+
+    mean = np.zeros((npixels, len(onew)))
+    variance = np.zeros((npixels, len(onew)))
+    for mask, members in MaskPlan(values):
+        if not mask.any():
+            variance[members] = prior
+            continue
+        L = _cholesky(Kxx[np.ix_(mask, mask)] + np.diag(params.noise[o[mask]]))
+        alpha = cho_solve((L, True), y[members][:, mask].T, check_finite=False)
+        v = solve_triangular(L, Kx[mask], lower=True, check_finite=False)
+        mean[members] = (Kx[mask].T @ alpha).T
+        variance[members] = prior - np.sum(v**2, axis=0)
+
+    shape = (npixels, noutputs, len(output_times))
+    return mean.reshape(shape), variance.reshape(shape)
+
+
+def _sparse_predict(params: LCMParameters, times, values, output_times, inducing):
+    """Predictive mean and variance of the sparse model with inducing points, see :func:`predict`."""
+    npixels, noutputs, _ = values.shape
+    x, o = stacked_inputs(times, noutputs)
+    xnew, onew = stacked_inputs(output_times, noutputs)
+    z, oz = stacked_inputs(inducing, noutputs)
+    y = values.reshape(npixels, -1)
+
+    # covariances with the inducing points are shared by all pixels, whitened by the inducing covariance
+    Lz = _inducing_cholesky(params, z, oz)
+    Vx = solve_triangular(Lz, covariance(params, z, oz, x, o), lower=True, check_finite=False)
+    Vs = solve_triangular(Lz, covariance(params, z, oz, xnew, onew), lower=True, check_finite=False)
+    prior = np.einsum("q,qoo->o", params.variance, params.B)[onew] + params.noise[onew]
+    # the part of the prior variance that is not explained by the inducing points
+    residual = prior - np.sum(Vs**2, axis=0)
+
+    mean = np.zeros((npixels, len(onew)))
+    variance = np.zeros((npixels, len(onew)))
+    for mask, members in MaskPlan(values):
+        if not mask.any():
+            variance[members] = prior
+            continue
+        Vl = Vx[:, mask] / params.noise[o[mask]]
+        LB = _cholesky(np.eye(len(z)) + Vl @ Vx[:, mask].T)
+        mean[members] = (Vs.T @ cho_solve((LB, True), Vl @ y[members][:, mask].T, check_finite=False)).T
+        variance[members] = residual + np.sum(solve_triangular(LB, Vs, lower=True, check_finite=False) ** 2, axis=0)
+
+    shape = (npixels, noutputs, len(output_times))
+    return mean.reshape(shape), variance.reshape(shape)
+
+
+def _inducing_cholesky(params: LCMParameters, z, oz):
+    """
+    Cholesky factor of the covariance of the inducing points. The coregionalization matrices are often nearly singular,
+    so a small jitter relative to the diagonal is always added.
+    """
+    Kzz = covariance(params, z, oz, z, oz)
+    return _cholesky(Kzz + 1e-6 * np.mean(np.diag(Kzz)) * np.eye(len(z)))
+
+
+def _log_likelihood_gradient(params: LCMParameters, x, o, y):
+    """
+    Summed log marginal likelihood of pixels sharing the inputs ``(x, o)`` and its gradient.
+
+    Args:
+        params: The model hyperparameters
+        x (array): Observation times, shape (n,)
+        o (array): Observation output indices, shape (n,)
+        y (array): Normalized observations, shape (n, pixels)
+
+    Returns: A tuple (log likelihood, gradient) with the gradient laid out like :meth:`LCMParameters.to_vector`.
+    """
+    n, npixels = y.shape
+    r = np.abs(np.subtract.outer(x, x))
+    onehot = o[:, np.newaxis] == np.arange(params.noutputs)
+    B = params.B
+
+    correlations = [_matern32(r, lengthscale) for lengthscale in params.lengthscale]
+    K = np.diag(params.noise[o])
+    for q, (C, _) in enumerate(correlations):
+        K += params.variance[q] * C * B[q][np.ix_(o, o)]
+
+    L = _cholesky(K)
+    alpha = cho_solve((L, True), y, check_finite=False)
+    log_likelihood = (
+        -0.5 * np.sum(y * alpha) - npixels * np.sum(np.log(np.diag(L))) - 0.5 * n * npixels * np.log(2 * np.pi)
+    )
+
+    # dL/dK = (alpha alpha^T - P K^-1) / 2
+    dK = 0.5 * (alpha @ alpha.T - npixels * cho_solve((L, True), np.eye(n), check_finite=False))
+
+    gradient = np.concatenate([_covariance_gradient(params, o, o, dK, correlations), onehot.T @ np.diag(dK)])
+    return log_likelihood, gradient
+
+
+def _stacked_log_likelihood_gradient(params: LCMParameters, x, o, y):
+    """
+    Like :func:`_log_likelihood_gradient`, for hyperparameters stacked along a leading axis.
+
+    The kernel matrices of all models are built, factorized and differentiated together, with batched array operations.
+
+    Args:
+        params: The stacked hyperparameters of R models
+        x (array): Observation times, shape (n,)
+        o (array): Observation output indices, shape (n,)
+        y (array): Normalized observations, shape (n, pixels)
+
+    Returns: A tuple (log likelihood, gradient) of arrays with shapes (R,) and (R, parameters), -inf and zeros for
+    models of which the kernel matrix is numerically not positive definite.
+    """
+    n, npixels = y.shape
+    r = np.abs(np.subtract.outer(x, x))
+    onehot = o[:, np.newaxis] == np.arange(params.noutputs)
+    variance = params.variance[..., np.newaxis, np.newaxis]
+
+    # shape (R, Q, n, n)
+    C, dC = _matern32(r, params.lengthscale[..., np.newaxis, np.newaxis])
+    Bo = params.B[..., o[:, np.newaxis], o]
+    K = np.sum(variance * C * Bo, axis=1) + params.noise[:, o][..., np.newaxis] * np.eye(n)
+
+    try:
+        L = np.linalg.cholesky(K)
+        failed = np.zeros(len(K), dtype=bool)
+    except np.linalg.LinAlgError:
+        L, failed = np.empty_like(K), np.zeros(len(K), dtype=bool)
+        for i, Ki in enumerate(K):
+            try:
+                L[i] = _cholesky(Ki)
+            except np.linalg.LinAlgError:
+                L[i], failed[i] = np.eye(n), True
+
+    K_inv = np.stack([cho_solve((Li, True), np.eye(n), check_finite=False) for Li in L])
+    alpha = K_inv @ y
+    log_likelihood = (
+        -0.5 * np.sum(y * alpha, axis=(-2, -1))
+        - npixels * np.sum(np.log(np.diagonal(L, axis1=-2, axis2=-1)), axis=-1)
+        - 0.5 * n * npixels * np.log(2 * np.pi)
+    )
+
+    # dL/dK = (alpha alpha^T - P K^-1) / 2, see _covariance_gradient for the kernel hyperparameters
+    dK = (0.5 * (alpha @ np.swapaxes(alpha, -1, -2) - npixels * K_inv))[:, np.newaxis]
+    dB = onehot.T @ (dK * variance * C) @ onehot
+    kernels = np.concatenate(
+        [
+            np.sum(dK * C * Bo, axis=(-2, -1))[..., np.newaxis],
+            np.sum(dK * variance * dC * Bo, axis=(-2, -1))[..., np.newaxis],
+            ((dB + np.swapaxes(dB, -1, -2)) @ params.W[..., np.newaxis])[..., 0],
+            np.diagonal(dB, axis1=-2, axis2=-1),
+        ],
+        axis=-1,
+    )
+    gradient = np.concatenate(
+        [kernels.reshape(len(K), -1), np.diagonal(dK[:, 0], axis1=-2, axis2=-1) @ onehot], axis=-1
+    )
+    log_likelihood[failed], gradient[failed] = -np.inf, 0.0
+    return log_likelihood, gradient
+
+
+def _covariance_gradient(params: LCMParameters, o1, o2, dK, correlations):
+    """
+    Gradient of ``sum(dK * K)`` to the kernel hyperparameters, with K the covariance between two sets of inputs.
+
+    Args:
+        params: The model hyperparameters
+        o1 (array): Output indices of the first set of inputs
+        o2 (array): Output indices of the second set of inputs
+        dK (array): Weights of the covariance entries, shape (len(o1), len(o2))
+        correlations (list): The Matérn correlations between the inputs and their lengthscale derivatives, per kernel
+
+    Returns: The gradient, laid out like :meth:`LCMParameters.to_vector` without the noise.
+    """
+    onehot1 = o1[:, np.newaxis] == np.arange(params.noutputs)
+    onehot2 = o2[:, np.newaxis] == np.arange(params.noutputs)
+    B = params.B
+
+    kernels = []
+    for q, (C, dC) in enumerate(correlations):
+        Bq = B[q][np.ix_(o1, o2)]
+        # gradient to the coregionalization matrix, aggregated over the inputs of every output pair
+        dB = onehot1.T @ (dK * params.variance[q] * C) @ onehot2
+        kernels.append(
+            np.concatenate(
+                [
+                    [np.sum(dK * C * Bq), np.sum(dK * params.variance[q] * dC * Bq)],
+                    (dB + dB.T) @ params.W[q],
+                    np.diag(dB),
+                ]
+            )
+        )
+    return np.concatenate(kernels)
+
+
+def _sparse_log_likelihood_gradient(params: LCMParameters, x, o, y, z, oz):
+    """
+    Variational lower bound of the summed log marginal likelihood (Titsias, 2009) with inducing inputs ``(z, oz)``,
+    and its gradient.
+
+    With n observations and m inducing inputs, the cost is O(n m^2) instead of O(n^3).
+
+    Args:
+        params: The model hyperparameters
+        x (array): Observation times, shape (n,)
+        o (array): Observation output indices, shape (n,)
+        y (array): Normalized observations, shape (n, pixels)
+        z (array): Inducing times, shape (m,)
+        oz (array): Inducing output indices, shape (m,)
+
+    Returns: A tuple (bound, gradient) with the gradient laid out like :meth:`LCMParameters.to_vector`.
+    """
+    n, npixels = y.shape
+    m = len(z)
+    onehot = o[:, np.newaxis] == np.arange(params.noutputs)
+    noise = params.noise[o]
+
+    corr_mn = [_matern32(np.abs(np.subtract.outer(z, x)), lengthscale) for lengthscale in params.lengthscale]
+    corr_mm = [_matern32(np.abs(np.subtract.outer(z, z)), lengthscale) for lengthscale in params.lengthscale]
+    B = params.B
+    Kmn = sum(params.variance[q] * C * B[q][np.ix_(oz, o)] for q, (C, _) in enumerate(corr_mn))
+    kdiag = np.einsum("q,qoo->o", params.variance, B)[o]
+
+    # whitened with Kmm = Lm Lm^T, S = V^T V + diag(noise) is inverted through the m x m matrix I + V diag(noise)^-1 V^T
+    Lm = _inducing_cholesky(params, z, oz)
+    V = solve_triangular(Lm, Kmn, lower=True, check_finite=False)
+    P = solve_triangular(Lm.T, V, lower=False, check_finite=False)
+    Vl = V / noise
+    LB = _cholesky(np.eye(m) + Vl @ V.T)
+    ly = y / noise[:, np.newaxis]
+    alpha = ly - Vl.T @ cho_solve((LB, True), V @ ly, check_finite=False)
+    trace = kdiag - np.sum(V**2, axis=0)
+
+    log_det = 2 * np.sum(np.log(np.diag(LB))) + np.sum(np.log(noise))
+    bound = (
+        -0.5 * np.sum(y * alpha)
+        - 0.5 * npixels * log_det
+        - 0.5 * n * npixels * np.log(2 * np.pi)
+        - 0.5 * npixels * np.sum(trace / noise)
+    )
+
+    # weights of the covariance entries in the gradient, with G = alpha alpha^T - P S^-1 + P diag(noise)^-1
+    GPt = alpha @ (alpha.T @ P.T) + npixels * Vl.T @ cho_solve((LB, True), Vl @ P.T, check_finite=False)
+    dKmn = GPt.T
+    dKmm = -0.5 * P @ GPt
+    dkdiag = onehot.T @ (-0.5 * npixels / noise)
+    S_inv_diag = 1 / noise - np.sum(solve_triangular(LB, Vl, lower=True, check_finite=False) ** 2, axis=0)
+    dnoise = 0.5 * (np.sum(alpha**2, axis=1) - npixels * S_inv_diag) + 0.5 * npixels * trace / noise**2
+
+    diagonal = [
+        np.concatenate(
+            [[dkdiag @ np.diag(B[q]), 0.0], 2 * params.variance[q] * dkdiag * params.W[q], params.variance[q] * dkdiag]
+        )
+        for q in range(len(params.variance))
+    ]
+    gradient = np.concatenate(
+        [
+            _covariance_gradient(params, oz, o, dKmn, corr_mn)
+            + _covariance_gradient(params, oz, oz, dKmm, corr_mm)
+            + np.concatenate(diagonal),
+            onehot.T @ dnoise,
+        ]
+    )
+    return bound, gradient
+
+
+def _positive(params: LCMParameters) -> np.ndarray:
+    """Mask of the hyperparameters in :meth:`LCMParameters.to_vector` that are constrained to be positive."""
+    noutputs = params.noutputs
+    kernel = np.concatenate([[True, True], np.zeros(noutputs, dtype=bool), np.ones(noutputs, dtype=bool)])
+    return np.concatenate([np.tile(kernel, len(params.variance)), np.ones(noutputs, dtype=bool)])
+
+
+def _minimize_stacked(objective, starts, lower, max_iters: int = 1000, tol: float = None, memory: int = 10):
+    """
+    Minimize a function from several starting points at once with L-BFGS, projected on lower bounds.
+
+    The optimizations advance in lockstep, so that every step of the backtracking line search evaluates the function
+    for all starting points that did not converge yet in a single stacked call.
+
+    Args:
+        objective: Function of points stacked along the first axis, returning the function values and gradients
+        starts (array): The starting points, shape (R, parameters)
+        lower (array): The lower bound of every parameter, -inf for unbounded parameters
+        max_iters: The maximum number of iterations per starting point
+        tol: The relative change of the function value and the gradient below which an optimization stops, defaults to
+            the tolerances of the scipy L-BFGS-B optimizer
+        memory: The number of corrections that approximate the inverse Hessian
+
+    Returns: A tuple (points, values, iterations) with the solution, function value and number of iterations of every
+    starting point.
+    """
+    ftol, gtol = (2.220446049250313e-09, 1e-5) if tol is None else (tol, tol)
+    x = np.maximum(starts, lower)
+    f, g = objective(x)
+    nstarts, size = x.shape
+    s, y, rho = np.zeros((nstarts, memory, size)), np.zeros((nstarts, memory, size)), np.zeros((nstarts, memory))
+    iterations = np.zeros(nstarts, dtype=int)
+    active = np.isfinite(f)
+
+    for _ in range(max_iters):
+        # parameters at their bound with a gradient pointing outwards stay fixed
+        free = (x > lower) | (g < 0)
+        active &= np.max(np.abs(np.where(free, g, 0.0)), axis=1) > gtol
+        (rows,) = np.nonzero(active)
+        if len(rows) == 0:
+            break
+
+        # two-loop recursion, the corrections are ordered from old to new and unused corrections have rho = 0
+        q = np.where(free[rows], g[rows], 0.0)
+        alphas = np.zeros((len(rows), memory))
+        for i in reversed(range(memory)):
+            alphas[:, i] = rho[rows, i] * np.sum(s[rows, i] * q, axis=1)
+            q -= alphas[:, i, np.newaxis] * y[rows, i]
+        yy = np.sum(y[rows, -1] ** 2, axis=1)
+        q *= np.where(yy > 0, np.sum(s[rows, -1] * y[rows, -1], axis=1) / np.where(yy > 0, yy, 1.0), 1.0)[:, np.newaxis]
+        for i in range(memory):
+            beta = rho[rows, i] * np.sum(y[rows, i] * q, axis=1)
+            q += (alphas[:, i] - beta)[:, np.newaxis] * s[rows, i]
+        direction = np.where(free[rows], -q, 0.0)
+
+        # fall back to the gradient where the direction does not descend, the first step is scaled like scipy does
+        steepest = np.sum(direction * g[rows], axis=1) >= 0
+        direction[steepest] = -np.where(free[rows[steepest]], g[rows[steepest]], 0.0)
+        step = np.where(iterations[rows] == 0, np.minimum(1.0, 1.0 / np.linalg.norm(direction, axis=1)), 1.0)
+
+        # backtracking line search with the Armijo condition
+        pending = np.arange(len(rows))
+        x_new, f_new, g_new = x[rows], f[rows], g[rows]
+        accepted = np.zeros(len(rows), dtype=bool)
+        for _ in range(30):
+            trial = np.maximum(x[rows[pending]] + step[pending, np.newaxis] * direction[pending], lower)
+            f_trial, g_trial = objective(trial)
+            decrease = np.sum(g[rows[pending]] * (trial - x[rows[pending]]), axis=1)
+            ok = f_trial <= f[rows[pending]] + 1e-4 * decrease
+            x_new[pending[ok]], f_new[pending[ok]], g_new[pending[ok]] = trial[ok], f_trial[ok], g_trial[ok]
+            accepted[pending[ok]] = True
+            step[pending[~ok]] *= 0.5
+            pending = pending[~ok]
+            if len(pending) == 0:
+                break
+
+        # an optimization of which the line search fails stops at its last point
+        active[rows[~accepted]] = False
+        rows, x_new, f_new, g_new = rows[accepted], x_new[accepted], f_new[accepted], g_new[accepted]
+        dx, dg = x_new - x[rows], g_new - g[rows]
+        curvature = np.sum(dx * dg, axis=1)
+        positive = curvature > 1e-10
+        update = rows[positive]
+        s[update] = np.concatenate([s[update, 1:], dx[positive, np.newaxis]], axis=1)
+        y[update] = np.concatenate([y[update, 1:], dg[positive, np.newaxis]], axis=1)
+        rho[update] = np.column_stack([rho[update, 1:], 1.0 / curvature[positive]])
+
+        change = (f[rows] - f_new) / np.maximum(np.maximum(np.abs(f[rows]), np.abs(f_new)), 1.0)
+        active[rows[change <= ftol]] = False
+        x[rows], f[rows], g[rows] = x_new, f_new, g_new
+        iterations[rows] += 1
+
+    return x, f, iterations
+
+
+def optimize(
+    times,
+    values,
+    initial: LCMParameters = None,
+    max_iters: int = 1000,
+    seed=0,
+    restarts: int = 1,
+    inducing=None,
+    tol=None,
+):
+    """
+    Train the hyperparameters shared by a set of pixels by maximizing their summed likelihood.
+
+    Pixels with the same observation mask share the kernel matrix, so the likelihood is evaluated once per mask.
+
+    With multiple restarts, the additional optimizations start from random hyperparameters, drawn like GPy's
+    ``randomize`` does, and the solution with the best likelihood is kept. The random starting points are optimized at
+    once to a loose tolerance, by a projected L-BFGS that evaluates the likelihood of all of them in a single stacked
+    call, and only the best of them is refined.
+
+    Args:
+        times (array): The time axis shared by all outputs, shape (T,)
+        values (array): Normalized observations with shape (pixels, outputs, T), NaN for missing values
+        initial: The hyperparameters to start from, defaults to the GPy initialization
+        max_iters: The maximum number of L-BFGS iterations
+        seed: Seed for the random initializations
+        restarts: The number of optimizations from different starting points
+        inducing (array): Times of the inducing points, shared by all outputs, to maximize the variational lower bound
+            of the likelihood of the sparse model instead of the exact likelihood
+        tol: The relative change of the likelihood and the gradient below which the optimization stops, defaults to
+            the tolerance of the scipy L-BFGS-B optimizer
+
+    Returns: A tuple (params, log_likelihood, iterations) with the trained hyperparameters and the total number of
+    iterations.
+    """
+    npixels, noutputs, _ = values.shape
+    x, o = stacked_inputs(times, noutputs)
+    y = values.reshape(npixels, -1)
+    groups = [(x[mask], o[mask], y[members][:, mask].T) for mask, members in MaskPlan(values) if np.any(mask)]
+    if len(groups) == 0:
+        raise ValueError("The pixels have no observations to train on")
+
+    if inducing is None:
+        likelihood = partial(_sum_groups, _log_likelihood_gradient, groups)
+        stacked_likelihood = partial(_sum_groups, _stacked_log_likelihood_gradient, groups)
+    else:
+        z, oz = stacked_inputs(inducing, noutputs)
+        likelihood = partial(_sum_groups, partial(_sparse_log_likelihood_gradient, z=z, oz=oz), groups)
+        stacked_likelihood = partial(_stack_likelihoods, likelihood)
+
+    rng = np.random.default_rng(seed)
+    if initial is None:
+        initial = LCMParameters.default(noutputs, rng)
+        if inducing is not None and len(inducing) > 1:
+            # inducing points only explain variations on scales beyond their spacing
+            spacing = np.median(np.diff(inducing))
+            initial = initial._replace(lengthscale=np.maximum(initial.lengthscale, spacing))
+    positive = _positive(initial)
+
+    # softplus transformation of the positive hyperparameters, bounded like the Logexp transformation of GPy
+    lower = np.where(positive, _MIN_SOFTPLUS, -np.inf)
+    if inducing is not None:
+        lower[-noutputs:] = np.log(np.expm1(_MIN_SPARSE_NOISE))
+    bounds = [(bound if np.isfinite(bound) else None, None) for bound in lower]
+
+    def objective(theta):
+        values = theta.copy()
+        values[positive] = np.logaddexp(0, theta[positive])
+        try:
+            log_likelihood, gradient = likelihood(LCMParameters.from_vector(values, noutputs))
+        except np.linalg.LinAlgError:
+            return np.inf, np.zeros_like(theta)
+        gradient[positive] *= expit(theta[positive])
+        return -log_likelihood, -gradient
+
+    def stacked_objective(thetas):
+        values = thetas.copy()
+        values[:, positive] = np.logaddexp(0, thetas[:, positive])
+        log_likelihood, gradient = stacked_likelihood(LCMParameters.from_vector(values, noutputs))
+        gradient[:, positive] *= expit(thetas[:, positive])
+        return -log_likelihood, -gradient
+
+    theta = initial.to_vector()
+    # inverse of the softplus transformation, x + log(1 - exp(-x)) does not overflow for large hyperparameters
+    theta[positive] += np.log(-np.expm1(-np.maximum(theta[positive], 1e-300)))
+
+    def refine(theta):
+        return minimize(
+            objective, theta, jac=True, method="L-BFGS-B", bounds=bounds, tol=tol, options=dict(maxiter=max_iters)
+        )
+
+    best = refine(np.maximum(theta, lower))
+    iterations = best.nit
+    if restarts > 1:
+        # the random starting points are screened at once with a loose tolerance, which is enough to tell which one
+        # ends up closest to the best optimum, and only that one is refined
+        starts = rng.standard_normal((restarts - 1, len(theta)))
+        thetas, objectives, screened = _minimize_stacked(stacked_objective, starts, lower, max_iters, _SCREENING_TOL)
+        iterations += int(np.sum(screened))
+        if np.min(objectives) < best.fun:
+            result = refine(thetas[np.argmin(objectives)])
+            iterations += result.nit
+            best = min(best, result, key=lambda result: result.fun)
+    theta = best.x
+
+    values = theta.copy()
+    values[positive] = np.logaddexp(0, theta[positive])
+    return LCMParameters.from_vector(values, noutputs), -best.fun, iterations
+
+
+def _sum_groups(likelihood, groups, params: LCMParameters):
+    """Sum a likelihood and its gradient over groups of pixels, given as (x, o, y) inputs with their own mask."""
+    results = [likelihood(params, x=x, o=o, y=y) for x, o, y in groups]
+    return sum(result[0] for result in results), sum(result[1] for result in results)
+
+
+def _stack_likelihoods(likelihood, params: LCMParameters):
+    """Evaluate a likelihood and its gradient for every model of stacked hyperparameters, one model at a time."""
+    results = []
+    for i in range(len(params.noise)):
+        model = LCMParameters(*(field[i] for field in params))
+        try:
+            results.append(likelihood(model))
+        except np.linalg.LinAlgError:
+            results.append((-np.inf, np.zeros(len(model.to_vector()))))
+    log_likelihood, gradient = zip(*results)
+    return np.array(log_likelihood), np.array(gradient)
@@ -0,0 +1,216 @@
+"""
+Compiled kernels of the per-pixel time series algorithms, for use with ``numba``.
+
+The kernels run the sequential algorithm of every pixel in parallel over a (pixel, time) array. Without ``numba``, the
+kernels remain importable as plain Python functions, but the algorithms dispatch to their array implementations.
+"""
+
+import importlib.util
+import warnings
+
+import numpy as np
+
+numba_exists = importlib.util.find_spec("numba") is not None
+if numba_exists:
+    from numba import njit, prange
+else:
+    prange = range
+
+    def njit(*args, **kwargs):
+        return lambda function: function
+
+
+_DAY = np.int64(86400 * 10**9)
+
+
+@njit(cache=True)
+def _find_peaks(values, n, sign):
+    # scipy.signal.find_peaks without conditions, the maximum of a flat plateau is its middle position
+    peaks = np.empty(max(n, 1), dtype=np.int64)
+    count = 0
+    i = 1
+    while i < n - 1:
+        if sign * values[i - 1] < sign * values[i]:
+            ahead = i + 1
+            while ahead < n - 1 and values[ahead] == values[i]:
+                ahead += 1
+            if sign * values[ahead] < sign * values[i]:
+                peaks[count] = (i + ahead - 1) // 2
+                count += 1
+                i = ahead
+        i += 1
+    return peaks[:count]
+
+
+@njit(cache=True, error_model="numpy")
+def _slope(times, feature, idx1, idx2):
+    return (feature[idx1] - feature[idx2]) / ((times[idx1] - times[idx2]) // _DAY)
+
+
+@njit(cache=True, error_model="numpy")
+def _peakvalley_series(times, values, drop_thr, rec_thr, slope_thr, result):
+    valid = np.flatnonzero(~np.isnan(values))
+    feature = values[valid]
+    timestamps = times[valid]
+    n = len(feature)
+
+    # find peaks and valleys in trend
+    pk_ids = _find_peaks(feature, n, 1)
+    vl_ids = _find_peaks(feature, n, -1)
+    if len(pk_ids) == 0 or len(vl_ids) == 0:
+        return
+
+    # if first valley before peak, add initial peak
+    if vl_ids[0] < pk_ids[0]:
+        pk_ids = np.concatenate((np.zeros(1, dtype=np.int64), pk_ids))
+
+    # if last valley before last peak, add final valley
+    if vl_ids[-1] < pk_ids[-1]:
+        vl_ids = np.concatenate((vl_ids, np.full(1, n - 1, dtype=np.int64)))
+
+    # merge fluctuations when dropping
+    pks = np.empty(len(pk_ids), dtype=np.int64)
+    vls = np.empty(len(pk_ids), dtype=np.int64)
+    pks[0], vls[0] = pk_ids[0], vl_ids[0]
+    npairs = 1
+    for idx in range(1, len(pk_ids)):
+        pk2, vl2 = pk_ids[idx], vl_ids[idx]
+        y11, y12 = feature[pks[npairs - 1]], feature[vls[npairs - 1]]
+        y21, y22 = feature[pk2], feature[vl2]
+        if (y21 - y12 < rec_thr) and (y22 < y12) and (y21 < y11):
+            vls[npairs - 1] = vl2
+        else:
+            pks[npairs], vls[npairs] = pk2, vl2
+            npairs += 1
+
+    # apply filter on merged
+    count = 0
+    for idx in range(npairs):
+        if -(feature[vls[idx]] - feature[pks[idx]]) > drop_thr:
+            pks[count], vls[count] = pks[idx], vls[idx]
+            count += 1
+    npairs = count
+
+    # select eligible events
+    for p_id in range(npairs):
+        pk, vl = pks[p_id], vls[p_id]
+        assigned_peak = False
+        skip_next = False
+        start = pk
+
+        # fix marker start
+        for idx in range(vl - 1, pk - 1, -1):
+            if skip_next:
+                skip_next = False
+                continue
+
+            if feature[idx] - feature[vl] > drop_thr and not assigned_peak:
+                start = idx
+                assigned_peak = True
+                continue
+
+            if assigned_peak:
+                if _slope(timestamps, feature, idx + 1, idx) < slope_thr:
+                    start = idx
+                elif idx - 1 >= pk and _slope(timestamps, feature, idx + 1, idx - 1) < slope_thr:
+                    start = idx - 1
+                    skip_next = True
+                else:
+                    break
+
+        # find marker end
+        eligible = False
+        next_pk = pks[p_id + 1] + 1 if p_id + 1 < npairs else n
+        for idx in range(vl, next_pk):
+            if feature[idx] - feature[vl] > rec_thr:
+                eligible = True
+                break
+            if feature[idx] < feature[vl]:
+                vl = idx
+
+        if not eligible:
+            continue
+
+        s, e = valid[start], valid[vl]
+        result[s + 1 : e] = 0
+        result[s] = 1
+        result[e] = -1
+
+
+@njit(parallel=True, cache=True)
+def peakvalley_mask(times, values, drop_thr, rec_thr, slope_thr):
+    """
+    Peak-valley mask of every row of a (pixel, time) array.
+
+    Args:
+        times: timestamps of the time axis, as int64 nanoseconds
+        values: array of input feature values, shape (pixels, time)
+        drop_thr: threshold value for the amplitude of the drop, of the same dtype as the values
+        rec_thr: threshold value for the amplitude of the recovery, of the same dtype as the values
+        slope_thr: threshold value for the slope where the peak should start
+
+    Returns:
+        array with different values {1: peak, -1: valley, 0: between peak and valley, np.nan: other}
+    """
+    result = np.full(values.shape, np.nan, dtype=values.dtype)
+    for pixel in prange(values.shape[0]):
+        _peakvalley_series(times, values[pixel], drop_thr, rec_thr, slope_thr, result[pixel])
+    return result
+
+
+@njit(parallel=True, cache=True, error_model="numpy")
+def temporal_outliers(values, start, end, min_periods, threshold):
+    """
+    Replace the outliers of every row of a (pixel, time) array by their rolling mean.
+
+    Args:
+        values: array of input feature values, shape (pixels, time)
+        start: first position of the rolling window of every date
+        end: position after the last position of the rolling window of every date
+        min_periods: minimum number of valid observations in a window
+        threshold: the threshold to be applied on the z-scores
+
+    Returns:
+        float32 array with outliers replaced by the rolling mean
+    """
+    result = np.empty(values.shape, dtype=np.float32)
+    for pixel in prange(values.shape[0]):
+        series = values[pixel]
+        for i in range(len(series)):
+            count = 0
+            total = 0.0
+            low, high = np.inf, -np.inf
+            for j in range(start[i], end[i]):
+                if not np.isnan(series[j]):
+                    count += 1
+                    total += series[j]
+                    low, high = min(low, series[j]), max(high, series[j])
+
+            mean, std = np.nan, np.nan
+            if count >= max(min_periods, 1):
+                # like pandas, a window of identical values has exactly their value as mean and no deviation
+                mean = low if low == high else total / count
+            if count >= max(min_periods, 2):
+                squares = 0.0
+                for j in range(start[i], end[i]):
+                    if not np.isnan(series[j]):
+                        squares += (series[j] - mean) ** 2
+                std = 0.0 if low == high else np.sqrt(squares / (count - 1))
+
+            zscore = (series[i] - mean) / std
+            result[pixel, i] = series[i] if -threshold <= zscore <= threshold else mean
+    return result
+
+
+def use_numba(backend: str) -> bool:
+    """
+    Whether an algorithm should run its compiled kernel for the given backend, "numpy" or "numba".
+
+    Falls back to the numpy implementation with a warning when numba is requested but not installed.
+    """
+    if backend not in ("numpy", "numba"):
+        raise ValueError(f"Unknown backend '{backend}', expected 'numpy' or 'numba'.")
+    if backend == "numba" and not numba_exists:
+        warnings.warn("numba is not installed, falling back to the numpy implementation.", RuntimeWarning)
+        return False
+    return backend == "numba"
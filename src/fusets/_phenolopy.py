@@ -28,6 +28,7 @@ Lewis Trotter: lewis.trotter@postgrad.curtin.edu.au
 
 # import required libraries
 import os, sys
+import warnings
 from collections import Counter
 import xarray as xr
 import numpy as np
@@ -38,6 +39,8 @@ from scipy.stats import zscore
 from scipy.signal import savgol_filter, find_peaks
 from scipy.ndimage import gaussian_filter
 
+from fusets._xarray_utils import _rechunk_time
+
 # from statsmodels.tsa.seasonal import STL as stl
 
 
@@ -2113,7 +2116,7 @@ def get_lios(da, da_sos_times, da_eos_times):
 
     # calculate lios using trapz (note: more sophisticated than integrate)
     da_lios_values = xr.apply_ufunc(
-        np.trapz,
+        np.trapezoid,
         da_lios_values,
         input_core_dims=[["time"]],
         dask="parallelized",
@@ -2172,7 +2175,7 @@ def get_sios(da, da_sos_times, da_eos_times, da_base_values):
 
     # calculate sios using trapz (note: more sophisticated than integrate)
     da_sios_values = xr.apply_ufunc(
-        np.trapz,
+        np.trapezoid,
         da_sios_values,
         input_core_dims=[["time"]],
         dask="parallelized",
@@ -2191,7 +2194,7 @@ def get_sios(da, da_sos_times, da_eos_times, da_base_values):
 
     # calculate trapz of base (note: more sophisticated than integrate)
     da_sios_bse_values = xr.apply_ufunc(
-        np.trapz,
+        np.trapezoid,
         da_sios_bse_values,
         input_core_dims=[["time"]],
         dask="parallelized",
@@ -2239,7 +2242,7 @@ def get_liot(da):
     # calculate liot using trapz (note: more sophisticated than integrate)
     print("> Calculating long integral of total (liot) values.")
     da_liot_values = xr.apply_ufunc(
-        np.trapz, da, input_core_dims=[["time"]], dask="parallelized", output_dtypes=[np.float32], kwargs={"dx": 1}
+        np.trapezoid, da, input_core_dims=[["time"]], dask="parallelized", output_dtypes=[np.float32], kwargs={"dx": 1}
     )
 
     # convert type
@@ -2283,7 +2286,7 @@ def get_siot(da, da_base_values):
     # calculate siot using trapz (note: more sophisticated than integrate)
     print("> Calculating short integral of total (siot) values.")
     da_siot_values = xr.apply_ufunc(
-        np.trapz, da, input_core_dims=[["time"]], dask="parallelized", output_dtypes=[np.float32], kwargs={"dx": 1}
+        np.trapezoid, da, input_core_dims=[["time"]], dask="parallelized", output_dtypes=[np.float32], kwargs={"dx": 1}
     )
 
     # combine 2d base vals with 3d da, projecting const base val to pixel timeseries (i.e. a rectangle)
@@ -2291,7 +2294,7 @@ def get_siot(da, da_base_values):
 
     # calculate trapz of base (note: more sophisticated than integrate)
     da_siot_bse_values = xr.apply_ufunc(
-        np.trapz,
+        np.trapezoid,
         da_siot_bse_values,
         input_core_dims=[["time"]],
         dask="parallelized",
@@ -2314,87 +2317,56 @@ def get_siot(da, da_base_values):
     return da_siot_values
 
 
-def calc_phenometrics(
-    da, peak_metric="pos", base_metric="bse", method="first_of_slope", factor=0.5, thresh_sides="two_sided", abs_value=0
-):
+# names of the phenometrics, in the order of the dataset variables
+_PHENOMETRICS = [
+    "pos_values",
+    "pos_times",
+    "mos_values",
+    "vos_values",
+    "vos_times",
+    "bse_values",
+    "aos_values",
+    "sos_values",
+    "sos_times",
+    "eos_values",
+    "eos_times",
+    "los_values",
+    "roi_values",
+    "rod_values",
+    "lios_values",
+    "sios_values",
+    "liot_values",
+    "siot_values",
+]
+
+# phenometrics holding a day of year or a number of days
+_PHENOMETRIC_DAYS = ["pos_times", "vos_times", "sos_times", "eos_times", "los_values"]
+
+# sos/eos methods of the fused engine
+_FUSED_METHODS = ["first_of_slope", "median_of_slope", "seasonal_amplitude", "absolute_value", "relative_value"]
+
+# number of pixels processed at once by the fused engine, bounds the memory of the intermediate arrays
+_PIXEL_BLOCK_SIZE = 4096
+
+
+def _get_phenometrics_stepwise(da, peak_metric, base_metric, method, factor, abs_value):
     """
-    Takes an xarray DataArray containing veg_index values and calculates numerous phenometrics
-    (metrics that measure various aspects of plant phenoly or lifecycle). See the information
-    within each metric method (e.g. get_pos) for a description of each.
+    Calculates the phenometrics with the chain of get_* functions, one function per metric.
 
     Parameters
     ----------
     da: xarray DataArray
         A two-dimensional or multi-dimensional array containing an DataArray of veg_index
-        and time values.
-    peak_metric: str
-        Sets the highest value for each pixel timeseries to use for calculations that rely on
-        the highest value. Can be either pos (peak of season), which is the single highest
-        value in the whole timeseries per pixel, or mos (middle of season), which is the mean
-        of the highest vales in top 90 percentile. Default is pos.
-    base_metric: str
-        Sets the lowest value for each pixel timeseries to use for calculations that rely on
-        the lowest value. Can be either vos (valley of season), which is the lowest possible
-        value in the whole timeseries per pixel, or bse (base), which is the mean of the min
-        value on the left and right slopes of the time series. Default is bse.
-    method: str
-        Sets the method used to determine pos (peak of season) and eos (end of season). Can be
-        first_of_slope, median_of_slope, seasonal_amplitude, absolute_value, relative_amplitude,
-        or stl_trend. See the get_pos and/or get_eos methods for more information.
-    factor: float (>=0 and <=1)
-        A float value between 0 and 1 which is used to increase or decrease the amplitude
-        threshold for the get_pos and get_eos seasonal_amplitude method. A factor closer
-        to 0 results in start of season nearer to min value, a factor closer to 1 results in
-        start of season closer to peak of season.
-    thresh_sides: str
-        A string indicating whether the sos value threshold calculation should be the min
-        value of left slope (one_sided) only, or use the bse/vos value (two_sided) calculated
-        earlier. Default is two_sided, as per TIMESAT 3.3. That said, one_sided is potentially
-        more robust.
-    abs_value: float
-        For absolute_value method only. Defines the absolute value in units of the vege index to
-        which sos is defined. The part of the vege slope that the absolute value hits will be the
-        sos value and time.
+        and time values, without all-nan pixels.
+    peak_metric, base_metric, method, factor, abs_value:
+        See calc_phenometrics.
 
     Returns
     -------
-    ds_phenos : xarray Dataset
-        An xarray Dataset type with an x and y dimension (no time). Contains numerous
-        variables representing the various phenometrics.
+    da_list : list of xarray DataArray
+        The phenometrics, in the order of _PHENOMETRICS.
     """
 
-    # notify user
-    print("Initialising calculation of phenometrics.\n")
-
-    # check if dask - not yet supported
-    # if dask.is_dask_collection(da):
-    #    raise TypeError('Dask arrays not yet supported. Please compute first.')
-
-    # check if dataset type
-    if type(da) != xr.DataArray:
-        raise TypeError("> Not a data array. Please provide a xarray data array.")
-
-    # check if max metric parameters supported
-    if peak_metric not in ["pos", "mos"]:
-        raise ValueError("> The peak_metric parameter must be either pos or mos.")
-
-    # check if min metric parameters supported
-    if base_metric not in ["bse", "vos"]:
-        raise ValueError("> The base_metric parameter must be either bse or vos.")
-
-    # create template dataset to hold phenometrics
-    # NOTE: no longer required
-
-    # get crs info before work
-    crs = extract_crs(da=da)
-
-    # take a mask of all-nan slices for clean up at end and set all-nan to 0s
-    da_all_nan_mask = da.isnull().all("time")
-    da = da.where(~da_all_nan_mask, 0.0)
-
-    # notify user
-    print("Beginning calculation of phenometrics. This can take awhile - please wait.\n")
-
     # calc peak of season (pos) values and times
     da_pos_values, da_pos_times = get_pos(da=da)
 
@@ -2500,8 +2472,8 @@ def calc_phenometrics(
     elif base_metric == "vos":
         da_siot_values = get_siot(da=da, da_base_values=da_vos_values)
 
-    # create data array list
-    da_list = [
+    # return data array list
+    return [
         da_pos_values,
         da_pos_times,
         da_mos_values,
@@ -2522,6 +2494,316 @@ def calc_phenometrics(
         da_siot_values,
     ]
 
+
+def _nanmedian(values):
+    """
+    Median along the last axis ignoring nans, like np.nanmedian but with a single sort of the array.
+    """
+    count = np.count_nonzero(~np.isnan(values), axis=-1)[:, None]
+    ordered = np.sort(values, axis=-1)
+    lower = np.take_along_axis(ordered, np.maximum(count - 1, 0) // 2, axis=-1)
+    upper = np.take_along_axis(ordered, np.minimum(count // 2, values.shape[-1] - 1), axis=-1)
+    return np.where(count > 0, (lower + upper) / 2, np.nan)
+
+
+def _season_point(slope, dists, doy):
+    """
+    Selects the value and day of year of a slope where the distances to a target are minimal,
+    as get_sos and get_eos do. Pixels without distances get nan as value.
+    """
+
+    # make mask for all nan pixels and fill with 0.0 (needs to be float)
+    mask = np.isnan(dists).all(axis=-1)
+    dists = np.where(mask[:, None], 0.0, dists)
+
+    # get time index where min dist from target
+    i = np.nanargmin(dists, axis=-1)
+    values = np.take_along_axis(slope, i[:, None], axis=-1)[:, 0]
+    times = doy[i]
+
+    # set all nan slices to nan and convert type
+    values = np.where(mask, np.nan, values).astype("float32")
+    times = np.where(mask, np.nan, times).astype("int16")
+    return values, times
+
+
+def _phenometrics_block(values, doy, coordinate, peak_metric, base_metric, method, factor, abs_value):
+    """
+    Calculates all phenometrics of a block of pixel timeseries in a single pass, sharing the
+    left and right slopes and their derivatives between the metrics. Gives the same results as
+    the get_* functions.
+
+    Parameters
+    ----------
+    values: numpy ndarray
+        The veg_index values, with shape (pixels, time) and without all-nan pixels.
+    doy: numpy ndarray
+        The day of year of each time.
+    coordinate: numpy ndarray
+        The times as float offsets from the first time, used for the derivatives.
+    peak_metric, base_metric, method, factor, abs_value:
+        See calc_phenometrics.
+
+    Returns
+    -------
+    metrics : numpy ndarray
+        A float64 array with shape (pixels, 18), holding the phenometrics in the order of _PHENOMETRICS.
+    """
+
+    # get pos and vos values and times (max and min val in each pixel timeseries)
+    pos_values = np.nanmax(values, axis=-1).astype("float32")
+    pos_times = doy[np.nanargmax(values, axis=-1)].astype("int16")
+    vos_values = np.nanmin(values, axis=-1).astype("float32")
+    vos_times = doy[np.nanargmin(values, axis=-1)].astype("int16")
+
+    # get left and right slopes values
+    slope_l = np.where(doy <= pos_times[:, None], values, np.nan)
+    slope_r = np.where(doy >= pos_times[:, None], values, np.nan)
+
+    # get mos values (mean of upper 80% values of left and right slopes)
+    slope_l_upper = np.where(slope_l >= np.nanmax(slope_l, axis=-1, keepdims=True) * 0.8, slope_l, np.nan)
+    slope_r_upper = np.where(slope_r >= np.nanmax(slope_r, axis=-1, keepdims=True) * 0.8, slope_r, np.nan)
+    mos_values = ((np.nanmean(slope_l_upper, axis=-1) + np.nanmean(slope_r_upper, axis=-1)) / 2).astype("float32")
+
+    # get bse values (mean of left and right slope min values)
+    bse_values = ((np.nanmin(slope_l, axis=-1) + np.nanmin(slope_r, axis=-1)) / 2).astype("float32")
+
+    # get aos values (peak - base)
+    peak_values = pos_values if peak_metric == "pos" else mos_values
+    base_values = bse_values if base_metric == "bse" else vos_values
+    aos_values = (peak_values - base_values).astype("float32")
+
+    # select vege values where positive on left slope and negative on right slope
+    slope_l_pos = np.where(np.gradient(slope_l, coordinate, axis=-1) > 0, slope_l, np.nan)
+    slope_r_neg = np.where(np.gradient(slope_r, coordinate, axis=-1) < 0, slope_r, np.nan)
+
+    # calc distances of the slopes from the sos and eos targets
+    if method in ["first_of_slope", "median_of_slope"]:
+        dists_sos = slope_l_pos - _nanmedian(slope_l_pos)
+        dists_eos = slope_r_neg - _nanmedian(slope_r_neg)
+        if method == "median_of_slope":
+            dists_sos, dists_eos = abs(dists_sos), abs(dists_eos)
+    elif method == "absolute_value":
+        dists_sos = abs(slope_l_pos - abs_value)
+        dists_eos = abs(slope_r_neg - abs_value)
+    else:
+        if method == "seasonal_amplitude":
+            target = (aos_values * factor) + base_values
+        else:
+            # get relative amplitude via robust max and base (10% cut off either side)
+            lower, upper = np.nanquantile(values, [0.10, 0.90], axis=-1)
+            target = ((upper - lower) * factor) + lower
+        dists_sos = abs(slope_l_pos - target[:, None])
+        dists_eos = abs(slope_r_neg - target[:, None])
+
+    # get sos and eos values and times
+    sos_values, sos_times = _season_point(slope_l_pos, dists_sos, doy)
+    eos_values, eos_times = _season_point(slope_r_neg, dists_eos, doy)
+
+    # get los values, negative values are corrected with the max time
+    los_values = eos_times - sos_times
+    los_values = np.where(los_values >= 0, los_values, doy[-1] + los_values).astype("int16")
+
+    # get roi and rod values
+    roi_values = ((pos_values - sos_values) / (pos_times - sos_times)).astype("float32")
+    rod_values = abs((eos_values - pos_values) / (eos_times - pos_times)).astype("float32")
+
+    # get vals between sos and eos times, and base vals projected on the timeseries (i.e. a rectangle)
+    season = (doy >= sos_times[:, None]) & (doy <= eos_times[:, None])
+    base_series = np.where(np.isnan(base_values)[:, None], values, base_values[:, None])
+
+    # calculate the integrals using trapezoid
+    lios = np.trapezoid(np.where(season, values, 0), dx=1, axis=-1)
+    liot = np.trapezoid(values, dx=1, axis=-1)
+    lios_values = lios.astype("float32")
+    sios_values = (lios - np.trapezoid(np.where(season, base_series, 0), dx=1, axis=-1)).astype("float32")
+    liot_values = liot.astype("float32")
+    siot_values = (liot - np.trapezoid(base_series, dx=1, axis=-1)).astype("float32")
+
+    return np.stack(
+        [
+            pos_values,
+            pos_times,
+            mos_values,
+            vos_values,
+            vos_times,
+            bse_values,
+            aos_values,
+            sos_values,
+            sos_times,
+            eos_values,
+            eos_times,
+            los_values,
+            roi_values,
+            rod_values,
+            lios_values,
+            sios_values,
+            liot_values,
+            siot_values,
+        ],
+        axis=-1,
+    ).astype("float64")
+
+
+def _phenometrics(values, doy, coordinate, **kwargs):
+    """
+    Calculates the phenometrics of an array with time as last axis, per block of pixels.
+    """
+    pixels = values.reshape(-1, values.shape[-1])
+    metrics = np.empty((len(pixels), len(_PHENOMETRICS)), dtype="float64")
+
+    # the slopes of pixels without a season are empty, ignore the warnings of their reductions
+    with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for start in range(0, len(pixels), _PIXEL_BLOCK_SIZE):
+            block = slice(start, start + _PIXEL_BLOCK_SIZE)
+            metrics[block] = _phenometrics_block(pixels[block], doy, coordinate, **kwargs)
+
+    return metrics.reshape(values.shape[:-1] + (len(_PHENOMETRICS),))
+
+
+def _get_phenometrics_fused(da, peak_metric, base_metric, method, factor, abs_value):
+    """
+    Calculates the phenometrics with the fused engine, which computes all metrics of a block
+    of pixels in a single pass over a numpy array. Dask arrays are processed lazily per chunk.
+
+    Parameters
+    ----------
+    da: xarray DataArray
+        A two-dimensional or multi-dimensional array containing an DataArray of veg_index
+        and time values, without all-nan pixels.
+    peak_metric, base_metric, method, factor, abs_value:
+        See calc_phenometrics.
+
+    Returns
+    -------
+    da_list : list of xarray DataArray
+        The phenometrics, in the order of _PHENOMETRICS.
+    """
+
+    # check factor and method
+    if factor < 0 or factor > 1:
+        raise ValueError("Provided factor value is not between 0 and 1. Aborting.")
+    if method not in _FUSED_METHODS:
+        raise ValueError("Provided method not supported. Aborting.")
+
+    # get day of year and the times as offsets for the derivatives, like xarray differentiate
+    time = da["time"].values
+    doy = da["time.dayofyear"].values
+    coordinate = (time - time.min()) / np.timedelta64(1, np.datetime_data(time.dtype)[0])
+
+    da_metrics = xr.apply_ufunc(
+        _phenometrics,
+        _rechunk_time(da, "time"),
+        input_core_dims=[["time"]],
+        output_core_dims=[["metric"]],
+        dask="parallelized",
+        output_dtypes=[np.float64],
+        dask_gufunc_kwargs={"output_sizes": {"metric": len(_PHENOMETRICS)}},
+        kwargs={
+            "doy": doy,
+            "coordinate": coordinate,
+            "peak_metric": peak_metric,
+            "base_metric": base_metric,
+            "method": method,
+            "factor": factor,
+            "abs_value": abs_value,
+        },
+    )
+
+    # split into the phenometrics with their types
+    return [
+        da_metrics.isel(metric=i).astype("int16" if name in _PHENOMETRIC_DAYS else "float32").rename(name)
+        for i, name in enumerate(_PHENOMETRICS)
+    ]
+
+
+def calc_phenometrics(
+    da, peak_metric="pos", base_metric="bse", method="first_of_slope", factor=0.5, thresh_sides="two_sided", abs_value=0
+):
+    """
+    Takes an xarray DataArray containing veg_index values and calculates numerous phenometrics
+    (metrics that measure various aspects of plant phenoly or lifecycle). See the information
+    within each metric method (e.g. get_pos) for a description of each.
+
+    Except for the stl_trend method, all metrics are computed by a fused engine in a single
+    pass over blocks of pixels, and dask arrays are processed lazily per chunk.
+
+    Parameters
+    ----------
+    da: xarray DataArray
+        A two-dimensional or multi-dimensional array containing an DataArray of veg_index
+        and time values.
+    peak_metric: str
+        Sets the highest value for each pixel timeseries to use for calculations that rely on
+        the highest value. Can be either pos (peak of season), which is the single highest
+        value in the whole timeseries per pixel, or mos (middle of season), which is the mean
+        of the highest vales in top 90 percentile. Default is pos.
+    base_metric: str
+        Sets the lowest value for each pixel timeseries to use for calculations that rely on
+        the lowest value. Can be either vos (valley of season), which is the lowest possible
+        value in the whole timeseries per pixel, or bse (base), which is the mean of the min
+        value on the left and right slopes of the time series. Default is bse.
+    method: str
+        Sets the method used to determine pos (peak of season) and eos (end of season). Can be
+        first_of_slope, median_of_slope, seasonal_amplitude, absolute_value, relative_amplitude,
+        or stl_trend. See the get_pos and/or get_eos methods for more information.
+    factor: float (>=0 and <=1)
+        A float value between 0 and 1 which is used to increase or decrease the amplitude
+        threshold for the get_pos and get_eos seasonal_amplitude method. A factor closer
+        to 0 results in start of season nearer to min value, a factor closer to 1 results in
+        start of season closer to peak of season.
+    thresh_sides: str
+        A string indicating whether the sos value threshold calculation should be the min
+        value of left slope (one_sided) only, or use the bse/vos value (two_sided) calculated
+        earlier. Default is two_sided, as per TIMESAT 3.3. That said, one_sided is potentially
+        more robust.
+    abs_value: float
+        For absolute_value method only. Defines the absolute value in units of the vege index to
+        which sos is defined. The part of the vege slope that the absolute value hits will be the
+        sos value and time.
+
+    Returns
+    -------
+    ds_phenos : xarray Dataset
+        An xarray Dataset type with an x and y dimension (no time). Contains numerous
+        variables representing the various phenometrics.
+    """
+
+    # notify user
+    print("Initialising calculation of phenometrics.\n")
+
+    # check if dataset type
+    if type(da) != xr.DataArray:
+        raise TypeError("> Not a data array. Please provide a xarray data array.")
+
+    # check if max metric parameters supported
+    if peak_metric not in ["pos", "mos"]:
+        raise ValueError("> The peak_metric parameter must be either pos or mos.")
+
+    # check if min metric parameters supported
+    if base_metric not in ["bse", "vos"]:
+        raise ValueError("> The base_metric parameter must be either bse or vos.")
+
+    # create template dataset to hold phenometrics
+    # NOTE: no longer required
+
+    # get crs info before work
+    crs = extract_crs(da=da)
+
+    # take a mask of all-nan slices for clean up at end and set all-nan to 0s
+    da_all_nan_mask = da.isnull().all("time")
+    da = da.where(~da_all_nan_mask, 0.0)
+
+    # notify user
+    print("Beginning calculation of phenometrics. This can take awhile - please wait.\n")
+
+    if method == "stl_trend":
+        # the stl trend is only available on the stepwise chain of metric functions
+        da_list = _get_phenometrics_stepwise(da, peak_metric, base_metric, method, factor, abs_value)
+    else:
+        da_list = _get_phenometrics_fused(da, peak_metric, base_metric, method, factor, abs_value)
+
     # combine data arrays into one dataset
     ds_phenos = xr.merge(da_list, compat="override")
 
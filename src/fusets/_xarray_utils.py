@@ -1,14 +1,65 @@
 from datetime import datetime
+from functools import cached_property
 
 import numpy as np
 import pandas as pd
 
+# proleptic Gregorian ordinal of the unix epoch, as returned by datetime.toordinal
+_EPOCH_ORDINAL = 719163
+
 
 def _topydate(t):
     return datetime.utcfromtimestamp((t - np.datetime64("1970-01-01T00:00:00Z")) / np.timedelta64(1, "s"))
 
 
-def _extract_dates(array):
+class _DateAxis:
+    """
+    Vectorized representation of a time axis, as integer day offsets relative to its first date.
+
+    Derived arrays are computed on first access and cached, so algorithms can consume them without converting
+    dates to Python objects.
+    """
+
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype="datetime64[ns]")
+
+    def __len__(self):
+        return len(self.values)
+
+    @classmethod
+    def from_ordinals(cls, ordinals) -> "_DateAxis":
+        """Create an axis from proleptic Gregorian ordinals, as returned by `datetime.toordinal`"""
+        return cls((np.asarray(ordinals, dtype=np.int64) - _EPOCH_ORDINAL).astype("datetime64[D]"))
+
+    @property
+    def origin(self) -> np.datetime64:
+        return self.values[0]
+
+    @cached_property
+    def ordinals(self) -> np.ndarray:
+        """Proleptic Gregorian ordinals of the dates, identical to `datetime.toordinal`"""
+        return self.values.astype("datetime64[D]").astype(np.int64) + _EPOCH_ORDINAL
+
+    @cached_property
+    def days(self) -> np.ndarray:
+        """Day offsets of the dates relative to the origin"""
+        return self.ordinals - self.ordinals[0]
+
+    @cached_property
+    def day_of_year(self) -> np.ndarray:
+        """Day of year of the dates, starting at 1"""
+        days = self.values.astype("datetime64[D]")
+        return (days - days.astype("datetime64[Y]")).astype(np.int64) + 1
+
+    def offsets(self, other: "_DateAxis") -> np.ndarray:
+        """Day offsets of the dates of another axis relative to the origin of this axis"""
+        return other.ordinals - self.ordinals[0]
+
+    def to_pydatetime(self) -> list:
+        return self.values.astype("datetime64[us]").astype(datetime).tolist()
+
+
+def _time_coordinate(array):
     time_coords = [c for c in array.coords.values() if c.dtype.type == np.datetime64]
     if len(time_coords) == 0:
         raise ValueError(
@@ -20,12 +71,19 @@ def _extract_dates(array):
         )
     dates = time_coords[0]
     assert dates.dtype.type == np.datetime64
+    return dates
 
-    dates = list(dates.values)
+
+def _extract_dates(array):
+    dates = list(_time_coordinate(array).values)
     dates = [_topydate(d) for d in dates]
     return dates
 
 
+def _extract_date_axis(array) -> _DateAxis:
+    return _DateAxis(_time_coordinate(array).values)
+
+
 def _time_dimension(array, time_dimension):
     time_coords = {c.name: c for c in array.coords.values() if c.dtype.type == np.datetime64}
     if len(time_coords) == 0:
@@ -40,7 +98,21 @@ def _time_dimension(array, time_dimension):
     return time_dimension
 
 
+def _rechunk_time(array, time_dimension):
+    """
+    Rechunk a dask backed array or dataset so that each chunk contains the complete time dimension.
+    Arrays that are not backed by dask are returned as is.
+    """
+    if array.chunks:
+        return array.chunk({time_dimension: -1})
+    return array
+
+
 def _output_dates(prediction_period, start_date, end_date):
+    return [_topydate(d) for d in _output_date_axis(prediction_period, start_date, end_date).values]
+
+
+def _output_date_axis(prediction_period, start_date, end_date) -> _DateAxis:
     period = pd.Timedelta(prediction_period)
     range = pd.date_range(start_date, end_date, freq=period)
-    return [_topydate(d) for d in range.values]
+    return _DateAxis(range.values)
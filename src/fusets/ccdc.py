@@ -1,10 +1,19 @@
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
 import numpy as np
 import xarray
 
-from fusets._xarray_utils import _extract_dates, _time_dimension
+from fusets import _ccdc
+from fusets._xarray_utils import _extract_date_axis, _rechunk_time, _time_dimension
 
 
-def ccdc_change_detection(array: xarray.DataArray):
+def ccdc_change_detection(
+    array: xarray.DataArray, max_breaks: int = 10, n_jobs: int = 1, executor: Executor = None, backend: str = "ccd"
+) -> xarray.DataArray:
     """
     CCDC change detection.
     This implementation works on generic timeseries, not on raw Landsat data like the original version.
@@ -12,143 +21,475 @@ def ccdc_change_detection(array: xarray.DataArray):
 
     `Zhe Zhu, Curtis E. Woodcock, Christopher Holden, Zhiqiang Yang, Generating synthetic Landsat images based on all available Landsat data: Predicting Landsat surface reflectance at any given time <https://doi.org/10.1016/j.rse.2015.02.009>`_
 
-    :param: array:
-    :return: the break days
-    """
-
-    def _filter_saturated(observations):
-        """
-        bool index for unsaturated obserervations between 0..10,000
-
-        Useful for efficiently filtering noisy-data from arrays.
-
-        Arguments:
-            observations: spectra nd-array, assumed to be shaped as
-                (6,n-moments) of unscaled data.
-
-        Returns:
-            1-d bool ndarray
-
-        """
-        unsaturated = (0 < observations[0]) & (observations[0] < 10000)
-        return unsaturated
-
-    def _results_to_changemodel(
-        fitted_models, start_day, end_day, break_day, magnitudes, observation_count, change_probability, curve_qa
-    ):
-        """
-        Helper method to consolidate results into a concise, self documenting data
-        structure.
-
-        This also converts any specific package types used during processing to
-        standard python types to help with downstream processing.
-
-        {start_day: int,
-         end_day: int,
-         break_day: int,
-         observation_count: int,
-         change_probability: float,
-         curve_qa: int,
-         blue:  {magnitude: float,
-                 rmse: float,
-                 coefficients: (float, float, ...),
-                 intercept: float},
-         etc...
-
-        Returns:
-            dict
-
-        """
-        spectral_models = []
-        for ix, model in enumerate(fitted_models):
-            spectral = {
-                "rmse": float(model.rmse),
-                "coefficients": tuple(float(c) for c in model.fitted_model.coef_),
-                "intercept": float(model.fitted_model.intercept_),
-                "magnitude": float(magnitudes[ix]),
-            }
-            spectral_models.append(spectral)
-
-        return {
-            "start_day": int(start_day),
-            "end_day": int(end_day),
-            "break_day": int(break_day),
-            "observation_count": int(observation_count),
-            "change_probability": float(change_probability),
-            "curve_qa": int(curve_qa),
-            "blue": spectral_models[0],
-        }
+    The pixels are processed independently, so they can be distributed over worker processes, and chunked dask arrays
+    are processed per chunk. Every pixel gets the same number of break days, padded with NaN.
+
+    The "numpy" backend is an in-package variant for single band series, which processes all pixels of a block in
+    lockstep and updates its least squares fits with one observation at a time as the model window grows, which is much
+    faster than ``ccd``. It differs from ``ccd`` in a few simplifications: the models are fitted by ordinary least
+    squares instead of a Lasso regression, the change test is normalized by the RMSE of the fit instead of the RMSE of
+    the seasonally closest observations, the thresholds are those of a single band and it only returns the breaks of
+    detected changes, not the end of the last segment.
+
+    :param array: DataArray containing timestamped observations of a single band
+    :param max_breaks: the size of the "bands" dimension of the result, later break days are dropped
+    :param n_jobs: the number of worker processes over which the pixels are distributed
+    :param executor: an executor to distribute the pixels over instead of a new process pool
+    :param backend: "ccd" to run the standard procedure of ``ccd`` per pixel, or "numpy" for the in-package variant
+    :return: the break days, as days since the first date, along a "bands" dimension
+    """
+
+    if backend not in _BACKENDS:
+        raise ValueError(f"Unknown CCDC backend {backend}, available backends: {list(_BACKENDS)}")
+
+    time_dimension = _time_dimension(array, None)
+
+    dates_np = _extract_date_axis(array).days
+
+    def callback(timeseries):
+        return _ccdc_pixels(timeseries, dates_np, max_breaks, n_jobs, executor, backend)
+
+    result = xarray.apply_ufunc(
+        callback,
+        _rechunk_time(array, time_dimension),
+        input_core_dims=[[time_dimension]],
+        output_core_dims=[["bands"]],
+        dask="parallelized",
+        output_dtypes=[np.float64],
+        dask_gufunc_kwargs=dict(output_sizes={"bands": max_breaks}),
+    )
+
+    # make sure to preserve dimension order
+    return result
+
+
+def _ccdc_pixels(values, dates, max_breaks, n_jobs=1, executor=None, backend="ccd"):
+    """
+    Apply CCDC to a block of pixels, optionally distributed over a pool of worker processes.
+
+    ``ccd`` is pure python and bound to the global interpreter lock, so the pixels are split in shards of plain numpy
+    arrays that are sent to worker processes, instead of using threads.
+
+    Args:
+        values (ndarray): observations with time as last axis, NaN marks missing values
+        dates (ndarray): the day offsets of the time axis
+        max_breaks (int): the number of break days per pixel
+        n_jobs (int): number of worker processes
+        executor (Executor): executor to submit the shards to, instead of creating a process pool
+        backend (str): name of the CCDC implementation
+
+    Returns:
+        The break days of every pixel padded with NaN, with shape (..., max_breaks)
+    """
+    shape = values.shape
+    pixels = np.ascontiguousarray(values.reshape(-1, shape[-1]), dtype=np.float64)
 
+    block = partial(_BACKENDS[backend], dates=dates, max_breaks=max_breaks)
+    if (executor is None and n_jobs <= 1) or len(pixels) == 0:
+        result = block(pixels)
+    else:
+        # a few shards per worker to balance the load, pixels with more segments take longer
+        shards = np.array_split(pixels, min(len(pixels), 4 * max(n_jobs, 1)))
+        if executor is None:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                result = np.concatenate(list(pool.map(block, shards)))
+        else:
+            result = np.concatenate(list(executor.map(block, shards)))
+
+    return result.reshape(shape[:-1] + (max_breaks,))
+
+
+def _ccdc_block(pixels, dates, max_breaks):
+    """
+    Apply the standard procedure of ``ccd`` to a block of pixels, one pixel at a time.
+
+    Args:
+        pixels (ndarray): observations with shape (pixels, time), NaN marks missing values
+        dates (ndarray): the day offsets of the time axis
+        max_breaks (int): the number of break days per pixel
+
+    Returns:
+        The break days of every pixel padded with NaN, with shape (pixels, max_breaks)
+    """
     from ccd import app, procedures
     from ccd.models import lasso
 
-    procedures.results_to_changemodel = _results_to_changemodel
-    procedures.qa.filter_saturated = _filter_saturated
+    result = np.full((len(pixels), max_breaks), np.nan)
+    with _ccd_customizations():
+        for i, timeseries in enumerate(pixels):
+            valid = ~np.isnan(timeseries)
+            timeseries_valid = timeseries[valid]
+
+            quality = np.ones(shape=(timeseries_valid.shape[0],))
+            proc_params = app.get_default_params()
+            thermal = np.full(shape=(timeseries_valid.shape[0],), fill_value=2731.5 + 10.0)  # 10 degrees, scaled
+            proc_params.THERMAL_IDX = 1  # index of thermal band, which we add ourselves
+            proc_params.TMASK_BANDS = [0]  # bands used for outlier detection
+            proc_params.DETECTION_BANDS = [0]  # index locations of the spectral bands that determine stability
+
+            results, processing_mask = procedures.standard_procedure(
+                dates[valid], np.array([timeseries_valid, thermal]), lasso.fitted_model, quality, None, proc_params
+            )
+
+            breaks = [r["break_day"] for r in results][:max_breaks]
+            result[i, : len(breaks)] = breaks
+    return result
 
-    time_dimension = _time_dimension(array, None)
 
-    dates = _extract_dates(array)
-    dates_np = np.array([d.toordinal() for d in dates])
-    dates_np = dates_np - dates_np[0]
+_BACKENDS = {"ccd": _ccdc_block, "numpy": _ccdc.detect_breaks}
 
-    def callback(timeseries):
-        timeseries_valid = timeseries[~np.isnan(timeseries)]
+_CCD_LOCK = threading.RLock()
 
-        quality = np.ones(shape=(timeseries_valid.shape[0],))
-        proc_params = app.get_default_params()
-        thermal = np.full(shape=(timeseries_valid.shape[0],), fill_value=2731.5 + 10.0)  # 10 degrees kelvin, scaled
-        proc_params.THERMAL_IDX = 1  # index of thermal band, which we add ourselves
-        proc_params.TMASK_BANDS = [0]  # bands used for outlier detection
-        proc_params.DETECTION_BANDS = [0]  # index locations of the spectral bands that are used to determine stability
 
-        results, processing_mask = procedures.standard_procedure(
-            dates_np, np.array([timeseries_valid, thermal]), lasso.fitted_model, quality, None, proc_params
-        )
+@contextmanager
+def _ccd_customizations():
+    """
+    Install the single band customizations of ``ccd`` for the duration of the context and restore the originals
+    afterwards. ``ccd`` looks these functions up as module globals, so threads using ``ccd`` at the same time are
+    serialized by a lock, which costs little because ``ccd`` holds the global interpreter lock anyway.
+    """
+    from ccd import procedures
+
+    customizations = {
+        (procedures, "results_to_changemodel"): _results_to_changemodel,
+        (procedures.qa, "filter_saturated"): _filter_saturated,
+        (procedures, "adjusted_variogram"): _adjusted_variogram,
+    }
+    with _CCD_LOCK:
+        originals = {target: getattr(*target) for target in customizations}
+        try:
+            for (module, name), function in customizations.items():
+                setattr(module, name, function)
+            yield
+        finally:
+            for (module, name), function in originals.items():
+                setattr(module, name, function)
+
+
+def _filter_saturated(observations):
+    """
+    bool index for unsaturated obserervations between 0..10,000
 
-        return np.array([r["break_day"] for r in results])
+    Useful for efficiently filtering noisy-data from arrays.
 
-    result = xarray.apply_ufunc(
-        callback, array, input_core_dims=[[time_dimension]], output_core_dims=[["bands"]], vectorize=True
+    Arguments:
+        observations: spectra nd-array, assumed to be shaped as
+            (6,n-moments) of unscaled data.
+
+    Returns:
+        1-d bool ndarray
+
+    """
+    unsaturated = (0 < observations[0]) & (observations[0] < 10000)
+    return unsaturated
+
+
+def _results_to_changemodel(
+    fitted_models, start_day, end_day, break_day, magnitudes, observation_count, change_probability, curve_qa
+):
+    """
+    Helper method to consolidate results into a concise, self documenting data
+    structure.
+
+    This also converts any specific package types used during processing to
+    standard python types to help with downstream processing.
+
+    {start_day: int,
+     end_day: int,
+     break_day: int,
+     observation_count: int,
+     change_probability: float,
+     curve_qa: int,
+     blue:  {magnitude: float,
+             rmse: float,
+             coefficients: (float, float, ...),
+             intercept: float},
+     etc...
+
+    Returns:
+        dict
+
+    """
+    spectral_models = []
+    for ix, model in enumerate(fitted_models):
+        spectral = {
+            "rmse": float(model.rmse),
+            "coefficients": tuple(float(c) for c in model.fitted_model.coef_),
+            "intercept": float(model.fitted_model.intercept_),
+            "magnitude": float(magnitudes[ix]),
+        }
+        spectral_models.append(spectral)
+
+    return {
+        "start_day": int(start_day),
+        "end_day": int(end_day),
+        "break_day": int(break_day),
+        "observation_count": int(observation_count),
+        "change_probability": float(change_probability),
+        "curve_qa": int(curve_qa),
+        "blue": spectral_models[0],
+    }
+
+
+def _adjusted_variogram(dates, observations):
+    """
+    ``ccd.math_utils.adjusted_variogram``, without relying on the array result of ``scipy.stats.mode``, which is a
+    scalar in recent scipy versions.
+
+    Args:
+        dates: 1-d array of values representing ordinal day
+        observations: 2-d array of spectral observations corresponding to the
+            dates array
+
+    Returns:
+        1-d ndarray of floats
+    """
+    from ccd.math_utils import calculate_variogram
+
+    vario = calculate_variogram(observations)
+
+    for idx in range(dates.shape[0]):
+        var = dates[1 + idx :] - dates[: -idx - 1]
+        if len(var) == 0:
+            continue
+
+        # the smallest of the most frequent differences, like scipy.stats.mode
+        differences, counts = np.unique(var, return_counts=True)
+        if differences[np.argmax(counts)] > 30:
+            diff = observations[:, 1 + idx :] - observations[:, : -idx - 1]
+            ids = var > 30
+
+            vario = np.median(np.abs(diff[:, ids]), axis=1)
+            break
+
+    return vario
+
+
+def ccdc_monitoring(array: xarray.DataArray, store: str, time_dimension: str = None) -> xarray.DataArray:
+    """
+    CCDC disturbance monitoring of a growing archive, with the models of the pixels kept in a store on disk.
+
+    The first call fits the models of all pixels on the whole archive with the in-package CCDC variant of
+    ``ccdc_change_detection(backend="numpy")``, and saves the harmonic model of the last segment of every pixel, its
+    RMSE and its last stable date in the store. Later calls only evaluate the change statistic of the acquisitions
+    after the last processed date of the store, against the stored models, and only refit the pixels that broke, or
+    that had no stable model yet, on their observations since the break. The archive can therefore be a lazy, e.g.
+    dask backed, datacube of which only these parts are loaded.
+
+    A break is confirmed when a number of consecutive observations deviate from the model, like in CCDC. The stored
+    models are not updated with the new observations.
+
+    :param array: DataArray containing timestamped observations of a single band, the archive including the new acquisitions
+    :param store: path of the netCDF file with the models, which is created if it does not exist
+    :param time_dimension: the name of the time dimension, only needed to resolve ambiguities
+    :return: the date of the last break of every pixel, NaT for pixels without a break
+    """
+
+    time_dimension = _time_dimension(array, time_dimension)
+    dates = _extract_date_axis(array).values.astype("datetime64[D]")
+    spatial_dimensions = [dim for dim in array.dims if dim != time_dimension]
+    shape = tuple(array.sizes[dim] for dim in spatial_dimensions)
+    npixels = int(np.prod(shape))
+
+    if os.path.exists(store):
+        models = xarray.load_dataset(store)
+        if tuple(models.sizes[dim] for dim in spatial_dimensions) != shape:
+            raise ValueError(f"The datacube does not match the pixels of the models in {store}.")
+        origin, last_date = np.datetime64(models.attrs["origin"], "D"), np.datetime64(models.attrs["last_date"], "D")
+        limits = models.attrs["peek_size"], models.attrs["change_threshold"], models.attrs["outlier_threshold"]
+        state = _ccdc.MonitorState(
+            *(
+                models[field].values.reshape((npixels,) + models[field].shape[len(shape) :])
+                for field in _ccdc.MonitorState._fields
+            )
+        )
+    else:
+        origin, last_date = dates[0], None
+        limits = _ccdc.thresholds((dates - origin).astype(np.int64))
+        state = _ccdc.MonitorState.empty(npixels)
+
+    days = (dates - origin).astype(np.int64)
+    new = np.flatnonzero(dates > last_date) if last_date is not None else np.arange(len(dates))
+    data = array.transpose(*spatial_dimensions, time_dimension).data.reshape(npixels, len(dates))
+
+    # evaluate the new acquisitions against the stored models
+    acquisitions = np.asarray(data[:, new], dtype=np.float64)
+    if last_date is not None:
+        for day, values in zip(days[new], acquisitions.T):
+            _ccdc.monitor(state, day, values, *limits[:2])
+
+    # refit the pixels without a model for which there are new observations
+    members = np.flatnonzero(np.isnan(state.coefficients[:, 0]) & ~np.isnan(acquisitions).all(axis=1))
+    if len(members) > 0:
+        times = np.flatnonzero(days >= state.start[members].min())
+        series = np.asarray(data[members][:, times], dtype=np.float64)
+        _ccdc.refit(state, members, days[times], series, limits)
+
+    coords = {dim: array[dim] for dim in spatial_dimensions if dim in array.coords}
+    models = xarray.Dataset(
+        {
+            field: (
+                spatial_dimensions + (["coefficient"] if field == "coefficients" else []),
+                values.reshape(shape + values.shape[1:]),
+            )
+            for field, values in state._asdict().items()
+        },
+        coords=coords,
+        attrs=dict(
+            origin=str(origin),
+            last_date=str(dates[-1] if last_date is None else max(dates[-1], last_date)),
+            peek_size=limits[0],
+            change_threshold=limits[1],
+            outlier_threshold=limits[2],
+        ),
     )
+    # replace the store at once, so an interrupted update leaves the previous models
+    models.to_netcdf(f"{store}.tmp")
+    os.replace(f"{store}.tmp", store)
 
-    # make sure to preserve dimension order
-    return result
+    last_break = np.where(np.isnan(state.last_break), 0, state.last_break).astype("timedelta64[D]") + origin
+    last_break[np.isnan(state.last_break)] = np.datetime64("NaT")
+    return xarray.DataArray(last_break.reshape(shape).astype("datetime64[ns]"), dims=spatial_dimensions, coords=coords)
 
 
-def fit_harmonics_curve(array: xarray.DataArray, num_coefficients=6, time_dimension=None):
+def fit_harmonics_curve(array: xarray.DataArray, num_coefficients=6, time_dimension=None, method="lasso"):
     """
     Fit a timeseries model based on fourier harmonics as proposed by CCDC.
     This method expects inputs in the [0,10000] range!
 
     `Zhe Zhu, Curtis E. Woodcock, Christopher Holden, Zhiqiang Yang, Generating synthetic Landsat images based on all available Landsat data: Predicting Landsat surface reflectance at any given time <https://doi.org/10.1016/j.rse.2015.02.009>`_
 
+    The harmonic design matrix is built once for the shared date axis, and all pixels are fitted together, with zero
+    weights for their missing values. Pixels with fewer valid observations than coefficients get NaN coefficients.
+
     :param array: DataArray containing timestamped observations in the range [0,10000]
-    :param num_coefficients:
+    :param num_coefficients: the number of coefficients: the intercept, the slope and the harmonic terms
     :param time_dimension:
-    :return:
+    :param method: "lasso" for the Lasso regression of CCDC, or "ols" for ordinary least squares
+    :return: the coefficients, with the intercept first, along a "bands" dimension
     """
 
-    from ccd.models import lasso
+    from ccd.models.lasso import coefficient_matrix
     from ccd.parameters import defaults
 
+    if method not in ("lasso", "ols"):
+        raise ValueError(f"Unknown method '{method}', expected 'lasso' or 'ols'.")
+
     time_dimension = _time_dimension(array, time_dimension)
 
-    dates = _extract_dates(array)
-    dates_np = np.array([d.toordinal() for d in dates])
-    dates_np = dates_np - dates_np[0]
+    dates_np = _extract_date_axis(array).days
+    design = coefficient_matrix(dates_np, defaults["AVG_DAYS_YR"], num_coefficients)[:, : num_coefficients - 1]
 
     def callback(timeseries):
-        timeseries_valid = timeseries[~np.isnan(timeseries)]
-        models = lasso.fitted_model(
-            dates_np, timeseries_valid, defaults["LASSO_MAX_ITER"], defaults["AVG_DAYS_YR"], num_coefficients
-        )
-
-        coeffs = [models.fitted_model.intercept_, *models.fitted_model.coef_[0 : num_coefficients - 1]]
-        return np.array(coeffs)
+        # all pixels of a block at once, the time dimension is moved to the last axis by apply_ufunc
+        return _fit_harmonics(design, timeseries, method, defaults["LASSO_MAX_ITER"])
 
     result = xarray.apply_ufunc(
-        callback, array, input_core_dims=[[time_dimension]], output_core_dims=[["bands"]], vectorize=True
+        callback,
+        _rechunk_time(array, time_dimension),
+        input_core_dims=[[time_dimension]],
+        output_core_dims=[["bands"]],
+        dask="parallelized",
+        output_dtypes=[np.float64],
+        dask_gufunc_kwargs=dict(output_sizes={"bands": num_coefficients}),
     )
 
     # make sure to preserve dimension order
     return result
+
+
+def _fit_harmonics(design, values, method="lasso", max_iter=1000):
+    """
+    Fit the harmonic model of a block of timeseries sharing the same date axis.
+
+    Args:
+        design (ndarray): the harmonic design matrix without intercept, shape (time, coefficients - 1)
+        values (ndarray): observations with time as last axis, NaN marks missing values
+        method (str): "lasso" for the Lasso regression with alpha 1 of ``ccd.models.lasso``, or "ols"
+        max_iter (int): maximum number of coordinate descent iterations of the Lasso regression
+
+    Returns:
+        The intercept and coefficients of every series, with the coefficients as last axis
+    """
+    shape = values.shape
+    y = values.reshape(-1, shape[-1]).astype(np.float64)
+    valid = ~np.isnan(y)
+    ncoefficients = design.shape[1] + 1
+    result = np.full((len(y), ncoefficients), np.nan)
+    fitted = valid.sum(axis=1) >= ncoefficients
+
+    # missing observations get a zero weight, so that all series are fitted together whatever their missing values, and
+    # like sklearn, the intercept follows from the fit of the centered data
+    weights = valid[fitted].astype(np.float64)
+    y = np.where(valid[fitted], y[fitted], 0.0)
+    n = weights.sum(axis=1)
+    offset = design.mean(axis=0)
+    x = design - offset
+    x_mean = weights @ x / n[:, np.newaxis]
+    y_mean = y.sum(axis=1) / n
+    xty = (weights * (y - y_mean[:, np.newaxis])) @ x
+    products = (x[:, :, np.newaxis] * x[:, np.newaxis, :]).reshape(len(x), -1)
+    gram = (weights @ products).reshape(-1, x.shape[1], x.shape[1])
+    gram -= n[:, np.newaxis, np.newaxis] * x_mean[:, :, np.newaxis] * x_mean[:, np.newaxis, :]
+
+    if method == "ols":
+        coefficients = _least_squares(gram, xty)
+    else:
+        coefficients = _lasso(gram, xty, n, max_iter=max_iter)
+
+    result[fitted, 0] = y_mean - np.sum((x_mean + offset) * coefficients, axis=1)
+    result[fitted, 1:] = coefficients
+    return result.reshape(shape[:-1] + (ncoefficients,))
+
+
+def _least_squares(gram, xty):
+    """
+    Least squares coefficients of a batch of series from their normal equations. Columns without data, e.g. the
+    harmonics that are not used, get a zero coefficient.
+
+    Args:
+        gram (ndarray): X'X of every series, shape (batch, coefficients, coefficients)
+        xty (ndarray): X'y of every series, shape (batch, coefficients)
+
+    Returns:
+        The coefficients, with shape (batch, coefficients)
+    """
+    unused = np.diagonal(gram, axis1=1, axis2=2) <= 0
+    gram = gram + unused[:, :, np.newaxis] * np.eye(gram.shape[-1])
+    return np.linalg.solve(gram, np.where(unused, 0.0, xty)[..., np.newaxis])[..., 0]
+
+
+def _lasso(gram, xty, n, alpha=1.0, max_iter=1000, tol=1e-8):
+    """
+    Lasso regression of a batch of series, by coordinate descent on their Gram matrices, minimizing
+    ||y - Xw||^2 / (2n) + alpha ||w||_1 like ``sklearn.linear_model.Lasso`` without intercept. Every series stops
+    after the first pass in which its coefficients converged, like it would when fitted on its own.
+
+    Args:
+        gram (ndarray): X'X of every series, shape (batch, coefficients, coefficients)
+        xty (ndarray): X'y of every series, shape (batch, coefficients)
+        n (ndarray): the number of observations of every series, shape (batch,)
+        alpha (double): the L1 regularization strength
+        max_iter (int): the maximum number of passes over the coefficients
+        tol (double): the relative change of the coefficients below which a pass is considered converged
+
+    Returns:
+        The coefficients, with shape (batch, coefficients)
+    """
+    coefficients = np.zeros(xty.shape)
+    diagonal = np.diagonal(gram, axis1=1, axis2=2)
+    used = diagonal > 0
+    active = np.arange(len(xty))
+    for _ in range(max_iter):
+        if len(active) == 0:
+            break
+        w, change = coefficients[active], np.zeros(len(active))
+        for j in range(xty.shape[1]):
+            d = np.where(used[active, j], diagonal[active, j], 1.0)
+            rho = xty[active, j] - np.sum(gram[active, j] * w, axis=1) + d * w[:, j]
+            updated = np.where(used[active, j], np.sign(rho) * np.maximum(np.abs(rho) - n[active] * alpha, 0) / d, 0.0)
+            change = np.maximum(change, np.abs(updated - w[:, j]))
+            w[:, j] = updated
+        coefficients[active] = w
+        active = active[change > tol * np.abs(w).max(axis=1)]
+    return coefficients
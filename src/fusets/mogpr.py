@@ -5,14 +5,15 @@ Link: https://doi.org/10.1016/j.rse.2019.111452
 
 import importlib
 import itertools
-from datetime import datetime
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
 from typing import List, Union
 
 import numpy as np
-import pandas as pd
 import xarray
 
-from fusets._xarray_utils import _extract_dates, _output_dates, _time_dimension
+from fusets import _gp
+from fusets._xarray_utils import _DateAxis, _extract_date_axis, _output_date_axis, _time_dimension
 from fusets.base import BaseEstimator
 
 _openeo_exists = importlib.util.find_spec("openeo") is not None
@@ -26,106 +27,75 @@ class MOGPRTransformer(BaseEstimator):
     MOGPR (multi-output gaussia-process regression) integrates various timeseries and delivers the same amount of reconstructed timeseries. This allows to
     fill gaps based on other indicators that are correlated with each other.
 
+    The transformer learns coregionalization hyperparameters that are shared by all pixels on a sample of pixels, after
+    which every pixel is predicted without further optimization.
+
     """
 
-    def __init__(self) -> None:
+    def __init__(self, n_samples: int = 16, random_state: int = None) -> None:
+        """
+        Args:
+            n_samples: The number of pixels on which the hyperparameters are trained.
+            random_state: Seed for the selection of the training pixels.
+        """
+        self.n_samples = n_samples
+        self.random_state = random_state
         self.model = None
 
-    def fit(self, X, y=None, **fit_params):
-        ds = X
-        for pos_x in range(4):  # len(ds.coords['x'].values)
-            for pos_y in range(4):  # len(ds.coords['y'].values)
-                master_ind = 0
-                nt = 1
-                day_step = 15
-
-                time = []
-                data = []
-                time_str = []
-                var_names = []
-
-                for d in ds:
-                    y = ds[d][:, pos_y, pos_x].values
-                    x = ds[d]["t"].values
-
-                    time_vec_num = np.asarray(
-                        [pd.Timestamp(_).to_pydatetime().toordinal() for _ in x], dtype=np.float64
-                    )
-                    time.append(time_vec_num)
-                    data.append(y)
-                    var_names.append(d)
-
-                time_vec_min = np.min(list(pd.core.common.flatten(time)))
-                time_vec_max = np.max(list(pd.core.common.flatten(time)))
-                output_timevec = np.array(range(int(time_vec_min), int(time_vec_max), 5), dtype=np.float64)
-                output_time = [datetime.fromordinal(int(_)) for _ in output_timevec]
-
-                out_mean, out_std, out_qflag, out_model = mogpr_1D(data[:], time[:], master_ind, output_timevec, nt)
-                if out_model is not None:
-                    print(out_model)
-                    self.model = out_model
-                    return
-
-    def transform(self, X):
-        array = X
-        ds = array
-        variables = None
-        time_dimension = "t"
-
-        output = []
-
-        for pos_x in range(len(ds.coords["x"].values)):
-            for pos_y in range(len(ds.coords["y"].values)):
-                master_ind = 0
-                nt = 1
-                day_step = 15
-
-                time = []
-                data = []
-                time_str = []
-                var_names = []
-
-                for d in ds:
-                    y = ds[d][:, pos_y, pos_x].values
-                    x = ds[d]["t"].values
-
-                    time_vec_num = np.asarray(
-                        [pd.Timestamp(_).to_pydatetime().toordinal() for _ in x], dtype=np.float64
-                    )
-                    time.append(time_vec_num)
-                    data.append(y)
-                    var_names.append(d)
-
-                time_vec_min = np.min(list(pd.core.common.flatten(time)))
-                time_vec_max = np.max(list(pd.core.common.flatten(time)))
-                output_timevec = np.array(range(int(time_vec_min), int(time_vec_max), 5), dtype=np.float64)
-                output_time = [datetime.fromordinal(int(_)) for _ in output_timevec]
-
-                out_mean, out_std, out_qflag, out_model = mogpr_1D(
-                    data[:], time[:], master_ind, output_timevec, nt, trained_model=self.model
-                )
-
-                output.append(out_mean)
-        array_x_y_ds_t = np.array(output).reshape((len(ds.coords["x"].values), len(ds.coords["y"].values), len(ds), -1))
-        array_ds_t_x_y = np.moveaxis(np.moveaxis(array_x_y_ds_t, 0, -1), 0, -1)
-
-        # TODO rudimentary dataset construction, needs to be better
-
-        vars = {}
-        c = 0
-        for var in ds:
-            vars[var] = (("t", "x", "y"), array_ds_t_x_y[c])
-            c = c + 1
-
-        out_ds = xarray.Dataset(
-            data_vars=vars,
-            coords=dict(
-                x=ds.x,
-                y=ds.y,
-                t=output_time,
-            ),
+    def fit(self, X: xarray.Dataset, y=None, **fit_params):
+        """
+        Train the hyperparameters shared by all pixels on a random sample of pixels, by maximizing their summed
+        likelihood.
+
+        Args:
+            X: An input datacube with the variables to fuse, the first variable being the master output.
+            **fit_params: Optionally the ``time_dimension`` of the datacube.
+
+        Returns: The fitted transformer.
+        """
+        time_dimension = _time_dimension(X, fit_params.get("time_dimension", "t"))
+        times = _extract_date_axis(X).ordinals.astype(np.float64)
+        values = _pixel_array(X, time_dimension)
+
+        # every output needs a few observations to estimate its noise level and correlation with the master
+        candidates = np.flatnonzero(np.all(np.sum(~np.isnan(values), axis=-1) >= 2, axis=-1))
+        if len(candidates) == 0:
+            raise ValueError("Unable to train a MOGPR model, no pixel has enough valid observations")
+        rng = np.random.default_rng(self.random_state)
+        sample = values[rng.choice(candidates, min(self.n_samples, len(candidates)), replace=False)]
+
+        normalized, _, _ = _gp.normalize(sample)
+        self.model, _, _ = _gp.optimize(times, normalized, seed=self.random_state)
+        return self
+
+    def transform(self, X: xarray.Dataset, time_dimension: str = "t") -> xarray.Dataset:
+        """
+        Predict every pixel on a 5-daily time axis, using the trained hyperparameters.
+
+        Args:
+            X: An input datacube with the same variables as the one used for fitting.
+            time_dimension: The name of the time dimension of this datacube.
+
+        Returns: A gapfilled datacube.
+        """
+        if self.model is None:
+            raise ValueError("The MOGPRTransformer has to be fitted before it can transform a datacube")
+
+        dates = _extract_date_axis(X)
+        time_dimension = _time_dimension(X, time_dimension)
+        times = dates.ordinals.astype(np.float64)
+        output_timevec = np.arange(times.min(), times.max(), 5, dtype=np.float64)
+
+        result, _ = xarray.apply_ufunc(
+            _mogpr_shared,
+            X.to_array(dim="variable"),
+            kwargs=dict(time_in=times, output_timevec=output_timevec, params=self.model),
+            input_core_dims=[["variable", time_dimension]],
+            output_core_dims=[["variable", "t_new"], ["variable", "t_new"]],
         )
-        return out_ds
+        result = result.assign_coords(t_new=_DateAxis.from_ordinals(output_timevec).values)
+        result = result.rename(t_new=time_dimension).transpose(time_dimension, ...)
+        return result.to_dataset(dim="variable")
 
     def fit_transform(self, X: Union[xarray.Dataset, DataCube], y=None, **fit_params):
         if _openeo_exists and isinstance(X, DataCube):
@@ -133,7 +103,7 @@ class MOGPRTransformer(BaseEstimator):
 
             return mogpr_openeo(X)
 
-        return mogpr(X)
+        return self.fit(X, **fit_params).transform(X, time_dimension=fit_params.get("time_dimension", "t"))
 
 
 def mogpr(
@@ -143,6 +113,14 @@ def mogpr(
     prediction_period: str = None,
     include_uncertainties: bool = False,
     include_raw_inputs: bool = False,
+    n_jobs: int = 1,
+    executor: Executor = None,
+    backend: str = "gpy",
+    warm_start: bool = False,
+    max_iters: int = 1000,
+    group_masks: bool = False,
+    restarts: int = 1,
+    inducing_period: str = None,
 ) -> xarray.Dataset:
     """
     MOGPR (multi-output gaussian-process regression) integrates various timeseries into a single values. This allows to
@@ -157,22 +135,40 @@ def mogpr(
         prediction_period: The duration specified as ISO-8601, e.g. P5D: 5-daily, P1M: monthly. Defaults to input dates.
         include_uncertainties: Flag indicating if the uncertainties should be added to the output of the mogpr process.
         include_raw_inputs: Flag indicating if the raw inputs should be added to the output of the mogpr process.
+        n_jobs: The number of worker processes over which the pixels are distributed.
+        executor: An executor to distribute the pixels over instead of a new process pool, e.g. to reuse a pool for multiple calls.
+        backend: The gaussian process implementation, "gpy" to train a GPy model per pixel or "numpy" to use the
+            faster in-package implementation of the same model, which does not require GPy.
+        warm_start: Flag to visit neighbouring pixels consecutively and start the optimization of every pixel from the
+            hyperparameters of the previous one, which are usually close to its optimum. Warm started optimizations
+            stop at a relative likelihood change of 1e-5, which takes a few times fewer likelihood evaluations.
+        max_iters: The maximum number of optimizer iterations per pixel, e.g. 50 to also cap the cost of the few
+            pixels that converge slowly.
+        group_masks: Flag to train one set of hyperparameters per group of pixels with the same observation mask over
+            all variables, instead of per pixel. The kernel matrix is then factorized once per group. Only supported by
+            the numpy backend.
+        restarts: The number of optimizations per pixel from different starting points. Predictions are made with the
+            hyperparameters with the best likelihood, which makes the result robust against poor local optima.
+        inducing_period: The spacing of the inducing points of a sparse gaussian process, specified as ISO-8601, e.g.
+            P15D. The cost of a sparse model grows linearly with the number of observations instead of cubically,
+            which keeps long, dense time series tractable. Defaults to the exact model. Only supported by the numpy
+            backend.
 
     Returns: A gapfilled datacube.
 
     """
 
-    dates = _extract_dates(array)
+    dates = _extract_date_axis(array)
     time_dimension = _time_dimension(array, time_dimension)
 
     output_dates = dates
     output_time_dimension = "t_new"
 
     if prediction_period is not None:
-        output_dates = _output_dates(prediction_period, dates[0], dates[-1])
+        output_dates = _output_date_axis(prediction_period, dates.values[0], dates.values[-1])
 
-    dates_np = np.array([d.toordinal() for d in dates], dtype=np.float64)
-    output_dates_np = np.array([d.toordinal() for d in output_dates], dtype=np.float64)
+    dates_np = dates.ordinals.astype(np.float64)
+    output_dates_np = output_dates.ordinals.astype(np.float64)
 
     if variables is not None:
         array = array.drop_vars([var for var in list(array.data_vars) if var not in variables])
@@ -180,30 +176,39 @@ def mogpr(
     if len(output_dates) == 0:
         raise Exception("The result does not contain any output times, please select a larger range")
 
-    def callback(timeseries):
-        out_mean, out_std, _, _ = mogpr_1D(
-            timeseries,
-            list([dates_np for _ in timeseries]),
-            0,
-            output_timevec=output_dates_np,
-            nt=1,
-            trained_model=None,
+    if backend not in _BACKENDS:
+        raise ValueError(f"Unknown MOGPR backend {backend}, available backends: {list(_BACKENDS)}")
+
+    options = dict(warm_start=warm_start, max_iters=max_iters, restarts=restarts)
+    if backend == "numpy":
+        # the distances between the time axes are shared by all pixels
+        options["grid"] = _gp.TimeGrid.from_times(dates_np, output_dates_np)
+    if group_masks:
+        if backend != "numpy":
+            raise ValueError("Grouping pixels by observation mask is only supported by the numpy backend")
+        options["group_masks"] = True
+    if inducing_period is not None:
+        if backend != "numpy":
+            raise ValueError("Sparse gaussian processes are only supported by the numpy backend")
+        options["inducing"] = _output_date_axis(inducing_period, dates.values[0], dates.values[-1]).ordinals.astype(
+            np.float64
         )
-        return np.array(out_mean), np.array(out_std)
 
-    # setting vectorize to true is convenient, but has performance similar to for loop
+    def callback(timeseries):
+        return _mogpr_pixels(timeseries, dates_np, output_dates_np, n_jobs, executor, backend, **options)
+
+    # the callback receives all pixels at once, with the variable and time dimensions as last axes
     result, std = xarray.apply_ufunc(
         callback,
         array.to_array(dim="variable"),
         input_core_dims=[["variable", time_dimension]],
         output_core_dims=[["variable", output_time_dimension], ["variable", output_time_dimension]],
-        vectorize=True,
     )
     result["variable"] = [f"{variable}_FUSED" for variable in result["variable"].values]
 
     # Assign coordinates to the time dimensions
-    result = result.assign_coords({output_time_dimension: output_dates})
-    std = std.assign_coords({output_time_dimension: output_dates})
+    result = result.assign_coords({output_time_dimension: output_dates.values})
+    std = std.assign_coords({output_time_dimension: output_dates.values})
 
     merged = result
     if include_uncertainties:
@@ -221,6 +226,207 @@ def mogpr(
     return merged.to_dataset(dim="bands")
 
 
+def _mogpr_pixels(values, time_in, output_timevec, n_jobs=1, executor=None, backend="gpy", **options):
+    """
+    Apply MOGPR to a block of pixels, optionally distributed over a pool of worker processes.
+
+    GPy is bound to the global interpreter lock, so the pixels are split in shards of plain numpy arrays that are
+    sent to worker processes, instead of using threads.
+
+    Args:
+        values (array): Input data with shape (..., variables, time)
+        time_in (array): Vector containing the (ordinal) dates of the time dimension
+        output_timevec (array): Vector containing the dates on which output must be estimated
+        n_jobs (int): Number of worker processes
+        executor (Executor): Executor to submit the shards to, instead of creating a process pool
+        backend (str): Name of the gaussian process implementation
+        **options: Options of the backend, ``warm_start`` also makes the pixels be visited in a spatially coherent order
+
+    Returns:
+        a tuple (out_mean, out_std) of arrays with shape (..., variables, output time)
+    """
+    shape = values.shape
+    pixels = np.ascontiguousarray(values.reshape((-1,) + shape[-2:]), dtype=np.float64)
+    order = _serpentine_order(shape[:-2]) if options.get("warm_start") else np.arange(len(pixels))
+    pixels = pixels[order]
+
+    block = partial(_BACKENDS[backend], time_in=time_in, output_timevec=output_timevec, **options)
+    if executor is None and n_jobs <= 1:
+        out_mean, out_std = block(pixels)
+    else:
+        # a few shards per worker to balance the load, pixels with more observations take longer
+        shards = np.array_split(pixels, min(len(pixels), 4 * max(n_jobs, 1)))
+        if executor is None:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                results = list(pool.map(block, shards))
+        else:
+            results = list(executor.map(block, shards))
+        out_mean = np.concatenate([r[0] for r in results])
+        out_std = np.concatenate([r[1] for r in results])
+
+    out_mean[order], out_std[order] = out_mean.copy(), out_std.copy()
+    out_shape = shape[:-1] + (len(output_timevec),)
+    return out_mean.reshape(out_shape), out_std.reshape(out_shape)
+
+
+def _mogpr_block(pixels, time_in, output_timevec, warm_start=False, max_iters=1000, restarts=1):
+    """
+    Apply MOGPR to a block of pixels, one pixel at a time.
+
+    Args:
+        pixels (array): Input data with shape (pixels, variables, time)
+        time_in (array): Vector containing the (ordinal) dates of the time dimension
+        output_timevec (array): Vector containing the dates on which output must be estimated
+        warm_start (bool): Start the optimization of every pixel from the solution of the previous pixel
+        max_iters (int): Maximum number of optimizer iterations per pixel
+        restarts (int): Number of optimizations from different starting points per pixel
+
+    Returns:
+        a tuple (out_mean, out_std) of arrays with shape (pixels, variables, output time)
+    """
+    out_mean = np.empty(pixels.shape[:2] + (len(output_timevec),))
+    out_std = np.empty_like(out_mean)
+    previous = None
+    for i, timeseries in enumerate(pixels):
+        mean, std, qflag, model = mogpr_1D(
+            list(timeseries),
+            [time_in for _ in timeseries],
+            0,
+            output_timevec=output_timevec,
+            nt=restarts,
+            trained_model=None,
+            initial_params=previous,
+            max_iters=max_iters,
+            tol=None if previous is None else _WARM_START_TOL,
+        )
+        if warm_start and qflag and model != []:
+            previous = _gp.LCMParameters.from_gpy(model).as_initial().to_vector()
+        out_mean[i] = mean
+        out_std[i] = std
+    return out_mean, out_std
+
+
+def _mogpr_numpy_block(
+    pixels,
+    time_in,
+    output_timevec,
+    master_ind=0,
+    warm_start=False,
+    max_iters=1000,
+    restarts=1,
+    group_masks=False,
+    inducing=None,
+    grid=None,
+):
+    """
+    Apply MOGPR to a block of pixels with the numpy implementation of the gaussian process, one pixel at a time or one
+    group of pixels with the same observation mask at a time.
+
+    Args:
+        pixels (array): Input data with shape (pixels, variables, time)
+        time_in (array): Vector containing the (ordinal) dates of the time dimension
+        output_timevec (array): Vector containing the dates on which output must be estimated
+        master_ind (int): Index identifying the Master output, pixels without master observations are not predicted
+        warm_start (bool): Start the optimization of every pixel from the solution of the previous pixel
+        max_iters (int): Maximum number of optimizer iterations per pixel
+        restarts (int): Number of optimizations from different starting points per pixel
+        group_masks (bool): Train hyperparameters per group of pixels with the same observation mask, so that the
+            kernel matrix is built and factorized once per group and solved for all pixels of the group at once
+        inducing (array): Vector containing the (ordinal) dates of the inducing points of a sparse model
+        grid (TimeGrid): The distances between the input and output dates, shared by all pixels
+
+    Returns:
+        a tuple (out_mean, out_std) of arrays with shape (pixels, variables, output time)
+    """
+    normalized, mean, std = _gp.normalize(pixels)
+    observed = np.any(~np.isnan(normalized[:, master_ind]), axis=-1)
+    if group_masks:
+        groups = [members for members in _gp.MaskPlan(normalized).members if observed[members[0]]]
+    else:
+        groups = [[i] for i in np.flatnonzero(observed)]
+
+    previous = None
+    out_mean = np.full(pixels.shape[:2] + (len(output_timevec),), np.nan)
+    out_std = np.full_like(out_mean, np.nan)
+    for members in groups:
+        timeseries = normalized[members]
+        try:
+            params, _, _ = _gp.optimize(
+                time_in,
+                timeseries,
+                initial=previous,
+                max_iters=max_iters,
+                restarts=restarts,
+                inducing=inducing,
+                tol=None if previous is None else _WARM_START_TOL,
+            )
+        except np.linalg.LinAlgError:
+            continue
+        if warm_start:
+            previous = params.as_initial()
+        pred_mean, pred_var = _gp.predict(params, time_in, timeseries, output_timevec, inducing=inducing, grid=grid)
+        out_mean[members] = pred_mean * std[members, :, np.newaxis] + mean[members, :, np.newaxis]
+        out_std[members] = pred_var * std[members, :, np.newaxis]
+    return out_mean, out_std
+
+
+def _serpentine_order(shape):
+    """
+    Order in which the pixels of a grid are visited row by row, in alternating directions, so that consecutive pixels
+    are always neighbours.
+
+    Args:
+        shape (tuple): The shape of the (flattened, row-major) pixel grid
+
+    Returns: The indices of the pixels in visiting order.
+    """
+    rows = np.arange(int(np.prod(shape))).reshape(-1, shape[-1] if len(shape) > 0 else 1)
+    rows[1::2] = rows[1::2, ::-1]
+    return rows.ravel()
+
+
+_BACKENDS = {"gpy": _mogpr_block, "numpy": _mogpr_numpy_block}
+# a warm started optimization starts close to the optimum, so it stops once the likelihood barely improves instead
+# of refining flat directions of the likelihood that hardly change the prediction
+_WARM_START_TOL = 1e-5
+_EPS = np.finfo(np.float64).eps
+
+
+def _pixel_array(array, time_dimension):
+    """Stack the variables of a dataset into a (pixels, variables, time) array."""
+    stacked = array.to_array(dim="variable")
+    stacked = stacked.transpose(..., "variable", time_dimension)
+    return np.asarray(stacked.values, dtype=np.float64).reshape((-1,) + stacked.shape[-2:])
+
+
+def _mogpr_shared(values, time_in, output_timevec, params, master_ind=0):
+    """
+    Predict a block of pixels with hyperparameters shared by all pixels, by direct linear algebra.
+
+    Args:
+        values (array): Input data with shape (..., variables, time)
+        time_in (array): Vector containing the (ordinal) dates of the time dimension
+        output_timevec (array): Vector containing the dates on which output must be estimated
+        params (LCMParameters): The trained hyperparameters
+        master_ind (int): Index identifying the Master output, pixels without master observations are not predicted
+
+    Returns:
+        a tuple (out_mean, out_std) of arrays with shape (..., variables, output time)
+    """
+    shape = values.shape
+    normalized, mean, std = _gp.normalize(np.asarray(values, dtype=np.float64).reshape((-1,) + shape[-2:]))
+    pred_mean, pred_var = _gp.predict(params, time_in, normalized, output_timevec)
+
+    out_mean = pred_mean * std[..., np.newaxis] + mean[..., np.newaxis]
+    out_std = pred_var * std[..., np.newaxis]
+    unobserved = np.all(np.isnan(normalized[:, master_ind]), axis=-1)
+    out_mean[unobserved] = np.nan
+    out_std[unobserved] = np.nan
+
+    out_shape = shape[:-1] + (len(output_timevec),)
+    return out_mean.reshape(out_shape), out_std.reshape(out_shape)
+
+
 def _MOGPR_GPY_retrieval(data_in, time_in, master_ind, output_timevec, nt):
     """
     Function performing the multioutput gaussian-process regression at pixel level for gapfilling purposes
@@ -230,7 +436,8 @@ def _MOGPR_GPY_retrieval(data_in, time_in, master_ind, output_timevec, nt):
         time_in (array): vector containing the dates of each layer in the time dimension
         master_ind (int): Index identifying the Master output
         output_timevec (array) :vector containing the dates on which output must be estimated
-        nt [int]: # of time the GP training must be performed (def=1)
+        nt [int]: # of time the GP training must be performed from different starting points, the model with the best
+            likelihood is kept (def=1)
     Returns:
         a tuple
         (out_mean, out_std, out_qflag, out_model) where:
@@ -289,54 +496,44 @@ def _MOGPR_GPY_retrieval(data_in, time_in, master_ind, output_timevec, nt):
             nsamples, npixels = Xtest.shape
             noutputs = len(Ytrain)
 
-            for i_test in range(nt):
-                Yp = np.zeros((nsamples, noutputs))
-                Vp = np.zeros((nsamples, noutputs))
-                K = Matern32(1)
-                LCM = LCM(input_dim=1, num_outputs=noutputs, kernels_list=[K] * noutputs, W_rank=1)
-                model = GPCoregionalizedRegression(Xtrain, Ytrain, kernel=LCM.copy())
-                if not np.isnan(Ytrain[1]).all():
-                    try:
-                        # if trained_model is None:
+            K = Matern32(1)
+            kernel = LCM(input_dim=1, num_outputs=noutputs, kernels_list=[K] * noutputs, W_rank=1)
+            model = GPCoregionalizedRegression(Xtrain, Ytrain, kernel=kernel)
+            if not np.isnan(Ytrain[1]).all():
+                try:
+                    if nt > 1:
+                        # restarts from random hyperparameters, the model keeps the solution with the best likelihood;
+                        # they run sequentially, mogpr parallelizes over the pixels with n_jobs
+                        model.optimize_restarts(num_restarts=nt, robust=False, verbose=False, parallel=False)
+                    else:
                         model.optimize()
-                        list_tmp = [model.param_array]
+                    list_tmp = [model.param_array]
 
-                        for _ in range(noutput_timeseries):
-                            list_tmp.append(eval("model.sum.ICM" + str(_) + ".B.B"))
-                        out_model[x][y] = list_tmp
+                    for _ in range(noutput_timeseries):
+                        list_tmp.append(eval("model.sum.ICM" + str(_) + ".B.B"))
+                    out_model[x][y] = list_tmp
 
-                    except:
-                        out_qflag[x, y] = False
-                        continue
+                except:
+                    out_qflag[x, y] = False
+                    continue
 
-                    for out in range(noutputs):
-                        newX = Xtest.copy()
-
-                        newX = np.hstack([newX, out * np.ones((newX.shape[0], 1))])
-                        noise_dict = {"output_index": newX[:, -1:].astype(int)}
-                        Yp[:, None, out], Vp[:, None, out] = model.predict(newX, Y_metadata=noise_dict)
-
-                    if i_test == 0:
-                        for ind in range(noutput_timeseries):
-                            out_mean[ind][:, None, x, y] = (Yp[:, None, ind] * Y_std_vec[ind] + Y_mean_vec[ind]) / nt
-                            out_std[ind][:, None, x, y] = (Vp[:, None, ind] * Y_std_vec[ind]) / nt
-
-                    else:
-                        for ind in range(noutput_timeseries):
-                            out_mean[ind][:, None, x, y] = (
-                                out_mean[ind][:, None, x, y]
-                                + (Yp[:, None, ind] * Y_std_vec[ind] + Y_mean_vec[ind]) / nt
-                            )
-                            out_std[ind][:, None, x, y] = (
-                                out_std[ind][:, None, x, y] + (Vp[:, None, ind] * Y_std_vec[ind]) / nt
-                            )
+                # Prediction of all outputs in a single call
+                newX = np.column_stack([np.tile(Xtest[:, 0], noutputs), np.repeat(np.arange(noutputs), nsamples)])
+                noise_dict = {"output_index": newX[:, -1:].astype(int)}
+                Yp, Vp = model.predict(newX, Y_metadata=noise_dict)
+                Yp = Yp.reshape(noutputs, nsamples)
+                Vp = Vp.reshape(noutputs, nsamples)
 
-                    del Yp, Vp
+                for ind in range(noutput_timeseries):
+                    out_mean[ind][:, x, y] = Yp[ind] * Y_std_vec[ind] + Y_mean_vec[ind]
+                    out_std[ind][:, x, y] = Vp[ind] * Y_std_vec[ind]
 
     return out_mean, out_std, out_qflag, out_model
 
 
-def mogpr_1D(data_in, time_in, master_ind, output_timevec, nt, trained_model=None):
+def mogpr_1D(
+    data_in, time_in, master_ind, output_timevec, nt, trained_model=None, initial_params=None, max_iters=1000, tol=None
+):
     """
     Function performing the multioutput gaussian-process regression at pixel level for gapfilling purposes
 
@@ -345,7 +542,13 @@ def mogpr_1D(data_in, time_in, master_ind, output_timevec, nt, trained_model=Non
         time_in (list): List of numpy 1D arrays containing the (ordinal)dates of each variable in the time dimension
         master_ind (int): Index identifying the Master output
         output_timevec (array) : Vector containing the dates on which output must be estimated
-        nt [int]: # of times the GP training must be performed (def=1)
+        nt [int]: # of times the GP training must be performed from different starting points, the model with the best
+            likelihood is kept (def=1)
+        trained_model (Object): Model of which the hyperparameters are kept fixed
+        initial_params (array): Parameter array to start the optimization from, e.g. the solution of a neighbouring pixel
+        max_iters (int): Maximum number of optimizer iterations
+        tol (float): Relative change of the likelihood below which the optimization stops, defaults to the tolerance
+            of GPy
     Returns:
         a tuple
         (out_mean, out_std, out_qflag, out_model) where:
@@ -397,58 +600,48 @@ def mogpr_1D(data_in, time_in, master_ind, output_timevec, nt, trained_model=Non
         Xtrain = X_vec
         Ytrain = Y_vec
 
-        Yp = np.zeros((outputs_len, noutputs))
-        Vp = np.zeros((outputs_len, noutputs))
-
-        for i_test in range(nt):
-            try:
-                # Kernel
-                K = Matern32(input_dim=1)
-                # Linear Coregionalization
-                LCM = LCM(input_dim=1, num_outputs=noutputs, kernels_list=[K] * noutputs, W_rank=1)
-                if trained_model is None:
-                    # Linear coregionalization
-                    out_model = GPCoregionalizedRegression(Xtrain, Ytrain, kernel=LCM.copy())
-                    out_model.optimize()
-                else:
-                    # Extract hyperparams
-                    l = trained_model[".*ICM.*lengthscale"][0]
-                    v = trained_model[".*ICM.*var"][0]
-                    k = trained_model[".*ICM.*B.kappa"].values
-                    w = trained_model[".*ICM.*B.W"].values
-
-                    out_model = GPCoregionalizedRegression(Xtrain, Ytrain, kernel=LCM.copy())
-
-                    # Fix hyperparams
-                    out_model[".*ICM.*len"].constrain_fixed(l)
-                    out_model[".*ICM.*var"].constrain_fixed(v)
-                    out_model[".*ICM.*B.kappa"].constrain_fixed(k)
-                    out_model[".*ICM.*B.W"].constrain_fixed(w)
-
-                    out_model.optimize()
-
-            except:
-                out_qflag = False
-                continue
-
-            for out in range(noutputs):
-                newX = output_timevec[:, np.newaxis]
-                newX = np.hstack([newX, out * np.ones((newX.shape[0], 1))])
-
-                noise_dict = {"output_index": newX[:, -1:].astype(int)}
-                # Prediction
-                Yp[:, None, out], Vp[:, None, out] = out_model.predict(newX, Y_metadata=noise_dict)
-
-                if i_test == 0:
-                    out_mean[out][:, None] = (Yp[:, None, out] * Y_std_vec[out] + Y_mean_vec[out]) / nt
-                    out_std[out][:, None] = (Vp[:, None, out] * Y_std_vec[out]) / nt
-                else:
-                    out_mean[out][:, None] = (
-                        out_mean[out][:, None] + (Yp[:, None, out] * Y_std_vec[out] + Y_mean_vec[out]) / nt
-                    )
-                    out_std[out][:, None] = out_std[out][:, None] + (Vp[:, None, out] * Y_std_vec[out]) / nt
-
-            del Yp, Vp
+        try:
+            # Kernel
+            K = Matern32(input_dim=1)
+            # Linear Coregionalization
+            LCM = LCM(input_dim=1, num_outputs=noutputs, kernels_list=[K] * noutputs, W_rank=1)
+            out_model = GPCoregionalizedRegression(Xtrain, Ytrain, kernel=LCM.copy())
+            if trained_model is None:
+                if initial_params is not None:
+                    out_model[:] = initial_params
+            else:
+                # Extract hyperparams
+                l = trained_model[".*ICM.*lengthscale"][0]
+                v = trained_model[".*ICM.*var"][0]
+                k = trained_model[".*ICM.*B.kappa"].values
+                w = trained_model[".*ICM.*B.W"].values
+
+                # Fix hyperparams
+                out_model[".*ICM.*len"].constrain_fixed(l)
+                out_model[".*ICM.*var"].constrain_fixed(v)
+                out_model[".*ICM.*B.kappa"].constrain_fixed(k)
+                out_model[".*ICM.*B.W"].constrain_fixed(w)
+
+            # the L-BFGS-B optimizer of GPy takes the tolerance in units of the machine precision
+            options = dict(max_iters=max_iters) if tol is None else dict(max_iters=max_iters, bfgs_factor=tol / _EPS)
+            if nt > 1:
+                # restarts from random hyperparameters, the model keeps the solution with the best likelihood; they run
+                # sequentially, mogpr parallelizes over the pixels with n_jobs
+                out_model.optimize_restarts(num_restarts=nt, robust=False, verbose=False, parallel=False, **options)
+            else:
+                out_model.optimize(**options)
+
+        except:
+            out_qflag = False
+        else:
+            # Prediction of all outputs in a single call
+            newX = np.column_stack([np.tile(output_timevec, noutputs), np.repeat(np.arange(noutputs), outputs_len)])
+            noise_dict = {"output_index": newX[:, -1:].astype(int)}
+            Yp, Vp = out_model.predict(newX, Y_metadata=noise_dict)
+
+            Yp = Yp.reshape(noutputs, outputs_len) * np.array(Y_std_vec)[:, np.newaxis]
+            out_mean = list(Yp + np.array(Y_mean_vec)[:, np.newaxis])
+            out_std = list(Vp.reshape(noutputs, outputs_len) * np.array(Y_std_vec)[:, np.newaxis])
 
     # Flatten the series
     out_mean_list = []
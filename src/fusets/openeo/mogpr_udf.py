@@ -76,7 +76,8 @@ def apply_datacube(cube: XarrayDataCube, context: Dict) -> XarrayDataCube:
     @return:
     """
     load_venv()
-    home = write_gpy_cfg()
+    backend = context.get("backend", "gpy")
+    home = write_gpy_cfg() if backend == "gpy" else os.getenv("HOME")
 
     from fusets.mogpr import mogpr
 
@@ -96,6 +97,7 @@ def apply_datacube(cube: XarrayDataCube, context: Dict) -> XarrayDataCube:
         prediction_period=prediction_period,
         include_uncertainties=include_uncertainties,
         include_raw_inputs=include_raw_inputs,
+        backend=backend,
     )
     log_time("Calculated MOGPR", time)
     result_dc = XarrayDataCube(result.to_array(dim="bands").transpose(*dims).astype("float32"))
@@ -1,13 +1,13 @@
 import importlib.util
 from datetime import datetime
-from typing import Iterable, Sequence, Tuple, Union
+from typing import NamedTuple, Sequence, Union
 
 import numpy as np
 import xarray
-from scipy.signal import find_peaks
 from xarray import DataArray
 
-from fusets._xarray_utils import _extract_dates, _time_dimension
+from fusets import _kernels
+from fusets._xarray_utils import _extract_date_axis, _rechunk_time, _time_dimension
 
 _openeo_exists = importlib.util.find_spec("openeo") is not None
 if _openeo_exists:
@@ -19,6 +19,7 @@ def peakvalley(
     drop_thr: float = 0.15,
     rec_r: float = 1.0,
     slope_thr: float = -0.007,
+    backend: str = "numpy",
 ) -> Union[DataArray, DataCube]:
     """
     Algorithm for finding peak-valley patterns in the provided array.
@@ -28,6 +29,8 @@ def peakvalley(
         drop_thr: threshold value for the amplitude of the drop in the input feature
         rec_r: threshold value for the amplitude of the recovery, relative to the `drop_delta`
         slope_thr: threshold value for the slope where the peak should start
+        backend: "numpy" to process the pixels with array operations, or "numba" to run a compiled kernel in
+            parallel over the pixels, which gives identical results and falls back to "numpy" without numba
 
     Returns:
         data array with different values {1: peak, -1: valley, 0: between peak and valley, np.nan: other}
@@ -38,19 +41,21 @@ def peakvalley(
 
         return peak_valley_openeo(array, drop_thr, rec_r, slope_thr)
 
-    dates = np.array(_extract_dates(array))
+    dates = _extract_date_axis(array).values
     time_dimension = _time_dimension(array, None)
+    mask = _compiled_peakvalley_mask if _kernels.use_numba(backend) else _peakvalley_mask
 
     def callback(timeseries):
-        out, _ = peakvalley_f(dates, timeseries, drop_thr, rec_r, slope_thr)
-        return out
+        # all pixels of a block at once, the time dimension is moved to the last axis by apply_ufunc
+        return mask(dates, timeseries, drop_thr, rec_r, slope_thr)[0]
 
     result = xarray.apply_ufunc(
         callback,
-        array,
+        _rechunk_time(array, time_dimension),
         input_core_dims=[[time_dimension]],
         output_core_dims=[[time_dimension]],
-        vectorize=True,
+        dask="parallelized",
+        output_dtypes=[array.dtype],
     )
 
     result = result.rename("peak_valley_mask")
@@ -78,110 +83,520 @@ def peakvalley_f(
         array with different values {1: peak, -1: valley, 0: between peak and valley, np.nan: other}
     """
 
-    drop_thr, rec_thr = drop_thr, drop_thr * rec_r
-    result = np.full_like(y, np.nan)
+    result, (_, starts, ends) = _peakvalley_mask(x, y, drop_thr, rec_r, slope_thr)
+    return result, np.column_stack([starts, ends])
 
-    # find peaks and valleys in trend
-    nan_mask = np.isnan(y)
-    feature = y[~nan_mask]
-    timestamps = x[~nan_mask]
 
-    pk_ids = find_peaks(feature)[0]
-    vl_ids = find_peaks(-feature)[0]
-    if len(pk_ids) == 0 or len(vl_ids) == 0:
-        return result, []
+class PeakValleyState(NamedTuple):
+    """
+    Per-pixel state of the incremental peak-valley detection of `peakvalley_update`.
+
+    All fields are arrays with the shape of a time slice, the `stack_*` and `recent_date` fields have an extra last
+    axis that grows when a pixel needs more entries. Every field has to be persisted between acquisitions, none of them
+    can be recomputed without the past observations:
+
+    - `count` to `run_direction` hold the last two valid observations and the run of equal values that ends with the
+      last one, a new observation decides whether the last one, or the middle of that run, is a peak or a valley.
+    - `peak_value` to `valley_value` hold the extremes of the current sequence of merged drops, which decide whether
+      the next valley merges with it and whether the sequence drops more than `drop_thr`.
+    - `pending` to `low_date` hold the drop that waits for a recovery of `drop_thr * rec_r`, and `found` to
+      `held_end` a drop that recovered before the first peak, which is only reported with that peak.
+    - `stack_size` to `stack_peak_start` hold the observations that a deeper valley can still start from, with the
+      starts of the descents to them under `slope_thr`, and `recent_date` the dates that locate the middle of a run.
+
+    The state can be stored with e.g. `numpy.savez` and restored with `PeakValleyState(**numpy.load(path))` between
+    acquisitions, including the current length of the last axis.
+
+    Attributes:
+        count: the number of valid observations
+        first_date: the date of the first valid observation
+        last_value: the last valid observation
+        last_date: the date of the last valid observation
+        last_start: where a drop of the current sequence of merged drops to the last observation would start
+        last_peak_start: where a drop from the last peak to the last observation would start
+        prior_value: the valid observation before the last one
+        prior_date: the date of the observation before the last one
+        prior_start: the same as `last_start`, for the observation before the last one
+        prior_peak_start: the same as `last_peak_start`, for the observation before the last one
+        run_start: the index of the first observation of the run of equal values that ends with the last observation
+        run_direction: 1 if the series rose into that run, -1 if it dropped and 0 at the start of the series
+        peak_value: the value of the last peak
+        peak_date: the date of the last peak
+        peak_low: the lowest observation since the last peak
+        chain_value: the value of the first peak of the current sequence of merged drops
+        chain_date: the date of that peak
+        valley_value: the value of the last valley
+        pending: whether a drop that passes the drop threshold waits for its recovery
+        start_date: the start of the pending drop
+        low_value: the running minimum since the valley of the pending drop
+        low_date: the date of the running minimum
+        found: whether the series had a peak, drops that recover before the first peak are held back until then
+        held_start: the start of a recovered drop that is held back
+        held_end: the end of a recovered drop that is held back
+        stack_size: the number of candidate starts on the stack
+        stack_value: the candidate starts, the strictly decreasing observations since the first peak of the current
+            sequence that a deeper valley can still start from
+        stack_date: the dates of the candidate starts
+        stack_start: the same as `last_start`, for the candidate starts
+        stack_peak_start: the same as `last_peak_start`, for the candidate starts
+        recent_date: the dates of the last valid observations, by their index modulo the length of the last axis
+    """
+
+    count: np.ndarray
+    first_date: np.ndarray
+    last_value: np.ndarray
+    last_date: np.ndarray
+    last_start: np.ndarray
+    last_peak_start: np.ndarray
+    prior_value: np.ndarray
+    prior_date: np.ndarray
+    prior_start: np.ndarray
+    prior_peak_start: np.ndarray
+    run_start: np.ndarray
+    run_direction: np.ndarray
+    peak_value: np.ndarray
+    peak_date: np.ndarray
+    peak_low: np.ndarray
+    chain_value: np.ndarray
+    chain_date: np.ndarray
+    valley_value: np.ndarray
+    pending: np.ndarray
+    start_date: np.ndarray
+    low_value: np.ndarray
+    low_date: np.ndarray
+    found: np.ndarray
+    held_start: np.ndarray
+    held_end: np.ndarray
+    stack_size: np.ndarray
+    stack_value: np.ndarray
+    stack_date: np.ndarray
+    stack_start: np.ndarray
+    stack_peak_start: np.ndarray
+    recent_date: np.ndarray
+
+    @classmethod
+    def empty(cls, shape, capacity: int = 8) -> "PeakValleyState":
+        """The state of pixels without observations, with room for `capacity` stack entries and recent dates"""
+        shape = (shape,) if np.isscalar(shape) else tuple(shape)
+        fields = {}
+        for name in cls._fields:
+            field_shape = shape + (capacity,) if name in _PEAKVALLEY_AXES else shape
+            if name.endswith("_value") or name == "peak_low":
+                fields[name] = np.full(field_shape, np.nan)
+            elif name.endswith("_date") or name.endswith("_start") and name != "run_start" or name == "held_end":
+                fields[name] = np.full(field_shape, np.datetime64("NaT", "ns"))
+            else:
+                fields[name] = np.zeros(field_shape, dtype=bool if name in ("pending", "found") else np.int64)
+        return cls(**fields)
+
+
+_PEAKVALLEY_STACK = ("stack_value", "stack_date", "stack_start", "stack_peak_start")
+_PEAKVALLEY_AXES = _PEAKVALLEY_STACK + ("recent_date",)
+
+
+def peakvalley_update(
+    state: PeakValleyState,
+    date: datetime,
+    values: Union[np.ndarray, DataArray],
+    drop_thr: float = 0.15,
+    rec_r: float = 1.0,
+    slope_thr: float = -0.007,
+):
+    """
+    Incremental peak-valley detection, which processes a single new acquisition of every pixel.
+
+    Like `peakvalley`, the detector finds the peaks and valleys of every pixel, merges drops that do not recover enough
+    and reports a drop that passes `drop_thr` as soon as the series recovers more than `drop_thr * rec_r` above its
+    minimum. The reported start and end dates are those of the events of `peakvalley_f` on the valid observations so
+    far, so processing a float64 time series one acquisition at a time finds the same events as `peakvalley`.
+
+    Next to a few values per pixel, the state keeps the decreasing observations of the current drop that a deeper
+    valley could still start from, within `drop_thr` of the lowest observation since the last peak, and the dates
+    of the last observations of a run of equal values. Both typically hold a few entries, the last axis of the state
+    grows when needed, e.g. for a long and slow decline. Missing values leave the state of a pixel unchanged.
+
+    Args:
+        state: the state of every pixel after the previous acquisition, or `PeakValleyState.empty(shape)`
+        date: the date of the new acquisition, after the dates of all previous acquisitions
+        values: the new observation of every pixel, NaN where missing
+        drop_thr: threshold value for the amplitude of the drop in the input feature
+        rec_r: threshold value for the amplitude of the recovery, relative to the `drop_delta`
+        slope_thr: threshold value for the slope where the peak should start
+
+    Returns:
+        A tuple (state, start, end) with the new state and the start and end dates of the events confirmed by this
+        acquisition, NaT for pixels without a new event. For a data array input, start and end are data arrays.
+    """
+    y = np.asarray(values, dtype=np.float64)
+    shape, size = y.shape, y.size
+    fields = {
+        name: np.array(field).reshape(size, -1) if name in _PEAKVALLEY_AXES else np.array(field).reshape(size)
+        for name, field in zip(PeakValleyState._fields, state)
+    }
+    (rows,) = np.nonzero(~np.isnan(y.reshape(size)))
+    _reserve(fields, rows)
+
+    # only the pixels with a valid observation are updated
+    pixels = {name: field[rows] for name, field in fields.items()}
+    events = _peakvalley_step(pixels, y.reshape(size)[rows], np.datetime64(date, "ns"), drop_thr, rec_r, slope_thr)
+    for name, field in fields.items():
+        field[rows] = pixels[name]
+
+    start, end = np.full((2, size), np.datetime64("NaT", "ns"))
+    start[rows], end[rows] = events
+    state = PeakValleyState(
+        **{
+            name: field.reshape(shape + field.shape[1:] if name in _PEAKVALLEY_AXES else shape)
+            for name, field in fields.items()
+        }
+    )
+    start, end = start.reshape(shape), end.reshape(shape)
+
+    if isinstance(values, DataArray):
+        start, end = values.copy(data=start), values.copy(data=end)
+    return state, start, end
+
+
+def _reserve(fields, rows):
+    """Grow the last axis of the state, so that the pixels in `rows` have room for a new observation"""
+    capacity = fields["stack_value"].shape[1]
+    # a new observation adds at most one stack entry, a peak or valley in the middle of the current run of equal
+    # values needs the dates of the second half of the run
+    runs = fields["count"][rows] - fields["run_start"][rows]
+    needed = max(np.max(fields["stack_size"][rows], initial=0) + 1, np.max(runs // 2 + 2, initial=0))
+    if needed <= capacity:
+        return
+
+    grown = max(needed, 2 * capacity)
+    for name in _PEAKVALLEY_STACK:
+        field = fields[name]
+        fill = np.full((len(field), grown - capacity), np.nan if name == "stack_value" else np.datetime64("NaT", "ns"))
+        fields[name] = np.concatenate([field, fill], axis=1)
+
+    # the recent dates move to their index modulo the new capacity
+    last = fields["count"][:, np.newaxis] - 1
+    index = last - (last - np.arange(capacity)) % capacity
+    recent = np.full((len(last), grown), np.datetime64("NaT", "ns"))
+    np.put_along_axis(recent, index % grown, fields["recent_date"], axis=1)
+    fields["recent_date"] = recent
+
+
+def _shift_stack(s, amount):
+    """Remove the first `amount` stack entries of every pixel"""
+    capacity = s["stack_value"].shape[1]
+    index = np.minimum(np.arange(capacity) + amount[:, np.newaxis], capacity - 1)
+    for name in _PEAKVALLEY_STACK:
+        s[name] = np.take_along_axis(s[name], index, axis=1)
+    s["stack_size"] = s["stack_size"] - amount
+
+
+def _peakvalley_step(s, y, d, drop_thr, rec_r, slope_thr):
+    """Add a valid observation `y` of every pixel to the state fields `s`, returns the start and end of new events"""
+    nat = np.datetime64("NaT", "ns")
+    rec_thr = drop_thr * rec_r
+    rows, t, capacity = np.arange(len(y)), s["count"], s["stack_value"].shape[1]
+    start, end = np.full((2, len(y)), nat)
+
+    # a change of value ends a run of equal values, at a peak or a valley in the middle of the run when the direction
+    # turns, or at a peak at the first observation when the series starts dropping
+    s["first_date"][t == 0] = d
+    direction = np.sign(y - s["last_value"])
+    changed = (t > 0) & (direction != 0)
+    middle = s["recent_date"][rows, ((s["run_start"] + t - 1) // 2) % capacity]
+    middle = np.where(s["run_direction"] == 0, s["first_date"], middle)
+    initial = changed & (s["run_direction"] == 0) & (direction < 0)
+    peak = changed & (s["run_direction"] > 0) & (direction < 0)
+    valley = changed & (s["run_direction"] < 0) & (direction > 0)
+    s["run_direction"][changed], s["run_start"][changed] = direction[changed], t[changed]
+
+    # the drops from a new peak start at or after it
+    top = initial | peak
+    s["peak_value"][top], s["peak_date"][top], s["peak_low"][top] = s["last_value"][top], middle[top], y[top]
+    for name in ("last", "prior"):
+        after = top & (s[f"{name}_date"] >= middle)
+        s[f"{name}_peak_start"][after] = middle[after] if slope_thr > 0 else s[f"{name}_date"][after]
+    s["stack_peak_start"][rows[top], s["stack_size"][top] - 1] = s["last_peak_start"][top]
+
+    # drops that recovered before the first peak are reported with it
+    held = peak & ~np.isnat(s["held_start"])
+    start[held], end[held] = s["held_start"][held], s["held_end"][held]
+    s["held_start"][held] = s["held_end"][held] = nat
+    s["found"] |= peak
+
+    # a valley merges with the current sequence of drops when the drop to it follows a peak that did not recover enough
+    # and is lower than the first peak, and the valley is deeper than the last one, otherwise the sequence restarts
+    value = s["last_value"]
+    merged = (
+        valley
+        & (s["peak_value"] - s["valley_value"] < rec_thr)
+        & (value < s["valley_value"])
+        & (s["peak_value"] < s["chain_value"])
+    )
+    new = valley & ~merged
+    s["chain_value"][new], s["chain_date"][new] = s["peak_value"][new], s["peak_date"][new]
+    s["last_start"][new], s["prior_start"][new] = s["last_peak_start"][new], s["prior_peak_start"][new]
+    s["stack_start"][new] = s["stack_peak_start"][new]
+    stack = np.arange(capacity) < s["stack_size"][:, np.newaxis]
+    before = np.count_nonzero(stack & (s["stack_date"] < s["peak_date"][:, np.newaxis]), axis=1)
+    _shift_stack(s, np.where(new, before, 0))
+    s["valley_value"][valley] = value[valley]
+
+    # a sequence that drops more than the threshold starts from the last candidate above the threshold, and is pending
+    # until the series recovers, or until the next sequence that drops more than the threshold
+    filtered = valley & (s["chain_value"] - value > drop_thr)
+    stack = np.arange(capacity) < s["stack_size"][:, np.newaxis]
+    above = np.count_nonzero(stack & (s["stack_value"] - value[:, np.newaxis] > drop_thr), axis=1) - 1
+    s["start_date"][filtered] = s["stack_start"][rows[filtered], above[filtered]]
+    _shift_stack(s, np.where(filtered, above, 0))
+    s["pending"] |= filtered
+    s["low_value"][filtered], s["low_date"][filtered] = value[filtered], middle[filtered]
+
+    # where a drop to this observation would start, extending the descent of the last or the prior observation by
+    # one or two steps as long as they drop faster than the slope threshold
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope1 = (y - s["last_value"]) / ((d - s["last_date"]) // np.timedelta64(1, "D"))
+        slope2 = (y - s["prior_value"]) / ((d - s["prior_date"]) // np.timedelta64(1, "D"))
+
+    def descent_start(bound, last_start, prior_start):
+        step1 = (s["last_date"] >= bound) & (slope1 < slope_thr)
+        step2 = ~step1 & (s["prior_date"] >= bound) & (slope2 < slope_thr)
+        return np.where(step1, last_start, np.where(step2, prior_start, d))
+
+    current = descent_start(s["chain_date"], s["last_start"], s["prior_start"])
+    current_peak = descent_start(s["peak_date"], s["last_peak_start"], s["prior_peak_start"])
+
+    # the observation replaces the candidates that are not above it, the candidates before the last one that is more
+    # than the threshold above the lowest observation since the peak can no longer start a drop
+    stack = np.arange(capacity) < s["stack_size"][:, np.newaxis]
+    size = np.count_nonzero(stack & (s["stack_value"] > y[:, np.newaxis]), axis=1)
+    for name, entry in zip(_PEAKVALLEY_STACK, (y, d, current, current_peak)):
+        s[name][rows, size] = entry
+    s["stack_size"] = size + 1
+    s["peak_low"] = np.fmin(s["peak_low"], y)
+    stack = np.arange(capacity) < s["stack_size"][:, np.newaxis]
+    above = np.count_nonzero(stack & (s["stack_value"] - s["peak_low"][:, np.newaxis] > drop_thr), axis=1) - 1
+    _shift_stack(s, np.maximum(above, 0))
+    s["recent_date"][rows, t % capacity] = d
+
+    # the pending drop ends at its lowest observation, when the series recovers
+    recovered = s["pending"] & (y - s["low_value"] > rec_thr)
+    lower = s["pending"] & ~recovered & (y < s["low_value"])
+    s["low_value"][lower], s["low_date"][lower] = y[lower], d
+    report, hold = recovered & s["found"], recovered & ~s["found"]
+    start[report], end[report] = s["start_date"][report], s["low_date"][report]
+    s["held_start"][hold], s["held_end"][hold] = s["start_date"][hold], s["low_date"][hold]
+    s["pending"] &= ~recovered
+
+    for name in ("value", "date", "start", "peak_start"):
+        s[f"prior_{name}"] = s[f"last_{name}"]
+    s["last_value"], s["last_date"], s["last_start"], s["last_peak_start"] = (
+        y,
+        np.full(len(y), d),
+        current,
+        current_peak,
+    )
+    s["count"] = t + 1
+    return start, end
+
+
+def _peakvalley_mask(x: Sequence[datetime], y: np.ndarray, drop_thr: float, rec_r: float, slope_thr: float):
+    """
+    Peak-valley mask of a batch of time series, with the time dimension on the last axis.
+
+    Args:
+        x: array of timestamps
+        y: array of input feature values, with shape (..., time)
+
+    Returns:
+        A tuple (mask, events), where events are arrays (series, start, end) with the flat series index and the
+        positions of the start and end of every event among the valid observations of its series.
+    """
+    y = np.asarray(y)
+    values = y.reshape(-1, y.shape[-1])
+    result = np.full_like(values, np.nan)
+
+    # move the valid observations of every series to the front, the NaNs to the back
+    order = np.argsort(np.isnan(values), axis=-1, kind="stable")
+    feature = np.take_along_axis(values, order, axis=-1)
+    timestamps = np.asarray(x, dtype="datetime64[ns]")[order]
+    lengths = np.count_nonzero(~np.isnan(values), axis=-1)
+
+    events = _peakvalley_events(timestamps, feature, lengths, drop_thr, drop_thr * rec_r, slope_thr)
+    series, starts, ends = events
+
+    # the events of a series are ordered and only touch at their ends, where the start of the next event wins
+    steps = np.zeros((len(values), values.shape[-1] + 1), dtype=np.int64)
+    np.add.at(steps, (series, order[series, starts] + 1), 1)
+    np.add.at(steps, (series, order[series, ends]), -1)
+    result[np.cumsum(steps[:, :-1], axis=-1) > 0] = 0
+    result[series, order[series, ends]] = -1
+    result[series, order[series, starts]] = 1
+
+    return result.reshape(y.shape), events
+
+
+def _compiled_peakvalley_mask(x: Sequence[datetime], y: np.ndarray, drop_thr: float, rec_r: float, slope_thr: float):
+    """Peak-valley mask of a batch of time series with the compiled kernel, identical to `_peakvalley_mask`"""
+    y = np.asarray(y)
+    values = np.ascontiguousarray(y.reshape(-1, y.shape[-1]))
+    times = np.asarray(x, dtype="datetime64[ns]").view(np.int64)
+
+    # the thresholds of the amplitudes are compared in the precision of the values, like numpy does for python floats
+    dtype = values.dtype.type
+    result = _kernels.peakvalley_mask(times, values, dtype(drop_thr), dtype(drop_thr * rec_r), float(slope_thr))
+    return result.reshape(y.shape), None
+
+
+def _peakvalley_events(timestamps, feature, lengths, drop_thr: float, rec_thr: float, slope_thr: float):
+    """
+    Detect the peak-valley events of a batch of time series, in lockstep for all series and events.
+
+    Args:
+        timestamps: array of timestamps per series, shape (series, time)
+        feature: array of feature values per series, with the valid observations first, shape (series, time)
+        lengths: number of valid observations per series
+
+    Returns:
+        A tuple of arrays (series, start, end) with the series and the positions of the start and end of every event.
+    """
+    nseries = len(feature)
+
+    # find peaks and valleys in trend
+    pk_mask = _local_maxima(feature)
+    vl_mask = _local_maxima(-feature)
+    found = pk_mask.any(axis=-1) & vl_mask.any(axis=-1)
+    pk_mask[~found] = False
+    vl_mask[~found] = False
 
     # if first valley before peak, add initial peak
-    if vl_ids[0] < pk_ids[0]:
-        pk_ids = np.insert(pk_ids, 0, 0)
+    pk_mask[:, 0] |= found & (vl_mask.argmax(axis=-1) < pk_mask.argmax(axis=-1))
 
     # if last valley before last peak, add final valley
-    if vl_ids[-1] < pk_ids[-1]:
-        vl_ids = np.insert(vl_ids, len(pk_ids) - 1, len(feature) - 1)
-
-    pairs = np.transpose([pk_ids, vl_ids])
-    if len(pk_ids) == 0 or len(vl_ids) == 0:
-        return result, []
-
-    # merge fluctuations when dropping
-    idx = 0
-    new_pairs = [pairs[0]]
-    while idx < len(pairs) - 1:
-        idx += 1
-        pk2, vl2 = pairs[idx]
-        pk1, vl1 = new_pairs[-1]
-        y11, y12, y21, y22 = feature[[pk1, vl1, pk2, vl2]]
+    final = found & (vl_mask[:, ::-1].argmax(axis=-1) > pk_mask[:, ::-1].argmax(axis=-1))
+    vl_mask[final, lengths[final] - 1] = True
+
+    pk_series, pk_ids = np.nonzero(pk_mask)
+    vl_series, vl_ids = np.nonzero(vl_mask)
+    pk, vl = _pad(pk_series, pk_ids, nseries), _pad(vl_series, vl_ids, nseries)
+    valid = _pad(pk_series, np.ones_like(pk_ids, dtype=bool), nseries)
+    rows = np.arange(nseries)
+    if not valid.any():
+        # no series with both a peak and a valley, e.g. missing, constant or monotonic series
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+
+    # merge fluctuations when dropping, pair by pair for all series at once
+    group_start = valid.copy()
+    pk1, vl1 = pk[:, 0], vl[:, 0]
+    for idx in range(1, pk.shape[-1]):
+        pk2, vl2 = pk[:, idx], vl[:, idx]
+        y11, y12, y21, y22 = feature[rows, pk1], feature[rows, vl1], feature[rows, pk2], feature[rows, vl2]
 
         # merge with previous if second pair below threshold
         # and if second peak/valley below first peak/valley
-        if (y21 - y12 < rec_thr) & (y22 < y12) & (y21 < y11):
-            new_pairs[-1][1] = vl2
-        else:
-            new_pairs.append([pk2, vl2])
-    pairs = np.array(new_pairs)
+        merge = (y21 - y12 < rec_thr) & (y22 < y12) & (y21 < y11)
+        group_start[:, idx] &= ~merge
+        pk1 = np.where(group_start[:, idx], pk2, pk1)
+        vl1 = np.where(valid[:, idx], vl2, vl1)
+
+    # a merged pair spans from the peak of its first pair to the valley of its last pair
+    first = np.flatnonzero(group_start[valid])
+    last = np.append(first[1:], np.count_nonzero(valid)) - 1
+    series, pk, vl = np.nonzero(valid)[0][first], pk[valid][first], vl[valid][last]
 
     # apply filter on merged
-    mask = -np.diff(feature[pairs], axis=-1) > drop_thr
-    pairs = pairs[mask.squeeze(-1)]
-
-    # select eligible events
-    new_pairs = []
-    for p_id, (pk, vl) in enumerate(pairs):
-        eligible = False
-        assigned_peak = False  # flag to control if the peak has already been assigned
-        skip_next = False
-
-        # fix marker start
-        for idx in range(vl - 1, pk - 1, -1):
-            if skip_next:
-                skip_next = False
-                continue
-
-            # if the difference is above the threshold and the peak has not yet been assigned
-            if feature[idx] - feature[vl] > drop_thr and not assigned_peak:
-                start = idx
-                assigned_peak = True
-                continue
-
-            if assigned_peak:
-                # calculate derivative between current NDVI and the next NDVI
-                slope1 = _calculate_slope((idx + 1, idx), x, y)
-                slope2 = _calculate_slope((idx + 1, idx - 1), x, y)
-                if slope1 < slope_thr:
-                    start = idx
-
-                elif idx - 1 >= pk and slope2 < slope_thr:
-                    start = idx - 1
-                    skip_next = True
-                else:
-                    break
-
-        # find marker end
-        next_pk = pairs[p_id + 1][0] + 1 if p_id + 1 < len(pairs) else len(feature)
-        for idx in range(vl, next_pk):
-            if feature[idx] - feature[vl] > rec_thr:
-                rec = idx
-                eligible = True
-                break
-            if feature[idx] < feature[vl]:
-                vl = idx
-
-        if not eligible:
-            continue
-
-        new_pairs.append([start, vl])
-
-    pairs = np.array(new_pairs)
-
-    for pair in pairs:
-        s, e = timestamps[pair]
-        result[(x > s) & (x < e)] = 0
-        result[(x == s)] = 1
-        result[(x == e)] = -1
-
-    return result, pairs
-
-
-def _calculate_slope(indices: Tuple[int, int], x: Iterable[datetime], y: np.ndarray) -> float:
-    idx1, idx2 = indices
-    return (y[idx1] - y[idx2]) / (x[idx1] - x[idx2]).days
+    mask = -(feature[series, vl] - feature[series, pk]) > drop_thr
+    series, pk, vl = series[mask], pk[mask], vl[mask]
+
+    # fix marker start: the last position before the valley that is above the drop threshold
+    event, idx = _ranges(pk, vl)
+    above = feature[series[event], idx] - feature[series[event], vl[event]] > drop_thr
+    start = np.full(len(pk), -1)
+    np.maximum.at(start, event[above], idx[above])
+
+    # then move the start back as long as the series keeps dropping, with integer day deltas as in the time axis
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope1 = _slope(timestamps, feature, 1, 0)
+        slope2 = _slope(timestamps, feature, 1, -1)
+    idx = start - 1
+    active = idx >= pk
+    while active.any():
+        (event,) = np.nonzero(active)
+        i = idx[event]
+        down1 = slope1[series[event], i] < slope_thr
+        down2 = ~down1 & (i - 1 >= pk[event]) & (slope2[series[event], i] < slope_thr)
+        start[event] = np.where(down1, i, np.where(down2, i - 1, start[event]))
+        idx[event] = i - np.where(down2, 2, 1)
+        active[event] = (down1 | down2) & (idx[event] >= pk[event])
+
+    # find marker end: the recovery after the lowest point, before the next peak
+    next_pk = np.where(np.append(series[1:] == series[:-1], False), np.append(pk[1:], 0) + 1, lengths[series])
+    idx = vl.copy()
+    eligible = np.zeros(len(vl), dtype=bool)
+    active = idx < next_pk
+    while active.any():
+        (event,) = np.nonzero(active)
+        i = idx[event]
+        value, low = feature[series[event], i], feature[series[event], vl[event]]
+        recovered = value - low > rec_thr
+        eligible[event] = recovered
+        vl[event] = np.where(~recovered & (value < low), i, vl[event])
+        idx[event] = i + 1
+        active[event] = ~recovered & (i + 1 < next_pk[event])
+
+    return series[eligible], start[eligible], vl[eligible]
+
+
+def _local_maxima(values: np.ndarray) -> np.ndarray:
+    """
+    Mask of the local maxima along the last axis, identical to `scipy.signal.find_peaks` without conditions.
+
+    The maximum of a flat plateau is its middle position, rounded down. NaN values are never part of a maximum.
+    """
+    n = values.shape[-1]
+    positions = np.arange(n)
+    flat = values[:, 1:] == values[:, :-1]
+
+    # first and last position of the plateau of every position
+    left = np.maximum.accumulate(np.where(np.insert(~flat, 0, True, axis=-1), positions, 0), axis=-1)
+    right = np.where(np.append(~flat, np.ones((len(values), 1), dtype=bool), axis=-1), positions, n)
+    right = np.minimum.accumulate(right[:, ::-1], axis=-1)[:, ::-1]
+
+    rising = np.insert(values[:, :-1] < values[:, 1:], 0, False, axis=-1)
+    falling = np.append(values[:, 1:] < values[:, :-1], np.zeros((len(values), 1), dtype=bool), axis=-1)
+    rising = np.take_along_axis(rising, left, axis=-1)
+    falling = np.take_along_axis(falling, right, axis=-1)
+    return rising & falling & (positions == (left + right) // 2)
+
+
+def _slope(timestamps, feature, offset1: int, offset2: int) -> np.ndarray:
+    """Slope between the positions i + offset1 and i + offset2 of every position i, NaN outside of the series"""
+    n = feature.shape[-1]
+    lo, hi = max(0, -offset1, -offset2), n - max(0, offset1, offset2)
+    idx1, idx2 = np.arange(lo, hi) + offset1, np.arange(lo, hi) + offset2
+    days = (timestamps[:, idx1] - timestamps[:, idx2]) // np.timedelta64(1, "D")
+    slope = np.full(feature.shape, np.nan)
+    slope[:, lo:hi] = (feature[:, idx1] - feature[:, idx2]) / days
+    return slope
+
+
+def _ranges(starts: np.ndarray, stops: np.ndarray):
+    """The concatenated ranges [start, stop), as arrays of range indices and positions"""
+    sizes = stops - starts
+    index = np.repeat(np.arange(len(starts)), sizes)
+    offsets = np.arange(len(index)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    return index, starts[index] + offsets
+
+
+def _rank(groups: np.ndarray):
+    """The number of elements of every group, and the rank of every element within its group, for sorted groups"""
+    counts = np.bincount(groups) if len(groups) else np.zeros(0, dtype=np.int64)
+    return counts, np.arange(len(groups)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+def _pad(groups: np.ndarray, values: np.ndarray, ngroups: int) -> np.ndarray:
+    """Arrange the values of sorted groups in the rows of a 2-D array, padded with zeros"""
+    counts, rank = _rank(groups)
+    out = np.zeros((ngroups, counts.max(initial=1)), dtype=values.dtype)
+    out[groups, rank] = values
+    return out
@@ -6,11 +6,16 @@ import pandas as pd
 import xarray
 from xarray import DataArray
 
-from fusets._xarray_utils import _extract_dates, _time_dimension
+from fusets import _kernels
+from fusets._xarray_utils import _extract_date_axis, _rechunk_time, _time_dimension
 
 
 def temporal_outliers(
-    array: DataArray, window: Union[int, str], threshold: float, variables: List[str] = None
+    array: DataArray,
+    window: Union[int, str],
+    threshold: float,
+    variables: List[str] = None,
+    backend: str = "numpy",
 ) -> DataArray:
     """
     Algorithm for a z-score-based filtering of time series outliers
@@ -20,26 +25,35 @@ def temporal_outliers(
         window: pandas-based window-size, can be integer or string, e.g., '20D' for a 20 days window
         threshold: the threshold to be applied on the z-scores for filtering outlier (amount of st. dev.)
         variables: The list of variable names that should be affected, or None to use all variables
+        backend: "numpy" to filter all pixels at once with cumulative sums over the rolling windows, or "numba" to run a
+            compiled kernel in parallel over the pixels, which falls back to "numpy" without numba
 
     Returns:
         data array with outliers filtered out and with the rolling mean of time series
     """
 
-    dates = np.array(_extract_dates(array))
+    dates = _extract_date_axis(array).values
     time_dimension = _time_dimension(array, None)
 
     if variables is not None:
         array = array.drop_vars([var for var in list(array.data_vars) if var not in variables])
 
+    # the windows only depend on the dates, so they are shared by all pixels
+    start, end, min_periods = _window_bounds(dates, window)
+    filter_outliers = _kernels.temporal_outliers if _kernels.use_numba(backend) else _rolling_outliers
+
     def callback(timeseries):
-        return temporal_outliers_f(dates, timeseries, window, threshold)
+        # all pixels of a block at once, the time dimension is moved to the last axis by apply_ufunc
+        values = np.ascontiguousarray(timeseries.reshape(-1, len(dates)), dtype=np.float64)
+        return filter_outliers(values, start, end, min_periods, threshold).reshape(timeseries.shape)
 
     result = xarray.apply_ufunc(
         callback,
-        array,
+        _rechunk_time(array, time_dimension),
         input_core_dims=[[time_dimension]],
         output_core_dims=[[time_dimension]],
-        vectorize=True,
+        dask="parallelized",
+        output_dtypes=[np.float32],
     )
 
     return result
@@ -68,3 +82,61 @@ def temporal_outliers_f(x: Sequence[datetime], y: np.ndarray, window: Union[int,
     ts_mask = ts_zscore.between(-threshold, threshold)
 
     return timeseries.where(ts_mask, ts_mean).to_numpy(dtype="float32")
+
+
+def _window_bounds(x: Sequence[datetime], window: Union[int, str]):
+    """
+    Positions of the centered rolling windows of every date, closed on both sides, as in `temporal_outliers_f`.
+
+    Args:
+        x: array of timestamps
+        window: pandas-based window-size, can be integer or string, e.g., '20D' for a 20 days window
+
+    Returns:
+        A tuple (start, end, min_periods) with the first position and the position after the last position of the
+        window of every date, and the minimum number of valid observations of a window, following pandas.
+    """
+    n = len(x)
+    if isinstance(window, (int, np.integer)):
+        end = np.arange(n) + 1 + (window - 1) // 2
+        start = end - window - 1
+        return np.clip(start, 0, n), np.clip(end, 0, n), int(window)
+
+    times = np.asarray(x, dtype="datetime64[ns]").view(np.int64)
+    half = pd.Timedelta(window).value // 2
+    start = np.searchsorted(times, times - half, side="left")
+    end = np.searchsorted(times, times + half, side="right")
+    return start, end, 1
+
+
+def _rolling_outliers(values: np.ndarray, start: np.ndarray, end: np.ndarray, min_periods: int, threshold: float):
+    """
+    Replace the outliers of every row of a (pixel, time) array by their rolling mean, with the windows of
+    `_window_bounds`.
+
+    The rolling sums of all pixels are differences of cumulative sums at the window bounds. Missing values do not
+    count as observations, and the values are centered on their mean per pixel to keep the variance accurate.
+
+    Returns:
+        float32 array with outliers replaced by the rolling mean
+    """
+    valid = ~np.isnan(values)
+    with np.errstate(invalid="ignore"):
+        center = np.nanmean(np.where(valid.any(axis=-1, keepdims=True), values, 0), axis=-1, keepdims=True)
+    centered = np.where(valid, values - center, 0)
+
+    def rolling_sum(x):
+        cumulative = np.concatenate([np.zeros(x.shape[:-1] + (1,)), np.cumsum(x, axis=-1)], axis=-1)
+        return cumulative[:, end] - cumulative[:, start]
+
+    count = rolling_sum(valid.astype(np.float64))
+    total = rolling_sum(centered)
+    squares = rolling_sum(centered**2)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(count >= max(min_periods, 1), total / count, np.nan)
+        variance = np.where(count >= max(min_periods, 2), (squares - total * mean) / (count - 1), np.nan)
+        zscore = (values - center - mean) / np.sqrt(np.maximum(variance, 0))
+
+    mean += center
+    return np.where((zscore >= -threshold) & (zscore <= threshold), values, mean).astype(np.float32)
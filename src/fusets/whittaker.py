@@ -1,14 +1,16 @@
+import hashlib
 import importlib.util
 import math
-from array import array
+import threading
+from collections import OrderedDict
 from datetime import timedelta
 from typing import Union
 
 import numpy as np
 import xarray
-from xarray import DataArray
+from xarray import DataArray, Dataset
 
-from fusets._xarray_utils import _extract_dates, _output_dates, _time_dimension
+from fusets._xarray_utils import _extract_date_axis, _output_date_axis, _rechunk_time, _time_dimension
 from fusets.base import BaseEstimator
 
 _openeo_exists = importlib.util.find_spec("openeo") is not None
@@ -57,23 +59,49 @@ class WhittakerTransformer(BaseEstimator):
             smoothing_lambda: The smoothing factor.
             time_dimension: The name of the time dimension of this datacube. Only needs to be specified to resolve ambiguities.
             prediction_period: The duration specified as ISO-8601, e.g. P5D: 5-daily, P1M: monthly. First date of the time dimension is used as starting point.
+            optimize_lambda: Select the smoothing factor per pixel with the V-curve criterion instead of using `smoothing_lambda`.
+            lambda_candidates: The candidate log10(lambda) values evaluated when `optimize_lambda` is set.
+            sparse_grid: Solve only on the input and output dates instead of on a daily grid.
+            robust: Iteratively reweight the observations with the residuals of the fit, "envelope" or "zscore".
+            robust_iterations: The number of reweighting iterations when `robust` is set.
+            robust_threshold: The z-score above which observations are discarded when `robust` is "zscore".
 
-        Returns: A smoothed datacube
+        Returns: A smoothed datacube, or a dataset with the smoothed datacube and the selected lambda per pixel when `optimize_lambda` is set.
 
         """
 
         smoothing = fit_params.get("smoothing_lambda", 10000)
-        if _openeo_exists and isinstance(array, DataCube):
+        if _openeo_exists and isinstance(X, DataCube):
             from .openeo import whittaker as whittaker_openeo
 
-            return whittaker_openeo(array, smoothing)
+            return whittaker_openeo(X, smoothing)
 
-        return whittaker(X, smoothing, fit_params.get("time_dimension", "t"), fit_params.get("prediction_period", None))
+        return whittaker(
+            X,
+            smoothing,
+            fit_params.get("time_dimension", "t"),
+            fit_params.get("prediction_period", None),
+            fit_params.get("optimize_lambda", False),
+            fit_params.get("lambda_candidates", None),
+            fit_params.get("sparse_grid", False),
+            fit_params.get("robust", None),
+            fit_params.get("robust_iterations", 3),
+            fit_params.get("robust_threshold", 3.0),
+        )
 
 
 def whittaker(
-    array: Union[DataArray, DataCube], smoothing_lambda=10000, time_dimension="t", prediction_period=None
-) -> Union[DataArray, DataCube]:
+    array: Union[DataArray, DataCube],
+    smoothing_lambda=10000,
+    time_dimension="t",
+    prediction_period=None,
+    optimize_lambda=False,
+    lambda_candidates=None,
+    sparse_grid=False,
+    robust=None,
+    robust_iterations=3,
+    robust_threshold=3.0,
+) -> Union[DataArray, Dataset, DataCube]:
     """
     Convenience method for whittaker. See :meth:`fusets.whittaker.WhittakerTransformer.fit_transform` for more detailed documentation.
 
@@ -82,8 +110,24 @@ def whittaker(
         smoothing_lambda: The smoothing factor.
         time_dimension: The name of the time dimension of this datacube. Only needs to be specified to resolve ambiguities.
         prediction_period: The duration specified as ISO-8601, e.g. P5D: 5-daily, P1M: monthly. First date of the time dimension is used as starting point.
-
-    Returns: A smoothed datacube
+        optimize_lambda: Select the smoothing factor per pixel with the V-curve criterion instead of using `smoothing_lambda`.
+            All candidates are evaluated for all pixels together, the runtime grows linearly with the number of candidates.
+        lambda_candidates: The candidate log10(lambda) values evaluated when `optimize_lambda` is set, in increasing order.
+            The selected lambda is the midpoint between two consecutive candidates.
+        sparse_grid: Solve only on the input and output dates instead of on a daily grid, using divided differences for
+            the unevenly spaced dates. The result approximates the daily solution, and is considerably faster for long
+            timeseries, e.g. about three times for a 5-daily series with a 5-daily `prediction_period`.
+        robust: Iteratively reweight the observations with the residuals of the previous fit, to clean and smooth the
+            timeseries in a single pass instead of running :func:`fusets.temporal_outliers` first. "envelope" fits
+            the upper envelope, observations above the fit get a weight of 0.9 and the others 0.1, which suppresses
+            cloud and shadow dips. "zscore" discards the observations of which the residual is more than
+            `robust_threshold` standard deviations away from the mean residual.
+        robust_iterations: The number of reweighting iterations when `robust` is set, every iteration costs one
+            factorization per pixel.
+        robust_threshold: The z-score above which observations are discarded when `robust` is "zscore".
+
+    Returns: A smoothed datacube. When `optimize_lambda` is set, a dataset with the smoothed datacube as `smoothed` and
+        the selected lambda per pixel as `lambda`.
 
     """
     if _openeo_exists and isinstance(array, DataCube):
@@ -91,30 +135,72 @@ def whittaker(
 
         return whittaker_openeo(array, smoothing_lambda)
 
-    dates = _extract_dates(array)
+    if robust not in _ROBUST_WEIGHTS:
+        raise ValueError(f"Unknown robust mode '{robust}', expected one of {list(_ROBUST_WEIGHTS)}.")
+
+    dates = _extract_date_axis(array)
     time_dimension = _time_dimension(array, time_dimension)
+    robust_options = dict(robust=robust, iterations=robust_iterations, threshold=robust_threshold)
 
     output_dates = dates
     output_time_dimension = time_dimension
 
     if prediction_period is not None:
-        output_dates = _output_dates(prediction_period, dates[0], dates[-1])
+        output_dates = _output_date_axis(prediction_period, dates.values[0], dates.values[-1])
         output_time_dimension = "t_new"
 
-    def callback(timeseries):
-        _, _, Zd, XXd = whittaker_f(dates, timeseries, smoothing_lambda, 1)
-        dates_mask = np.isin(XXd, output_dates)
-        return Zd[dates_mask]
+    day_offsets = dates.days
+    output_offsets = dates.offsets(output_dates)
 
-    result = xarray.apply_ufunc(
-        callback, array, input_core_dims=[[time_dimension]], output_core_dims=[[output_time_dimension]], vectorize=True
+    # dask backed inputs are processed lazily per spatial chunk, which requires the complete timeseries in each chunk
+    array = _rechunk_time(array, time_dimension)
+    dask_kwargs = dict(
+        dask="parallelized", dask_gufunc_kwargs=dict(output_sizes={output_time_dimension: len(output_dates)})
     )
 
-    result[output_time_dimension] = output_dates
+    if optimize_lambda:
+        llas = _DEFAULT_LAMBDA_CANDIDATES if lambda_candidates is None else lambda_candidates
+
+        def callback(timeseries):
+            return _whittaker_batch(
+                day_offsets, timeseries, None, output_offsets, llas=llas, sparse=sparse_grid, **robust_options
+            )
+
+        result, lambdas = xarray.apply_ufunc(
+            callback,
+            array,
+            input_core_dims=[[time_dimension]],
+            output_core_dims=[[output_time_dimension], []],
+            output_dtypes=[np.float64, np.float64],
+            **dask_kwargs,
+        )
+    else:
+
+        def callback(timeseries):
+            return _whittaker_batch(
+                day_offsets, timeseries, smoothing_lambda, output_offsets, sparse=sparse_grid, **robust_options
+            )
+
+        # the callback receives the full block with time as last axis, all pixels are smoothed together
+        result = xarray.apply_ufunc(
+            callback,
+            array,
+            input_core_dims=[[time_dimension]],
+            output_core_dims=[[output_time_dimension]],
+            output_dtypes=[np.float64],
+            **dask_kwargs,
+        )
+
+    result[output_time_dimension] = output_dates.values
     result = result.rename({output_time_dimension: time_dimension})
 
     # make sure to preserve dimension order
-    return result.transpose(*array.dims)
+    result = result.transpose(*array.dims)
+
+    if optimize_lambda:
+        lambdas = lambdas.transpose(*[d for d in array.dims if d != time_dimension])
+        return Dataset({"smoothed": result, "lambda": lambdas})
+    return result
 
 
 def whittaker_f(x, y, lmbd, d):
@@ -145,9 +231,6 @@ def whittaker_f(x, y, lmbd, d):
         Returns daily (default) and d spacing (d in days defined by the user) smoothed and gap-filled time series and the corresponding time date vector.
     """
 
-    # deferred import to avoid dependency issues with the whitakker library
-    from vam.whittaker import ws2d, ws2doptv
-
     # minimum and maximum dates
     D1 = get_all_dates(x)
     D11 = D1[~np.isnan(y)]
@@ -167,8 +250,8 @@ def whittaker_f(x, y, lmbd, d):
 
     # apply filter
     if isinstance(lmbd, list):
-        # the whitakker library also allows to choose a lambda value from a list. Note that values in this list need to be log10(lambda) (or so it seems)
-        z_, the_lambda = ws2doptv(t, w=w, llas=array("d", lmbd))
+        # choose a lambda value from a list, note that values in this list need to be log10(lambda)
+        z_, the_lambda = ws2doptv(t, w=w, llas=lmbd)
     else:
         z_ = ws2d(t, lmbd, w)
     z1_ = np.array(z_)
@@ -197,3 +280,482 @@ def get_all_dates(x):
     D = [i.toordinal() for i in x]
     D1 = np.array(D) - D[0]
     return D1
+
+
+def ws2d(y, lmbd, w):
+    """
+    Weighted Whittaker smoother with a second order difference penalty, solving (W + lambda D'D) z = W y.
+
+    Compatible with ``vam.whittaker.ws2d``, but also accepts 2-D input to smooth multiple series in a single call.
+    The symmetric pentadiagonal system is factorized once for every distinct weight vector.
+
+    Args:
+       y (ndarray) : series to smooth, with shape (n,) or (n_series, n)
+       lmbd (double) : lambda value
+       w (ndarray) : weights, with the same shape as y
+
+    Returns:
+        The smoothed series, with the same shape as y
+    """
+    y = np.asarray(y, dtype="double")
+    w = np.broadcast_to(np.asarray(w, dtype="double"), y.shape)
+    y2 = y.reshape(-1, y.shape[-1])
+    w2 = w.reshape(-1, y.shape[-1])
+
+    weights, index = np.unique(w2, axis=0, return_inverse=True)
+    rhs = np.where(w2 != 0, w2 * y2, 0)
+    z = _pentadiagonal_solve(factorization_cache.factorize(weights.T, lmbd), rhs.T, index.ravel())
+    return z.T.reshape(y.shape)
+
+
+def ws2doptv(y, w, llas):
+    """
+    Weighted Whittaker smoother with the lambda value selected by V-curve optimization.
+
+    For every candidate lambda, the log10 of the weighted residual sum of squares and of the roughness penalty are
+    computed. The optimal lambda is the midpoint of the two consecutive candidates between which this curve moves the
+    least (Eilers et al., 2017).
+
+    Compatible with ``vam.whittaker.ws2doptv``, but also accepts 2-D input to smooth multiple series in a single call.
+
+    Args:
+       y (ndarray) : series to smooth, with shape (n,) or (n_series, n)
+       w (ndarray) : weights, with the same shape as y
+       llas (list) : candidate log10(lambda) values, in increasing order
+
+    Returns:
+        A tuple (z, lopt) with the smoothed series and the optimal lambda value (one per series for 2-D input)
+    """
+    y = np.asarray(y, dtype="double")
+    w = np.broadcast_to(np.asarray(w, dtype="double"), y.shape)
+    llas = np.asarray(llas, dtype="double")
+    if len(llas) < 2:
+        raise ValueError(f"V-curve optimization requires at least two candidate lambda values, got {list(llas)}")
+
+    y2 = y.reshape(-1, y.shape[-1])
+    w2 = w.reshape(-1, y.shape[-1])
+
+    fits = np.empty((len(llas), y2.shape[0]))
+    pens = np.empty((len(llas), y2.shape[0]))
+    for i, llambda in enumerate(llas):
+        z = ws2d(y2, 10**llambda, w2)
+        fits[i] = np.sum(np.where(w2 != 0, w2 * (y2 - z) ** 2, 0), axis=-1)
+        pens[i] = np.sum(np.diff(z, n=2, axis=-1) ** 2, axis=-1)
+
+    lopt = _vcurve_optimum(fits, pens, llas)
+
+    rhs = np.where(w2 != 0, w2 * y2, 0)
+    z = _pentadiagonal_solve(factorization_cache.factorize(w2.T, lopt), rhs.T).T
+    z = z.reshape(y.shape)
+
+    if y.ndim == 1:
+        return z, lopt[0]
+    return z, lopt.reshape(y.shape[:-1])
+
+
+class FactorizationCache:
+    """
+    Least recently used cache of factorized Whittaker systems W + lambda D'D, bounded by memory.
+
+    Pixels in a tile usually share the same dates and often the same cloud mask, so the same system is factorized
+    over and over. Entries are keyed on the length of the daily grid, a hash of the weight vector and lambda, a cache
+    hit only requires a back-substitution to smooth a series.
+
+    Attributes:
+        max_bytes: The maximum amount of memory used by the cached factorizations.
+        hits: The number of factorizations that were found in the cache.
+        misses: The number of factorizations that had to be computed.
+    """
+
+    def __init__(self, max_bytes: int = 128 * 2**20):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """
+        Remove all entries from the cache and reset the hit and miss counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def factorize(self, w, lmbd, spacing=None):
+        """
+        Factorize a batch of Whittaker systems, reusing cached factorizations where possible.
+
+        Args:
+            w (ndarray): weights with shape (n, systems)
+            lmbd (double or ndarray): lambda value, or an array of lambda values with shape (systems,)
+            spacing (ndarray): distance between consecutive nodes, defaults to a daily grid
+
+        Returns:
+            The factorization as returned by :func:`_pentadiagonal_factor`
+        """
+        n, systems = w.shape
+        lmbd = np.broadcast_to(np.asarray(lmbd, dtype="double"), (systems,))
+        rows = np.ascontiguousarray(w.T, dtype="double")
+        grid = None if spacing is None else hashlib.blake2b(np.asarray(spacing, dtype="double").tobytes()).digest()
+        keys = [
+            (n, grid, hashlib.blake2b(rows[i].tobytes(), digest_size=16).digest(), float(lmbd[i]))
+            for i in range(systems)
+        ]
+
+        factor = np.empty((3, n, systems))
+        missing = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    factor[:, :, i] = entry
+            self.hits += systems - len(missing)
+            self.misses += len(missing)
+
+        if len(missing) > 0:
+            first = [columns[0] for columns in missing.values()]
+            computed = np.stack(_pentadiagonal_factor(rows[first].T, lmbd[first], spacing))
+            with self._lock:
+                for j, (key, columns) in enumerate(missing.items()):
+                    factor[:, :, columns] = computed[:, :, j, np.newaxis]
+                    self._put(key, computed[:, :, j].copy())
+
+        return factor[0], factor[1], factor[2]
+
+    def _put(self, key, entry):
+        if key in self._entries or entry.nbytes > self.max_bytes:
+            return
+        while self.nbytes + entry.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+        self._entries[key] = entry
+        self.nbytes += entry.nbytes
+
+
+factorization_cache = FactorizationCache()
+
+
+# maximum number of values in a single (daily grid x pixels) block processed by the batched solver
+_BLOCK_SIZE = 2**22
+
+# default log10(lambda) candidates for the lambda optimization, the midpoints are the decades 1 to 10000
+_DEFAULT_LAMBDA_CANDIDATES = [-0.5, 0.5, 1.5, 2.5, 3.5, 4.5]
+
+
+def _difference_coefficients(n, spacing=None):
+    """
+    Second order divided differences on a grid of n nodes.
+
+    On unevenly spaced nodes, each difference is weighted with the length of the interval it covers, so the penalty
+    approximates the integrated squared second derivative. On a daily grid this reduces to the plain second order
+    differences.
+
+    Args:
+        n (int): number of nodes
+        spacing (ndarray): distance between consecutive nodes, defaults to a daily grid
+
+    Returns:
+        A tuple (c0, c1, c2, m) with the coefficients of the nodes i, i+1, i+2 of every difference and its weight.
+    """
+    h = np.ones(max(n - 1, 0)) if spacing is None else np.asarray(spacing, dtype="double")
+    h1, h2 = h[:-1], h[1:]
+    return 2 / (h1 * (h1 + h2)), -2 / (h1 * h2), 2 / (h2 * (h1 + h2)), (h1 + h2) / 2
+
+
+def _penalty_diagonals(n, spacing=None):
+    """
+    Diagonals of the penalty matrix D'MD, with D the second order difference matrix of a series of length n and M the
+    weights of the differences (the identity on a daily grid).
+
+    Returns:
+        The main diagonal, the first and the second upper diagonal.
+    """
+    c0, c1, c2, m = _difference_coefficients(n, spacing)
+    a = np.zeros(n)
+    a[:-2] += m * c0 * c0
+    a[1:-1] += m * c1 * c1
+    a[2:] += m * c2 * c2
+    b = np.zeros(max(n - 1, 0))
+    b[:-1] += m * c0 * c1
+    b[1:] += m * c1 * c2
+    c = m * c0 * c2
+    return a, b, c
+
+
+def _penalty(z, spacing=None):
+    """
+    Roughness penalty z'D'MDz of a batch of series with shape (n, batch).
+    """
+    c0, c1, c2, m = _difference_coefficients(z.shape[0], spacing)
+    differences = c0[:, np.newaxis] * z[:-2] + c1[:, np.newaxis] * z[1:-1] + c2[:, np.newaxis] * z[2:]
+    return np.sum(m[:, np.newaxis] * differences**2, axis=0)
+
+
+def _pentadiagonal_factor(w, lmbd, spacing=None):
+    """
+    LDL' factorization of the symmetric pentadiagonal system W + lambda D'MD.
+
+    All systems in the batch are factorized in lockstep, the recursion only loops over the time axis.
+
+    Args:
+        w (ndarray): weights with shape (n, batch)
+        lmbd (double or ndarray): lambda value, or an array of lambda values with shape (batch,)
+        spacing (ndarray): distance between consecutive nodes, defaults to a daily grid
+
+    Returns:
+        A tuple (d, e, f) holding the diagonal of D and the two subdiagonals of the unit lower triangular L.
+    """
+    n = w.shape[0]
+    a, b, c = _penalty_diagonals(n, spacing)
+
+    d = np.empty_like(w, dtype="double")
+    e = np.zeros_like(d)
+    f = np.zeros_like(d)
+
+    for i in range(n):
+        d[i] = w[i] + lmbd * a[i]
+        if i >= 1:
+            d[i] -= e[i - 1] * e[i - 1] * d[i - 1]
+        if i >= 2:
+            d[i] -= f[i - 2] * f[i - 2] * d[i - 2]
+        if i < n - 1:
+            e[i] = lmbd * b[i]
+            if i >= 1:
+                e[i] -= f[i - 1] * e[i - 1] * d[i - 1]
+            e[i] /= d[i]
+        if i < n - 2:
+            f[i] = lmbd * c[i] / d[i]
+
+    return d, e, f
+
+
+def _pentadiagonal_solve(factor, rhs, index=None):
+    """
+    Solve a batch of factorized pentadiagonal systems.
+
+    Args:
+        factor (tuple): factorization as returned by :func:`_pentadiagonal_factor`, with shape (n, systems)
+        rhs (ndarray): right hand sides with shape (n, batch)
+        index (ndarray): for each right hand side, the index of the system to use. Defaults to one system per column.
+
+    Returns:
+        The solutions with shape (n, batch)
+    """
+    d, e, f = factor
+    if index is None:
+        index = slice(None)
+
+    n = rhs.shape[0]
+    z = np.array(rhs, dtype="double")
+
+    for i in range(1, n):
+        z[i] -= e[i - 1, index] * z[i - 1]
+        if i >= 2:
+            z[i] -= f[i - 2, index] * z[i - 2]
+
+    z[n - 1] /= d[n - 1, index]
+    for i in range(n - 2, -1, -1):
+        z[i] /= d[i, index]
+        z[i] -= e[i, index] * z[i + 1]
+        if i < n - 2:
+            z[i] -= f[i, index] * z[i + 2]
+
+    return z
+
+
+def _vcurve_optimum(fits, pens, llas):
+    """
+    Select the optimal lambda from the V-curve.
+
+    Args:
+        fits (ndarray): weighted residual sum of squares for every candidate, with shape (candidates, series)
+        pens (ndarray): roughness penalty for every candidate, with shape (candidates, series)
+        llas (ndarray): candidate log10(lambda) values
+
+    Returns:
+        The optimal lambda value for every series
+    """
+    llas = np.asarray(llas, dtype="double")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fits = np.log10(fits)
+        pens = np.log10(pens)
+        v = np.sqrt(np.diff(fits, axis=0) ** 2 + np.diff(pens, axis=0) ** 2) / np.diff(llas)[:, np.newaxis]
+    v[~np.isfinite(v)] = np.inf
+
+    lamids = (llas[1:] + llas[:-1]) / 2
+    return 10 ** lamids[np.argmin(v, axis=0)]
+
+
+def _robust_weights(robust, values, fitted, threshold):
+    """
+    Weights of the observations for the next iteration of a robust fit, from the residuals of the previous fit.
+
+    Args:
+        robust (str): "envelope" for asymmetric weights favouring the observations above the fit, or "zscore" to
+            discard the observations with a residual of more than threshold standard deviations from the mean residual
+        values (ndarray): observations with shape (series, time), NaN marks missing values
+        fitted (ndarray): the previous fit at the observation dates, with the same shape
+
+    Returns:
+        The weights, zero for missing values
+    """
+    residuals = values - fitted
+    if robust == "envelope":
+        weights = np.where(residuals > 0, _ENVELOPE_WEIGHT, 1 - _ENVELOPE_WEIGHT)
+    else:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # a biased fit shifts all residuals, the z-score is taken around their mean
+            mean = np.nanmean(residuals, axis=-1, keepdims=True)
+            zscore = (residuals - mean) / np.nanstd(residuals, axis=-1, ddof=1, keepdims=True)
+        weights = (np.abs(zscore) <= threshold).astype(np.float64)
+    weights[np.isnan(values)] = 0
+    return weights
+
+
+def _reweighted_solve(w, t, lmbd, spacing=None):
+    """
+    Solve Whittaker systems of which the weights differ per series.
+
+    The weights of a robust fit are rarely shared between series or calls, so every system is factorized in the
+    batch without looking for duplicates or going through the :data:`factorization_cache`.
+
+    Args:
+        w (ndarray): weights on the grid with shape (n, series)
+        t (ndarray): weighted observations on the grid with shape (n, series)
+        lmbd (double or ndarray): lambda value, or an array of lambda values with shape (series,)
+        spacing (ndarray): distance between consecutive nodes, defaults to a daily grid
+
+    Returns:
+        The solutions with shape (n, series)
+    """
+    return _pentadiagonal_solve(_pentadiagonal_factor(w, lmbd, spacing), t)
+
+
+_ROBUST_WEIGHTS = (None, "envelope", "zscore")
+
+# weight of the observations above the fit for robust="envelope", the observations below get the complement
+_ENVELOPE_WEIGHT = 0.9
+
+
+def _whittaker_batch(
+    day_offsets, values, lmbd, output_offsets, llas=None, sparse=False, robust=None, iterations=3, threshold=3.0
+):
+    """
+    Whittaker smoothing of a block of timeseries sharing the same date axis.
+
+    The smoother is evaluated on the daily grid spanned by the dates, or with sparse set, only on the observation and
+    output dates using divided differences. Pixels with identical missing data have an
+    identical system matrix, so the system is factorized once per unique mask (or taken from the
+    :data:`factorization_cache`) and all pixels are solved together.
+
+    When candidate lambda values are given, the V-curve is evaluated for all pixels in lockstep: every candidate
+    requires one factorization per unique mask, shared by all pixels with that mask.
+
+    Args:
+        day_offsets (ndarray): day offsets of the observations, relative to the first date
+        values (ndarray): observations with time as last axis, NaN marks missing values
+        lmbd (double): lambda value
+        output_offsets (ndarray): day offsets of the requested output dates
+        llas (list): candidate log10(lambda) values, to select lambda per pixel instead of using lmbd
+        sparse (bool): solve on the observation and output dates instead of on the daily grid
+        robust (str): reweight the observations with the residuals of the fit, see :func:`_robust_weights`
+        iterations (int): the number of reweighting iterations when robust is set
+        threshold (double): the z-score threshold when robust is "zscore"
+
+    Returns:
+        The smoothed values at the output dates, with time as last axis. When llas is given, a tuple with the smoothed
+        values and the selected lambda per pixel.
+    """
+    shape = values.shape
+    y = values.reshape(-1, shape[-1])
+    if sparse:
+        nodes = np.union1d(day_offsets, output_offsets)
+        spacing = np.diff(nodes)
+        observation_index = np.searchsorted(nodes, day_offsets)
+        output_index = np.searchsorted(nodes, output_offsets)
+    else:
+        nodes = np.arange(int(day_offsets[-1]) + 1)
+        spacing = None
+        observation_index = np.asarray(day_offsets)
+        output_index = np.asarray(output_offsets)
+
+    n = len(nodes)
+    block = max(1, _BLOCK_SIZE // n)
+    unique_days = len(np.unique(day_offsets)) == len(day_offsets)
+
+    result = np.full((y.shape[0], len(output_offsets)), np.nan)
+    lambdas = np.full(y.shape[0], np.nan)
+    for start in range(0, y.shape[0], block):
+        y_block = y[start : start + block]
+        valid = ~np.isnan(y_block)
+        _, first, index = np.unique(np.packbits(valid, axis=-1), axis=0, return_index=True, return_inverse=True)
+        masks = valid[first]
+
+        # weights on the grid, dates occurring multiple times get a proportionally higher weight
+        w = np.zeros((n, masks.shape[0]))
+        t = np.zeros((n, y_block.shape[0]))
+        if unique_days:
+            w[observation_index] = masks.T
+            t[observation_index] = np.where(valid, y_block, 0).T
+        else:
+            np.add.at(w, observation_index, masks.T)
+            np.add.at(t, observation_index, np.where(valid, y_block, 0).T)
+
+        # at least two distinct observations are required for a unique solution
+        solvable = (w > 0).sum(axis=0) >= 2
+        w[:, ~solvable] = 1
+
+        index = index.ravel()
+        if llas is None:
+            z = _pentadiagonal_solve(factorization_cache.factorize(w, lmbd, spacing), t, index)
+        else:
+            fits = np.empty((len(llas), y_block.shape[0]))
+            pens = np.empty((len(llas), y_block.shape[0]))
+            for i, llambda in enumerate(llas):
+                z = _pentadiagonal_solve(factorization_cache.factorize(w, 10**llambda, spacing), t, index)
+                fits[i] = np.nansum((y_block.T - z[observation_index]) ** 2, axis=0)
+                pens[i] = _penalty(z, spacing)
+            lopt = _vcurve_optimum(fits, pens, llas)
+
+            # factorize once for every combination of mask and selected lambda
+            systems, system_index = np.unique(np.stack([index, lopt]), axis=1, return_inverse=True)
+            factor = factorization_cache.factorize(w[:, systems[0].astype(int)], systems[1], spacing)
+            z = _pentadiagonal_solve(factor, t, system_index.ravel())
+
+        if robust is not None:
+            # iteratively reweighted fits of the same block, from the fit with the observation mask as weights
+            pixel_lambda = lmbd if llas is None else lopt
+            for _ in range(iterations):
+                weights = _robust_weights(robust, y_block, z[observation_index].T, threshold)
+                # series that are left with less than two observations keep their weights
+                keep = (weights > 0).sum(axis=-1) < 2
+                weights[keep] = valid[keep]
+                w_pixels = np.zeros((n, y_block.shape[0]))
+                t = np.zeros((n, y_block.shape[0]))
+                np.add.at(w_pixels, observation_index, weights.T)
+                np.add.at(t, observation_index, np.where(valid, weights * y_block, 0).T)
+                w_pixels[:, ~solvable[index]] = 1
+                z = _reweighted_solve(w_pixels, t, pixel_lambda, spacing)
+
+        if llas is not None:
+            lopt[~solvable[index]] = np.nan
+            lambdas[start : start + block] = lopt
+
+        z = z[output_index].T
+        z[~solvable[index]] = np.nan
+        result[start : start + block] = z
+
+    result = result.reshape(shape[:-1] + (len(output_offsets),))
+    if llas is None:
+        return result
+    return result, lambdas.reshape(shape[:-1])
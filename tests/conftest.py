@@ -78,6 +78,23 @@ def outlier_timeseries():
     return xarray.DataArray(data=values, dims=["time"], coords=dict(time=dates))
 
 
+@pytest.fixture
+def fusion_dataset():
+    rng = np.random.default_rng(42)
+    dates = pd.date_range("2022-01-01", periods=40, freq="5D")
+    days = 5 * np.arange(len(dates))
+    signal = np.sin(days * 2 * np.pi / 200)[:, np.newaxis, np.newaxis] + np.zeros((1, 3, 2))
+    ndvi = 0.5 + 0.3 * signal + rng.normal(scale=0.02, size=signal.shape)
+    rvi = 0.4 + 0.2 * signal + rng.normal(scale=0.02, size=signal.shape)
+    ndvi[rng.random(ndvi.shape) < 0.4] = np.nan
+    rvi[rng.random(rvi.shape) < 0.1] = np.nan
+
+    return xarray.Dataset(
+        {"NDVI": (("t", "y", "x"), ndvi), "RVI": (("t", "y", "x"), rvi)},
+        coords=dict(t=dates, y=[0.5, 1.5, 2.5], x=[0.5, 1.5]),
+    )
+
+
 @pytest.fixture
 def areas():
     return {
@@ -1,11 +1,12 @@
 import io
 
+import numpy as np
 import pytest
 import requests
 import xarray
 from numpy.testing import assert_allclose
 
-from fusets.ccdc import ccdc_change_detection, fit_harmonics_curve
+from fusets.ccdc import ccdc_change_detection, ccdc_monitoring, fit_harmonics_curve
 from fusets.whittaker import whittaker
 
 
@@ -34,7 +35,122 @@ def test_fit_simple_harmonics_exact(harmonic_timeseries):
     assert_allclose(coefficients, [5000, 5, 600, 200], atol=3)
 
 
-@pytest.mark.skip(reason="See https://github.com/Open-EO/FuseTS/issues/84#issuecomment-1600702434")
+def test_fit_harmonics_batched(harmonic_timeseries):
+    from ccd.models import lasso
+    from ccd.parameters import defaults
+
+    rng = np.random.default_rng(0)
+    noise = xarray.DataArray(rng.normal(0, 100, (4, 365)), dims=["x", "time"])
+    cube = (harmonic_timeseries + noise).transpose("x", "time")
+    cube = cube.where(rng.random(cube.shape) > 0.2)
+
+    coefficients = fit_harmonics_curve(cube, num_coefficients=6)
+
+    assert coefficients.dims == ("x", "bands")
+    days = (harmonic_timeseries.time - harmonic_timeseries.time[0]).dt.days.values
+    for series, result in zip(cube.values, coefficients.values):
+        valid = ~np.isnan(series)
+        model = lasso.fitted_model(
+            days[valid], series[valid], defaults["LASSO_MAX_ITER"], defaults["AVG_DAYS_YR"], 6
+        ).fitted_model
+        assert_allclose(result, [model.intercept_, *model.coef_[:5]], atol=0.05)
+
+    # every pixel has its own missing values, the least squares fits match those of the valid observations alone
+    ols = fit_harmonics_curve(cube, num_coefficients=6, method="ols")
+    design = lasso.coefficient_matrix(days, defaults["AVG_DAYS_YR"], 6)[:, :5]
+    for series, result in zip(cube.values, ols.values):
+        valid = ~np.isnan(series)
+        expected, *_ = np.linalg.lstsq(np.column_stack([np.ones(valid.sum()), design[valid]]), series[valid])
+        assert_allclose(result, expected, rtol=1e-6)
+
+    exact = fit_harmonics_curve(harmonic_timeseries, num_coefficients=4, method="ols")
+    assert_allclose(exact, [5000, 5, 600, 200], atol=3)
+
+
 def test_ccdc_change_detection(harmonic_timeseries):
     breaks = ccdc_change_detection(harmonic_timeseries)
     print(breaks)
+    assert breaks.dims == ("bands",)
+
+
+def test_ccdc_change_detection_parallel(harmonic_timeseries):
+    from ccd import procedures
+
+    rng = np.random.default_rng(0)
+    days = 5 * np.arange(365)
+    seasonal = 5000 + 600 * np.cos(days * 2 * np.pi / 365.25) - 2000 * (days >= 1000)
+    cube = xarray.DataArray(
+        seasonal + rng.normal(0, 50, (3, 365)), dims=["x", "time"], coords=dict(time=harmonic_timeseries.time)
+    )
+    cube[1] = cube[1].where(rng.random(365) > 0.3)
+    originals = procedures.results_to_changemodel, procedures.qa.filter_saturated, procedures.adjusted_variogram
+
+    breaks = ccdc_change_detection(cube, max_breaks=4)
+    parallel = ccdc_change_detection(cube.chunk({"x": 2}), max_breaks=4, n_jobs=2).compute()
+
+    assert breaks.dims == ("x", "bands") and breaks.shape == (3, 4)
+    # the first valid observation after the step, pixel 1 has gaps
+    assert_allclose(breaks.values[:, 0], 1000, atol=50)
+    assert np.isnan(breaks.values[:, -1]).all()
+    xarray.testing.assert_identical(breaks, parallel)
+    assert (
+        procedures.results_to_changemodel,
+        procedures.qa.filter_saturated,
+        procedures.adjusted_variogram,
+    ) == originals
+
+
+def test_ccdc_change_detection_numpy(harmonic_timeseries):
+    rng = np.random.default_rng(0)
+    days = 5 * np.arange(365)
+    steps = np.array([1000, 600, 1400])
+    seasonal = 5000 + 600 * np.cos(days * 2 * np.pi / 365.25) - 2000 * (days >= steps[:, None])
+    cube = xarray.DataArray(
+        seasonal + rng.normal(0, 50, (3, 365)), dims=["x", "time"], coords=dict(time=harmonic_timeseries.time)
+    )
+    cube[1] = cube[1].where(rng.random(365) > 0.3)
+    # a too short series and a constant series
+    cube = xarray.concat([cube, cube[0].where(days < 200), cube[0] * 0 + 5000], dim="x")
+
+    breaks = ccdc_change_detection(cube, max_breaks=3, backend="numpy")
+    reference = ccdc_change_detection(cube[:3], max_breaks=3)
+
+    assert breaks.dims == ("x", "bands") and breaks.shape == (5, 3)
+    assert_allclose(breaks.values[:3, 0], reference.values[:, 0])
+    assert_allclose(breaks.values[:3, 0], steps, atol=50)
+    # only the detected changes, too short and constant series have none
+    assert np.isnan(breaks.values[:, 1:]).all()
+    assert np.isnan(breaks.values[3:]).all()
+
+    with pytest.raises(ValueError):
+        ccdc_change_detection(cube, backend="unknown")
+
+
+def test_ccdc_monitoring(harmonic_timeseries, tmp_path):
+    rng = np.random.default_rng(0)
+    days = 5 * np.arange(365)
+    steps = np.array([1000, 600, 1400, 5000])
+    seasonal = 5000 + 600 * np.cos(days * 2 * np.pi / 365.25) - 2000 * (days >= steps[:, None])
+    cube = xarray.DataArray(
+        seasonal + rng.normal(0, 50, (4, 365)), dims=["x", "time"], coords=dict(time=harmonic_timeseries.time)
+    )
+    cube[1] = cube[1].where(rng.random(365) > 0.3)
+    # a constant series
+    cube = xarray.concat([cube, cube[0] * 0 + 5000], dim="x")
+    store = str(tmp_path / "models.nc")
+
+    archive = ccdc_monitoring(cube[:, :250], store)
+    assert archive.dims == ("x",)
+    assert np.isnat(archive.values[2:]).all()
+
+    # one acquisition at a time
+    for end in range(251, 366):
+        breaks = ccdc_monitoring(cube[:, :end], store)
+
+    models = xarray.load_dataset(store)
+    assert models.attrs["last_date"] == str(cube.time.values[-1].astype("datetime64[D]"))
+    assert models.coefficients.shape == (5, 8)
+    reference = ccdc_change_detection(cube, max_breaks=3, backend="numpy")
+    expected = cube.time.values[0] + np.fmax.reduce(reference.values, axis=1).astype("timedelta64[D]")
+    np.testing.assert_array_equal(breaks.values[:3], expected[:3])
+    assert np.isnat(breaks.values[3:]).all()
@@ -0,0 +1,341 @@
+import importlib.util
+import logging
+import time
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from scipy.optimize import approx_fprime, minimize, rosen, rosen_der
+
+from fusets import _gp
+
+requires_gpy = pytest.mark.skipif(importlib.util.find_spec("GPy") is None, reason="GPy is not installed")
+
+
+def _count_calls(monkeypatch, *names):
+    """Wrap functions of the gaussian process module to record their calls"""
+    calls = []
+    for name in names:
+        function = getattr(_gp, name)
+
+        def counting(*args, function=function, **kwargs):
+            calls.append(function.__name__)
+            return function(*args, **kwargs)
+
+        monkeypatch.setattr(_gp, name, counting)
+    return calls
+
+
+@requires_gpy
+def test_mogpr(fusion_dataset):
+    from fusets.mogpr import mogpr
+
+    result = mogpr(fusion_dataset, prediction_period="P10D", include_uncertainties=True)
+
+    assert set(result.data_vars) == {"NDVI_FUSED", "RVI_FUSED", "NDVI_STD", "RVI_STD"}
+    assert result.NDVI_FUSED.dims == ("y", "x", "t")
+    assert len(result.t) == 20
+    assert not np.isnan(result.NDVI_FUSED).any()
+    observed = fusion_dataset.NDVI.sel(t=result.t).transpose(*result.NDVI_FUSED.dims)
+    assert_allclose(result.NDVI_FUSED.where(~np.isnan(observed)), observed, atol=0.1)
+
+
+@requires_gpy
+def test_mogpr_process_pool(fusion_dataset):
+    from fusets.mogpr import mogpr
+
+    expected = mogpr(fusion_dataset, include_uncertainties=True)
+    result = mogpr(fusion_dataset, include_uncertainties=True, n_jobs=2)
+
+    # GPy draws its initial coregionalization weights from the global numpy random state, which differs per worker
+    for variable in ["NDVI_FUSED", "RVI_FUSED"]:
+        assert_allclose(result[variable], expected[variable], atol=0.1)
+
+
+def test_mogpr_transformer(fusion_dataset):
+    from fusets.mogpr import MOGPRTransformer
+
+    transformer = MOGPRTransformer(n_samples=4, random_state=0).fit(fusion_dataset)
+    result = transformer.transform(fusion_dataset)
+
+    assert set(result.data_vars) == {"NDVI", "RVI"}
+    assert result.NDVI.dims == ("t", "y", "x")
+    assert len(result.t) == 39
+    assert not np.isnan(result.NDVI).any()
+    observed = fusion_dataset.NDVI.sel(t=result.t)
+    assert_allclose(result.NDVI.where(~np.isnan(observed)), observed, atol=0.1)
+
+    # the hyperparameters are trained once on the sample and shared by all pixels
+    fitted = MOGPRTransformer(n_samples=4, random_state=0).fit_transform(fusion_dataset)
+    assert_allclose(fitted.NDVI, result.NDVI)
+
+
+@requires_gpy
+def test_gp_predict_matches_gpy(fusion_dataset):
+    from fusets.mogpr import mogpr_1D
+
+    times = np.arange(len(fusion_dataset.t)) * 5.0
+    output_times = np.arange(0, times[-1], 3.0)
+    values = np.stack([fusion_dataset.NDVI[:, 0, 0].values, fusion_dataset.RVI[:, 0, 0].values])
+    mean, std, _, model = mogpr_1D(list(values), [times, times], 0, output_times, nt=1)
+
+    params = _gp.LCMParameters.from_gpy(model)
+    normalized, y_mean, y_std = _gp.normalize(values[np.newaxis])
+    pred_mean, pred_var = _gp.predict(params, times, normalized, output_times)
+
+    assert_allclose(pred_mean[0] * y_std[0, :, np.newaxis] + y_mean[0, :, np.newaxis], mean, atol=1e-5)
+    assert_allclose(pred_var[0] * y_std[0, :, np.newaxis], std, atol=1e-5)
+    assert_allclose(_gp.log_likelihood(params, times, normalized)[0], model.log_likelihood(), rtol=1e-5)
+
+
+def test_mogpr_numpy_backend(fusion_dataset):
+    from fusets.mogpr import mogpr
+
+    result = mogpr(fusion_dataset, backend="numpy")
+
+    assert not np.isnan(result.NDVI_FUSED).any()
+    for variable in ["NDVI", "RVI"]:
+        observed = fusion_dataset[variable].transpose(*result.NDVI_FUSED.dims)
+        assert_allclose(result[f"{variable}_FUSED"].where(~np.isnan(observed)), observed, atol=0.1)
+
+    # the numpy backend is deterministic, whatever the distribution of the pixels
+    assert_allclose(mogpr(fusion_dataset, backend="numpy", n_jobs=2).NDVI_FUSED, result.NDVI_FUSED)
+
+
+def test_gp_log_likelihood_gradient():
+    rng = np.random.default_rng(0)
+    params = _gp.LCMParameters.default(2, seed=1)._replace(
+        lengthscale=np.array([7.0, 20.0]), noise=np.array([0.3, 0.2])
+    )
+    x, o = _gp.stacked_inputs(np.arange(0, 100, 5.0), 2)
+    y = rng.normal(size=(len(x), 3))
+
+    def log_likelihood(vector):
+        return _gp._log_likelihood_gradient(_gp.LCMParameters.from_vector(vector, 2), x, o, y)[0]
+
+    _, gradient = _gp._log_likelihood_gradient(params, x, o, y)
+    assert_allclose(gradient, approx_fprime(params.to_vector(), log_likelihood, 1e-7), rtol=1e-4)
+
+
+@requires_gpy
+def test_gp_optimize_matches_gpy(fusion_dataset):
+    from fusets.mogpr import mogpr_1D
+
+    times = np.arange(len(fusion_dataset.t)) * 5.0
+    values = np.stack([fusion_dataset.NDVI[:, 1, 1].values, fusion_dataset.RVI[:, 1, 1].values])
+    mean, _, _, model = mogpr_1D(list(values), [times, times], 0, times, nt=1)
+
+    normalized, y_mean, y_std = _gp.normalize(values[np.newaxis])
+    params, log_likelihood, _ = _gp.optimize(times, normalized, initial=_gp.LCMParameters.from_gpy(model))
+    pred_mean, _ = _gp.predict(params, times, normalized, times)
+
+    assert log_likelihood == pytest.approx(model.log_likelihood(), abs=1e-2)
+    assert_allclose(pred_mean[0] * y_std[0, :, np.newaxis] + y_mean[0, :, np.newaxis], mean, atol=1e-3)
+
+
+def test_mogpr_warm_start(fusion_dataset, monkeypatch):
+    from fusets.mogpr import mogpr
+
+    evaluations = _count_calls(monkeypatch, "_log_likelihood_gradient")
+
+    expected = mogpr(fusion_dataset, backend="numpy")
+    cold = len(evaluations)
+    result = mogpr(fusion_dataset, backend="numpy", warm_start=True, max_iters=50)
+    warm = len(evaluations) - cold
+
+    assert not np.isnan(result.NDVI_FUSED).any()
+    assert_allclose(result.NDVI_FUSED, expected.NDVI_FUSED, atol=0.1)
+    assert warm < cold
+
+
+def test_serpentine_order():
+    from fusets.mogpr import _serpentine_order
+
+    assert list(_serpentine_order((3, 2))) == [0, 1, 3, 2, 4, 5]
+    assert list(_serpentine_order((2, 2, 2))) == [0, 1, 3, 2, 4, 5, 7, 6]
+    assert list(_serpentine_order(())) == [0]
+
+
+def test_gp_as_initial_is_equivalent(fusion_dataset):
+    params = _gp.LCMParameters.default(2, seed=1)._replace(variance=np.array([0.5, 4.0]))
+    normalized, _, _ = _gp.normalize(fusion_dataset.to_array().transpose("y", "x", ...).values.reshape(-1, 2, 40))
+    times = np.arange(40) * 5.0
+
+    assert_allclose(
+        _gp.log_likelihood(params.as_initial(), times, normalized), _gp.log_likelihood(params, times, normalized)
+    )
+
+
+def test_mogpr_group_masks(fusion_dataset):
+    from fusets.mogpr import mogpr
+
+    # a cloud mask shared by all pixels
+    shared = fusion_dataset.where(~np.isnan(fusion_dataset.isel(x=0, y=0)))
+    result = mogpr(shared, backend="numpy", group_masks=True)
+
+    assert not np.isnan(result.NDVI_FUSED).any()
+    observed = shared.NDVI.transpose(*result.NDVI_FUSED.dims)
+    assert_allclose(result.NDVI_FUSED.where(~np.isnan(observed)), observed, atol=0.1)
+
+    with pytest.raises(ValueError):
+        mogpr(shared, group_masks=True)
+
+
+def test_gp_optimize_mixed_masks(fusion_dataset):
+    normalized, _, _ = _gp.normalize(fusion_dataset.to_array().transpose("y", "x", ...).values.reshape(-1, 2, 40))
+    times = np.arange(40) * 5.0
+    assert len(_gp.MaskPlan(normalized)) > 1
+
+    # a single set of hyperparameters maximizes the likelihood summed over all masks
+    params, log_likelihood, _ = _gp.optimize(times, normalized)
+    assert log_likelihood == pytest.approx(np.sum(_gp.log_likelihood(params, times, normalized)))
+
+
+def test_gp_mask_plan():
+    values = np.ones((5, 2, 3))
+    values[[1, 3], 0, 1] = np.nan
+    values[4] = np.nan
+    plan = _gp.MaskPlan(values)
+
+    assert len(plan) == 3
+    assert sorted(sorted(members) for members in plan.members) == [[0, 2], [1, 3], [4]]
+    for mask, members in plan:
+        assert np.array_equal(mask, ~np.isnan(values[members[0]].ravel()))
+
+
+@requires_gpy
+def test_mogpr_1D_restarts(fusion_dataset):
+    from fusets.mogpr import mogpr_1D
+
+    times = np.arange(len(fusion_dataset.t)) * 5.0
+    values = [fusion_dataset.NDVI[:, 2, 0].values, fusion_dataset.RVI[:, 2, 0].values]
+
+    np.random.seed(3)
+    _, _, _, single = mogpr_1D(values, [times, times], 0, times, nt=1)
+    np.random.seed(3)
+    mean, _, qflag, best = mogpr_1D(values, [times, times], 0, times, nt=3)
+
+    assert qflag
+    assert not np.isnan(mean).any()
+    assert best.log_likelihood() >= single.log_likelihood() - 1e-6
+
+
+def test_gp_optimize_restarts(fusion_dataset):
+    normalized, _, _ = _gp.normalize(fusion_dataset.to_array().transpose("y", "x", ...).values.reshape(-1, 2, 40))
+    times = np.arange(40) * 5.0
+
+    for pixel in normalized[:3]:
+        _, single, _ = _gp.optimize(times, pixel[np.newaxis])
+        _, best, iterations = _gp.optimize(times, pixel[np.newaxis], restarts=4)
+        assert best >= single
+        assert iterations > 0
+
+
+def test_gp_optimize_restart_cost(fusion_dataset, monkeypatch):
+    normalized, _, _ = _gp.normalize(fusion_dataset.to_array().transpose("y", "x", ...).values.reshape(-1, 2, 40))
+    times = np.arange(40) * 5.0
+    evaluations = _count_calls(monkeypatch, "_log_likelihood_gradient", "_stacked_log_likelihood_gradient")
+
+    costs = {}
+    for restarts in (1, 5):
+        evaluations.clear()
+        start = time.perf_counter()
+        for pixel in normalized:
+            _gp.optimize(times, pixel[np.newaxis], restarts=restarts)
+        costs[restarts] = (len(evaluations), time.perf_counter() - start)
+
+    calls, seconds = ((costs[5][i] - costs[1][i]) / 4 for i in range(2))
+    logging.info(f"MOGPR restarts, single start: {costs[1][1]:.2f}s, per additional restart: {seconds:.2f}s")
+    # the random restarts are optimized in lockstep, a stacked call evaluates all of them
+    assert calls < costs[1][0] / 2
+
+
+def test_gp_minimize_stacked_matches_scipy():
+    def objective(points):
+        return np.array([rosen(point) for point in points]), np.array([rosen_der(point) for point in points])
+
+    # the bound on the second parameter is active at the optimum
+    lower = np.array([-np.inf, 1.2, -np.inf, 0.5])
+    bounds = [(bound if np.isfinite(bound) else None, None) for bound in lower]
+    starts = np.random.default_rng(0).standard_normal((6, 4)) * 2
+
+    points, values, iterations = _gp._minimize_stacked(objective, starts, lower)
+
+    for start, point, value in zip(starts, points, values):
+        expected = minimize(
+            lambda x: (rosen(x), rosen_der(x)), np.maximum(start, lower), jac=True, method="L-BFGS-B", bounds=bounds
+        )
+        assert_allclose(point, expected.x, atol=1e-4)
+        assert_allclose(value, expected.fun, atol=1e-6)
+    assert np.all(points[:, 1] == 1.2)
+    assert np.all(iterations > 0)
+
+
+def test_mogpr_restarts(fusion_dataset):
+    from fusets.mogpr import mogpr
+
+    result = mogpr(fusion_dataset, backend="numpy", restarts=3)
+
+    observed = fusion_dataset.NDVI.transpose(*result.NDVI_FUSED.dims)
+    assert_allclose(result.NDVI_FUSED.where(~np.isnan(observed)), observed, atol=0.1)
+
+
+def test_gp_kron_covariance():
+    params = _gp.LCMParameters.default(2, seed=1)._replace(lengthscale=np.array([7.0, 20.0]))
+    times = np.arange(0, 100, 5.0)
+    output_times = np.arange(0, 100, 3.0)
+    grid = _gp.TimeGrid.from_times(times, output_times)
+
+    x, o = _gp.stacked_inputs(times, 2)
+    xnew, onew = _gp.stacked_inputs(output_times, 2)
+    assert_allclose(_gp._kron_covariance(params, grid.observed), _gp.covariance(params, x, o, x, o))
+    assert_allclose(_gp._kron_covariance(params, grid.cross), _gp.covariance(params, x, o, xnew, onew))
+
+
+def test_gp_sparse_log_likelihood_gradient():
+    rng = np.random.default_rng(0)
+    params = _gp.LCMParameters.default(2, seed=1)._replace(
+        variance=np.array([0.7, 1.3]), lengthscale=np.array([7.0, 20.0]), noise=np.array([0.3, 0.2])
+    )
+    x, o = _gp.stacked_inputs(np.arange(0, 100, 5.0), 2)
+    z, oz = _gp.stacked_inputs(np.arange(0, 100, 15.0), 2)
+    y = rng.normal(size=(len(x), 3))
+
+    def bound(vector):
+        return _gp._sparse_log_likelihood_gradient(_gp.LCMParameters.from_vector(vector, 2), x, o, y, z, oz)[0]
+
+    _, gradient = _gp._sparse_log_likelihood_gradient(params, x, o, y, z, oz)
+    assert_allclose(gradient, approx_fprime(params.to_vector(), bound, 1e-7), rtol=1e-4)
+
+    # with the observations as inducing points, the bound is the exact likelihood, up to the jitter
+    exact, _ = _gp._log_likelihood_gradient(params, x, o, y)
+    assert _gp._sparse_log_likelihood_gradient(params, x, o, y, x, o)[0] == pytest.approx(exact, rel=1e-5)
+
+
+def test_gp_sparse_predict(fusion_dataset):
+    params = _gp.LCMParameters.default(2, seed=1)._replace(
+        lengthscale=np.array([30.0, 60.0]), noise=np.array([0.1, 0.1])
+    )
+    normalized, _, _ = _gp.normalize(fusion_dataset.to_array().transpose("y", "x", ...).values.reshape(-1, 2, 40))
+    times = np.arange(40) * 5.0
+
+    expected_mean, expected_var = _gp.predict(params, times, normalized, times)
+    mean, var = _gp.predict(params, times, normalized, times, inducing=times)
+    assert_allclose(mean, expected_mean, atol=1e-4)
+    assert_allclose(var, expected_var, atol=1e-4)
+
+    mean, _ = _gp.predict(params, times, normalized, times, inducing=times[::3])
+    assert_allclose(mean, expected_mean, atol=0.05)
+
+
+def test_mogpr_inducing_points(fusion_dataset):
+    from fusets.mogpr import mogpr
+
+    result = mogpr(fusion_dataset, backend="numpy", inducing_period="P15D", include_uncertainties=True)
+
+    assert not np.isnan(result.NDVI_FUSED).any()
+    observed = fusion_dataset.NDVI.transpose(*result.NDVI_FUSED.dims)
+    assert_allclose(result.NDVI_FUSED.where(~np.isnan(observed)), observed, atol=0.1)
+
+    with pytest.raises(ValueError):
+        mogpr(fusion_dataset, inducing_period="P15D")
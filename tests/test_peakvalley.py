@@ -1,8 +1,19 @@
 import numpy as np
+import pytest
+import xarray
 from numpy.testing import assert_array_equal
+from scipy.signal import find_peaks
 
 from fusets._xarray_utils import _extract_dates
-from fusets.peakvalley import peakvalley_f
+from fusets.peakvalley import (
+    PeakValleyState,
+    _compiled_peakvalley_mask,
+    _local_maxima,
+    _peakvalley_mask,
+    peakvalley,
+    peakvalley_f,
+    peakvalley_update,
+)
 
 
 def test_peak_valley_detection(harmonic_timeseries):
@@ -11,3 +22,130 @@ def test_peak_valley_detection(harmonic_timeseries):
     _, pairs = peakvalley_f(dates, vals, drop_thr=200, rec_r=1.0, slope_thr=0)
     test_values = np.array([[9, 35], [82, 108], [155, 181], [228, 254], [301, 327]])
     assert_array_equal(pairs, test_values)
+
+
+def test_peak_valley_dask(harmonic_timeseries):
+    pytest.importorskip("dask")
+    cube = xarray.concat([harmonic_timeseries, harmonic_timeseries + 100], dim="x")
+    chunked = cube.chunk({"time": 50, "x": 1})
+
+    result = peakvalley(chunked, drop_thr=200, rec_r=1.0, slope_thr=0)
+
+    assert result.chunks == ((1, 1), (365,))
+    assert_array_equal(result.compute(), peakvalley(cube, drop_thr=200, rec_r=1.0, slope_thr=0))
+
+
+def test_peak_valley_batch(harmonic_timeseries):
+    rng = np.random.default_rng(0)
+    values = harmonic_timeseries.values + rng.normal(0, 50, (20, 365))
+    values[rng.random(values.shape) < 0.2] = np.nan
+    cube = xarray.DataArray(values, dims=["x", "time"], coords={"time": harmonic_timeseries.time})
+
+    result = peakvalley(cube, drop_thr=200, rec_r=1.0, slope_thr=0)
+
+    dates = cube.time.values
+    expected = [peakvalley_f(dates, series, drop_thr=200, rec_r=1.0, slope_thr=0)[0] for series in values]
+    assert_array_equal(result, expected)
+    assert (result == 1).any()
+
+
+def test_local_maxima():
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 4, (50, 30)).astype(float)
+
+    mask = _local_maxima(values)
+
+    for row, series in zip(mask, values):
+        assert_array_equal(np.flatnonzero(row), find_peaks(series)[0])
+
+
+def test_peak_valley_compiled(harmonic_timeseries):
+    rng = np.random.default_rng(0)
+    values = harmonic_timeseries.values + rng.normal(0, 50, (20, 365))
+    values[rng.random(values.shape) < 0.2] = np.nan
+    dates = harmonic_timeseries.time.values
+
+    result, _ = _compiled_peakvalley_mask(dates, values, drop_thr=200, rec_r=1.0, slope_thr=0)
+
+    expected = [peakvalley_f(dates, series, drop_thr=200, rec_r=1.0, slope_thr=0)[0] for series in values]
+    assert_array_equal(result, expected)
+    assert_array_equal(
+        _compiled_peakvalley_mask(dates, harmonic_timeseries.values, drop_thr=200, rec_r=1.0, slope_thr=0)[0],
+        peakvalley_f(np.array(_extract_dates(harmonic_timeseries)), harmonic_timeseries.values, 200, 1.0, 0)[0],
+    )
+
+
+def test_peak_valley_backend(harmonic_timeseries):
+    pytest.importorskip("numba")
+    cube = xarray.concat([harmonic_timeseries, harmonic_timeseries + 100], dim="x")
+
+    result = peakvalley(cube, drop_thr=200, rec_r=1.0, slope_thr=0, backend="numba")
+
+    assert_array_equal(result, peakvalley(cube, drop_thr=200, rec_r=1.0, slope_thr=0))
+    with pytest.raises(ValueError):
+        peakvalley(cube, backend="gpu")
+
+
+def test_peak_valley_update(harmonic_timeseries):
+    cube = xarray.concat([harmonic_timeseries, harmonic_timeseries.where(harmonic_timeseries.time.dt.day != 1)], "x")
+    dates = harmonic_timeseries.time.values
+    _, pairs = peakvalley_f(dates, harmonic_timeseries.values, drop_thr=200, rec_r=1.0, slope_thr=0)
+
+    state = PeakValleyState.empty(cube.x.shape)
+    events = []
+    for date in dates:
+        state, start, end = peakvalley_update(state, date, cube.sel(time=date), drop_thr=200, rec_r=1.0, slope_thr=0)
+        assert start.dims == ("x",)
+        events.extend(zip(start.values[~np.isnat(end)], end.values[~np.isnat(end)]))
+
+    # the missing values on the first of the month do not coincide with the events of this series
+    assert_array_equal(np.array(events)[::2], dates[pairs])
+    assert_array_equal(np.array(events)[1::2], dates[pairs])
+
+
+@pytest.mark.parametrize("drop_thr,rec_r,slope_thr", [(0.15, 1.0, -0.007), (0.05, 0.5, 0.0), (0.3, 1.5, 0.01)])
+def test_peak_valley_update_noisy(drop_thr, rec_r, slope_thr, tmp_path):
+    rng = np.random.default_rng(42)
+    dates = np.datetime64("2020-01-01", "ns") + np.cumsum(rng.integers(1, 12, 100)) * np.timedelta64(1, "D")
+    values = 0.5 + 0.3 * np.sin(np.arange(100) / rng.uniform(2, 8, (60, 1))) + rng.normal(0, 0.05, (60, 100))
+    values[:20] = rng.random((20, 100))
+    values[40:] = np.round(values[40:], 1)
+    values[50:] = np.linspace(1, 0, 100) + rng.normal(0, 0.002, 100)
+    values[rng.random(values.shape) < 0.2] = np.nan
+
+    state = PeakValleyState.empty((6, 10), capacity=1)
+    events = [[] for _ in range(60)]
+    for index, (date, observations) in enumerate(zip(dates, values.T)):
+        state, start, end = peakvalley_update(state, date, observations.reshape(6, 10), drop_thr, rec_r, slope_thr)
+        if index % 10 == 0:
+            # the state is persisted between runs
+            np.savez(tmp_path / "state.npz", **state._asdict())
+            state = PeakValleyState(**np.load(tmp_path / "state.npz"))
+        for pixel in np.flatnonzero(~np.isnat(start)):
+            events[pixel].append((start.flat[pixel], end.flat[pixel]))
+
+    for series, pixel_events in zip(values, events):
+        _, pairs = peakvalley_f(dates, series, drop_thr, rec_r, slope_thr)
+        expected = dates[~np.isnan(series)][pairs].reshape(-1, 2)
+        assert_array_equal(np.array(pixel_events).reshape(-1, 2), expected)
+
+
+@pytest.mark.parametrize("mask", [_peakvalley_mask, _compiled_peakvalley_mask])
+@pytest.mark.parametrize("series", [np.full(10, np.nan), np.ones(10), np.arange(10.0), np.arange(10.0)[::-1]])
+def test_peak_valley_without_events(series, mask):
+    dates = np.datetime64("2020-01-01", "ns") + np.arange(10) * np.timedelta64(5, "D")
+
+    result, _ = mask(dates, np.stack([series, series]), drop_thr=0.15, rec_r=1.0, slope_thr=-0.007)
+
+    assert np.isnan(result).all()
+    assert np.isnan(peakvalley_f(dates, series)[0]).all()
+
+
+def test_peak_valley_nodata_chunk(harmonic_timeseries):
+    pytest.importorskip("dask")
+    cube = xarray.concat([harmonic_timeseries, harmonic_timeseries * np.nan], dim="x").chunk({"x": 1})
+
+    result = peakvalley(cube, drop_thr=200, rec_r=1.0, slope_thr=0).compute()
+
+    assert_array_equal(result[0], peakvalley(harmonic_timeseries, drop_thr=200, rec_r=1.0, slope_thr=0))
+    assert result[1].isnull().all()
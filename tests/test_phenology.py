@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray
+from numpy.testing import assert_allclose, assert_array_equal
+
+from fusets import _phenolopy
+from fusets._phenolopy import _PHENOMETRICS, _get_phenometrics_fused, _get_phenometrics_stepwise
+from fusets.analytics import phenology
+
+
+@pytest.fixture
+def season_cube():
+    rng = np.random.default_rng(42)
+    dates = pd.date_range("2021-01-01", "2021-12-31", freq="5D")
+    days = dates.dayofyear.values[:, np.newaxis, np.newaxis]
+    peak = rng.uniform(120, 250, (1, 6, 5))
+    amplitude = rng.uniform(0.2, 0.8, (1, 6, 5))
+    values = 0.1 + amplitude * np.exp(-(((days - peak) / 40) ** 2)) + rng.normal(0, 0.02, (len(dates), 6, 5))
+    values[rng.random(values.shape) < 0.1] = np.nan
+    values[:, 0, 0] = np.nan
+
+    return xarray.DataArray(
+        values.astype("float32"), dims=["time", "y", "x"], coords=dict(time=dates, y=np.arange(6), x=np.arange(5))
+    )
+
+
+@pytest.mark.parametrize(
+    "method", ["first_of_slope", "median_of_slope", "seasonal_amplitude", "absolute_value", "relative_value"]
+)
+@pytest.mark.parametrize("peak_metric,base_metric", [("pos", "bse"), ("mos", "vos")])
+def test_phenometrics_fused(season_cube, method, peak_metric, base_metric, monkeypatch):
+    monkeypatch.setattr(_phenolopy, "_PIXEL_BLOCK_SIZE", 7)
+    da = season_cube.where(~season_cube.isnull().all("time"), 0.0)
+
+    fused = _get_phenometrics_fused(da, peak_metric, base_metric, method, 0.5, 0.3)
+    stepwise = _get_phenometrics_stepwise(da, peak_metric, base_metric, method, 0.5, 0.3)
+
+    for actual, expected in zip(fused, stepwise):
+        assert actual.name == expected.name
+        assert actual.dtype == expected.dtype
+        assert_allclose(actual, expected, rtol=1e-5)
+
+
+def test_phenology(season_cube):
+    result = phenology(season_cube)
+
+    assert list(result.data_vars) == _PHENOMETRICS
+    assert result.sizes == {"y": 6, "x": 5}
+    assert result.isel(y=0, x=0).to_array().isnull().all()
+    assert result.isel(y=slice(1, None)).pos_values.notnull().all()
+    assert_array_equal(result.pos_values, season_cube.max("time").where(result.pos_values.notnull()))
+
+    with pytest.raises(ValueError):
+        _phenolopy.calc_phenometrics(season_cube, method="unknown")
+
+
+def test_phenology_dask(season_cube):
+    pytest.importorskip("dask")
+    chunked = season_cube.chunk({"time": 20, "y": 2})
+
+    result = _phenolopy.calc_phenometrics(chunked)
+
+    assert result.pos_values.chunks == ((2, 2, 2), (5,))
+    xarray.testing.assert_allclose(result.compute(), _phenolopy.calc_phenometrics(season_cube))
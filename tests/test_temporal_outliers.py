@@ -1,8 +1,11 @@
 import numpy as np
-from numpy.testing import assert_almost_equal
+import pytest
+import xarray
+from numpy.testing import assert_allclose, assert_almost_equal, assert_array_equal
 
+from fusets import _kernels
 from fusets._xarray_utils import _extract_dates
-from fusets.temporal_outliers import temporal_outliers_f
+from fusets.temporal_outliers import _rolling_outliers, _window_bounds, temporal_outliers, temporal_outliers_f
 
 
 def test_temporal_outlier_filtering(outlier_timeseries):
@@ -13,3 +16,52 @@ def test_temporal_outlier_filtering(outlier_timeseries):
 
     assert_almost_equal(filtered_vals.mean(), 0.09904716, decimal=6)
     assert_almost_equal(filtered_vals.std(), 0.71552783, decimal=6)
+
+
+def test_temporal_outlier_filtering_dask(outlier_timeseries):
+    pytest.importorskip("dask")
+    dataset = xarray.Dataset({"a": outlier_timeseries, "b": -outlier_timeseries})
+    chunked = dataset.chunk({"time": 100})
+
+    result = temporal_outliers(chunked, window="20D", threshold=3)
+
+    assert result["a"].chunks == ((300,),)
+    expected = temporal_outliers(dataset, window="20D", threshold=3)
+    assert_array_equal(result["a"].compute(), expected["a"])
+    assert_array_equal(result["b"].compute(), expected["b"])
+
+
+@pytest.mark.parametrize("window", ["20D", 7])
+def test_temporal_outlier_filtering_compiled(outlier_timeseries, window):
+    dates = outlier_timeseries.time.values
+    values = outlier_timeseries.values + np.random.default_rng(0).normal(0, 0.1, (10, 300))
+    values[:, ::7] = np.nan
+
+    start, end, min_periods = _window_bounds(dates, window)
+    result = _kernels.temporal_outliers(values, start, end, min_periods, 3)
+
+    expected = [temporal_outliers_f(dates, series, window=window, threshold=3) for series in values]
+    assert_array_equal(result, expected)
+
+
+def test_temporal_outlier_filtering_backend(outlier_timeseries):
+    pytest.importorskip("numba")
+
+    result = temporal_outliers(outlier_timeseries, window="20D", threshold=3, backend="numba")
+
+    assert_array_equal(result, temporal_outliers(outlier_timeseries, window="20D", threshold=3))
+
+
+@pytest.mark.parametrize("window", ["20D", "7D", 7])
+def test_temporal_outlier_filtering_cube(outlier_timeseries, window):
+    dates = outlier_timeseries.time.values
+    values = 100 + outlier_timeseries.values + np.random.default_rng(0).normal(0, 0.1, (10, 300))
+    values[:, ::7] = np.nan
+    values[0] = np.round(values[0])
+    values[1] = np.nan
+
+    start, end, min_periods = _window_bounds(dates, window)
+    result = _rolling_outliers(values, start, end, min_periods, 3)
+
+    expected = [temporal_outliers_f(dates, series, window=window, threshold=3) for series in values]
+    assert_allclose(result, expected, rtol=1e-6)
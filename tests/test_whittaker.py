@@ -1,13 +1,25 @@
 import io
+import logging
+import time
 from datetime import datetime, timedelta
 
 import numpy as np
 import numpy.testing
+import pandas as pd
+import pytest
 import requests
 import xarray
 
 from fusets import whittaker
-from fusets.whittaker import WhittakerTransformer, whittaker_f
+from fusets.whittaker import (
+    FactorizationCache,
+    WhittakerTransformer,
+    _robust_weights,
+    factorization_cache,
+    whittaker_f,
+    ws2d,
+    ws2doptv,
+)
 
 
 def test_whittaker_f():
@@ -50,6 +62,21 @@ def test_whittaker_xarray(sinusoidal_timeseries):
     )
 
 
+def test_whittaker_cube(sinusoidal_timeseries):
+    cube = xarray.concat([sinusoidal_timeseries] * 6, dim="x").transpose("time", "x")
+    cube[{"x": 1}] = cube[{"x": 1}].where(cube.time != cube.time[5])
+    cube[{"x": 2}] = np.nan
+
+    result = whittaker(cube, smoothing_lambda=1, time_dimension="time")
+
+    assert result.dims == cube.dims
+    assert np.isnan(result[{"x": 2}]).all()
+    single = whittaker(sinusoidal_timeseries, smoothing_lambda=1, time_dimension="time")
+    for x in [0, 3, 4, 5]:
+        numpy.testing.assert_allclose(result[{"x": x}], single)
+    numpy.testing.assert_allclose(result[{"x": 1}], single, atol=0.15)
+
+
 def test_whittaker_transformer_xarray(sinusoidal_timeseries):
     result = WhittakerTransformer().fit_transform(sinusoidal_timeseries, smoothing_lambda=1, time_dimension="time")
 
@@ -74,3 +101,183 @@ def test_whittaker_realdata():
         {"index": smoothed_output.assign_attrs(grid_mapping="crs"), "crs": ds.crs}, attrs=dict(Conventions="CF-1.8")
     )
     out_set.to_netcdf("malawi_smooth.nc")
+
+
+def test_ws2d_batch():
+    rng = np.random.default_rng(42)
+    ys = np.cos(0.35 * np.arange(40)) + rng.normal(scale=0.1, size=(5, 40))
+    ws = (rng.random((5, 40)) > 0.3).astype("double")
+    ws[1] = ws[0]
+
+    smoothed = ws2d(ys, 10, ws)
+
+    penalty = np.diff(np.eye(40), n=2, axis=0)
+    for y, w, z in zip(ys, ws, smoothed):
+        expected = np.linalg.solve(np.diag(w) + 10 * penalty.T @ penalty, w * y)
+        numpy.testing.assert_allclose(z, expected, atol=1e-8)
+        numpy.testing.assert_allclose(ws2d(y, 10, w), expected, atol=1e-8)
+
+
+def test_ws2doptv():
+    rng = np.random.default_rng(42)
+    xs = np.arange(120)
+    ys = np.stack([np.cos(0.1 * xs), np.cos(0.1 * xs) + rng.normal(scale=0.3, size=len(xs))])
+    ws = np.ones_like(ys)
+    llas = np.arange(-2, 4.2, 0.2)
+
+    smoothed, lopt = ws2doptv(ys, ws, llas)
+
+    assert lopt.shape == (2,)
+    assert lopt[1] > lopt[0]
+    for y, w, z, l in zip(ys, ws, smoothed, lopt):
+        numpy.testing.assert_allclose(z, ws2d(y, l, w))
+    z, l = ws2doptv(ys[1], ws[1], llas)
+    assert l == lopt[1]
+    numpy.testing.assert_allclose(z, smoothed[1])
+    numpy.testing.assert_allclose(z, np.cos(0.1 * xs), atol=0.3)
+
+
+def test_factorization_cache():
+    cache = FactorizationCache()
+    weights = np.ones((30, 3))
+    weights[5, 2] = 0
+
+    d, e, f = cache.factorize(weights, 10)
+    assert (cache.hits, cache.misses, len(cache)) == (1, 2, 2)
+    cached = cache.factorize(weights, [10, 10, 100])
+    assert (cache.hits, cache.misses, len(cache)) == (3, 3, 3)
+    numpy.testing.assert_array_equal(cached[0][:, :2], d[:, :2])
+
+    cache.max_bytes = 2 * 3 * 30 * 8
+    cache.factorize(weights[:, :1], 1)
+    assert len(cache) == 2
+    assert cache.nbytes <= cache.max_bytes
+
+    cache.clear()
+    assert (cache.hits, cache.misses, len(cache), cache.nbytes) == (0, 0, 0, 0)
+
+
+def test_whittaker_cube_uses_cache(sinusoidal_timeseries):
+    cube = xarray.concat([sinusoidal_timeseries] * 4, dim="x")
+    factorization_cache.clear()
+
+    first = whittaker(cube, smoothing_lambda=1, time_dimension="time")
+    assert (factorization_cache.hits, factorization_cache.misses) == (0, 1)
+    second = whittaker(cube, smoothing_lambda=1, time_dimension="time")
+    assert (factorization_cache.hits, factorization_cache.misses) == (1, 1)
+    numpy.testing.assert_array_equal(first, second)
+
+
+def test_whittaker_optimize_lambda(sinusoidal_timeseries):
+    rng = np.random.default_rng(42)
+    noisy = sinusoidal_timeseries + xarray.DataArray(rng.normal(scale=0.2, size=(3, 32)), dims=["x", "time"])
+    noisy[{"x": 2}] = np.nan
+    llas = np.arange(-1, 4.2, 0.5)
+
+    result = whittaker(noisy, time_dimension="time", optimize_lambda=True, lambda_candidates=llas)
+
+    assert result["smoothed"].dims == noisy.dims
+    assert result["lambda"].dims == ("x",)
+    assert np.isnan(result["smoothed"][{"x": 2}]).all()
+    assert np.isnan(result["lambda"][2])
+
+    days = np.array([(t - noisy.time.values[0]) // np.timedelta64(1, "D") for t in noisy.time.values])
+    for x in range(2):
+        series = noisy[{"x": x}].values
+        y = np.zeros(days[-1] + 1)
+        y[days] = np.nan_to_num(series)
+        w = np.zeros(days[-1] + 1)
+        w[days] = ~np.isnan(series)
+        expected, lopt = ws2doptv(y, w, llas)
+        assert result["lambda"][x] == lopt
+        numpy.testing.assert_allclose(result["smoothed"][{"x": x}], expected[days])
+
+
+def test_whittaker_sparse_grid(sinusoidal_timeseries):
+    daily = whittaker(sinusoidal_timeseries, smoothing_lambda=10, time_dimension="time", prediction_period="P2D")
+    sparse = whittaker(
+        sinusoidal_timeseries, smoothing_lambda=10, time_dimension="time", prediction_period="P2D", sparse_grid=True
+    )
+
+    numpy.testing.assert_array_equal(sparse.time, daily.time)
+    numpy.testing.assert_allclose(sparse, daily, atol=0.05)
+
+    # on a daily grid both modes solve the same system
+    complete = sinusoidal_timeseries.resample(time="1D").mean()
+    numpy.testing.assert_allclose(
+        whittaker(complete, smoothing_lambda=10, time_dimension="time", sparse_grid=True),
+        whittaker(complete, smoothing_lambda=10, time_dimension="time"),
+    )
+
+
+def test_whittaker_sparse_grid_benchmark():
+    rng = np.random.default_rng(42)
+    dates = pd.date_range("2019-01-01", "2021-12-31", freq="5D")
+    values = np.sin(np.arange(len(dates)) * 2 * np.pi / 73) + rng.normal(scale=0.05, size=(64, 64, len(dates)))
+    values[rng.random(values.shape) < 0.6] = np.nan
+    cube = xarray.DataArray(values, dims=["x", "y", "t"], coords=dict(t=dates))
+
+    timings, results = {}, {}
+    for sparse_grid in [False, True]:
+        factorization_cache.clear()
+        start = time.perf_counter()
+        results[sparse_grid] = whittaker(cube, prediction_period="P5D", sparse_grid=sparse_grid)
+        timings[sparse_grid] = time.perf_counter() - start
+
+    logging.info(f"Whittaker 3 years 5-daily, daily grid: {timings[False]:.2f}s, sparse grid: {timings[True]:.2f}s")
+    numpy.testing.assert_array_equal(results[True].t, results[False].t)
+    numpy.testing.assert_allclose(results[True], results[False], atol=0.01)
+    # the sparse grid is about three times faster, only the order is checked to leave room for a loaded machine
+    assert timings[True] < timings[False]
+
+
+def test_whittaker_dask(sinusoidal_timeseries):
+    pytest.importorskip("dask")
+    cube = xarray.concat([sinusoidal_timeseries] * 6, dim="x").transpose("time", "x")
+    chunked = cube.chunk({"time": 8, "x": 2})
+
+    for prediction_period in [None, "P5D"]:
+        expected = whittaker(cube, smoothing_lambda=1, time_dimension="time", prediction_period=prediction_period)
+        result = whittaker(chunked, smoothing_lambda=1, time_dimension="time", prediction_period=prediction_period)
+
+        assert result.chunks is not None
+        assert result.chunks[1] == (2, 2, 2)
+        numpy.testing.assert_array_equal(result.time, expected.time)
+        numpy.testing.assert_allclose(result.compute(), expected)
+
+    result = whittaker(chunked, time_dimension="time", optimize_lambda=True)
+    expected = whittaker(cube, time_dimension="time", optimize_lambda=True)
+    numpy.testing.assert_allclose(result["lambda"].compute(), expected["lambda"])
+
+
+def test_whittaker_robust():
+    rng = np.random.default_rng(0)
+    dates = pd.date_range("2020-01-01", periods=73, freq="5D")
+    truth = 0.4 + 0.3 * np.sin(np.arange(73) * 5 * 2 * np.pi / 365)[:, np.newaxis] + np.zeros((1, 20))
+    observed = truth + rng.normal(0, 0.02, truth.shape)
+    observed[rng.random(observed.shape) < 0.1] -= 0.3
+    observed[rng.random(observed.shape) < 0.2] = np.nan
+    cube = xarray.DataArray(observed, dims=["t", "x"], coords={"t": dates})
+
+    def rmse(result):
+        return float(np.sqrt(((result - truth) ** 2).mean()))
+
+    plain = rmse(whittaker(cube, smoothing_lambda=100))
+    assert rmse(whittaker(cube, smoothing_lambda=100, robust="envelope")) < plain / 2
+    assert rmse(whittaker(cube, smoothing_lambda=100, robust="zscore", robust_threshold=1.5)) < plain
+
+    # without residuals above the threshold, the robust fit is the plain fit
+    numpy.testing.assert_allclose(
+        whittaker(cube, smoothing_lambda=100, robust="zscore", robust_threshold=np.inf),
+        whittaker(cube, smoothing_lambda=100),
+    )
+
+    # a bias of the fit shifts all residuals, only the outlier is discarded
+    values = np.array([[5.0, 5.1, 4.9, 5.0, 5.1, 4.9, 5.0, 7.0, np.nan]])
+    weights = _robust_weights("zscore", values, np.zeros_like(values), threshold=2.0)
+    numpy.testing.assert_array_equal(weights, [[1, 1, 1, 1, 1, 1, 1, 0, 0]])
+
+    result = whittaker(cube, optimize_lambda=True, sparse_grid=True, robust="envelope")
+    assert not np.isnan(result["smoothed"]).any()
+    with pytest.raises(ValueError):
+        whittaker(cube, robust="median")
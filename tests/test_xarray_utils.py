@@ -1,5 +1,10 @@
 from datetime import datetime
 
+import numpy as np
+import xarray
+
+from fusets._xarray_utils import _DateAxis, _extract_date_axis, _extract_dates
+
 
 def test_output_dates():
     from fusets._xarray_utils import _output_dates
@@ -10,3 +15,17 @@ def test_output_dates():
     assert datetime(2023, 3, 15, 0, 0) == result_dates[0]
     assert datetime(2023, 3, 20, 0, 0) == result_dates[1]
     assert datetime(2024, 2, 28, 0, 0) == result_dates[70]
+
+
+def test_date_axis():
+    dates = np.array(["2023-12-30T10:00", "2024-01-01", "2024-03-01T23:59", "2024-12-31"], dtype="datetime64[ns]")
+    array = xarray.DataArray(np.arange(4), dims=["t"], coords=dict(t=dates))
+
+    axis = _extract_date_axis(array)
+    pydates = _extract_dates(array)
+    assert list(axis.ordinals) == [d.toordinal() for d in pydates]
+    assert list(axis.days) == [0, 2, 62, 367]
+    assert list(axis.day_of_year) == [364, 1, 61, 366]
+    assert axis.to_pydatetime() == pydates
+    assert list(axis.offsets(_DateAxis(dates[2:]))) == [62, 367]
+    assert list(_DateAxis.from_ordinals(axis.ordinals).values) == list(dates.astype("datetime64[D]"))